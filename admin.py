@@ -1,7 +1,9 @@
 import logging
 from datetime import datetime, timedelta
-from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify
+from flask import Blueprint, Response, render_template, redirect, url_for, request, flash, jsonify
 from flask_login import login_required, current_user
+from config_snapshot import bump_config_version
+from subscriptions import normalize_vendor
 import logging
 
 # 创建admin蓝图
@@ -31,6 +33,24 @@ def monitor_targets():
         monitor_targets = MonitorTarget.query.all()
     return render_template('admin/monitor_targets.html', monitor_targets=monitor_targets)
 
+# 校验文本检查规则，返回错误信息（无错误时返回None）
+def validate_check_pattern(check_type, check_pattern):
+    if check_type == 'extractor':
+        from extractors import ExtractorSpecError, parse_spec
+        try:
+            parse_spec(check_pattern)
+        except ExtractorSpecError as e:
+            return str(e)
+        return None
+    if check_type != 'text':
+        return None
+    from matcher import RuleSyntaxError, compile_rule
+    try:
+        compile_rule(check_pattern)
+    except RuleSyntaxError as e:
+        return f'文本规则无效: {str(e)}'
+    return None
+
 # 添加监控目标页面
 @admin_bp.route('/add_monitor_target', methods=['GET', 'POST'])
 @login_required
@@ -45,6 +65,13 @@ def add_monitor_target():
         expected_result = request.form.get('expected_result', '')
         interval = int(request.form.get('interval', 300))
         use_flaresolverr = 'use_flaresolverr' in request.form
+        max_bytes = request.form.get('max_bytes', type=int) or None
+        region = request.form.get('region', '').strip() or None
+        
+        pattern_error = validate_check_pattern(check_type, check_pattern)
+        if pattern_error:
+            flash(pattern_error, 'danger')
+            return redirect(url_for('admin.add_monitor_target'))
         
         # 创建新的监控目标
         new_target = MonitorTarget(
@@ -55,12 +82,15 @@ def add_monitor_target():
             expected_result=expected_result,
             interval=interval,
             is_active=True,
-            use_flaresolverr=use_flaresolverr
+            use_flaresolverr=use_flaresolverr,
+            max_bytes=max_bytes,
+            region=region
         )
         
         try:
             with app.app_context():
                 db.session.add(new_target)
+                bump_config_version()
                 db.session.commit()
             logger.info(f"Admin {current_user.username} added new monitor target: {name}")
             flash('监控目标添加成功', 'success')
@@ -85,6 +115,11 @@ def edit_monitor_target(target_id):
         target = MonitorTarget.query.get_or_404(target_id)
         
         if request.method == 'POST':
+            pattern_error = validate_check_pattern(request.form['check_type'], request.form['check_pattern'])
+            if pattern_error:
+                flash(pattern_error, 'danger')
+                return redirect(url_for('admin.edit_monitor_target', target_id=target_id))
+            
             try:
                 target.name = request.form['name']
                 target.url = request.form['url']
@@ -93,8 +128,18 @@ def edit_monitor_target(target_id):
                 target.expected_result = request.form.get('expected_result', '')
                 target.interval = int(request.form.get('interval', 300))
                 target.use_flaresolverr = 'use_flaresolverr' in request.form
+                target.max_bytes = request.form.get('max_bytes', type=int) or None
+                target.region = request.form.get('region', '').strip() or None
+                
+                # 产品子目标与提取器目标共用同一页面
+                for child in target.children:
+                    child.url = target.url
+                    child.region = target.region
+                    child.use_flaresolverr = target.use_flaresolverr
+                    child.max_bytes = target.max_bytes
                 target.updated_at = datetime.utcnow()
                 
+                bump_config_version()
                 db.session.commit()
                 
                 logger.info(f"Admin {current_user.username} updated monitor target: {target.name}")
@@ -117,15 +162,21 @@ def delete_monitor_target(target_id):
     with app.app_context():
         target = MonitorTarget.query.get_or_404(target_id)
         
+        # 提取器目标生成的产品子目标一并删除
+        target_ids = [target_id] + [child.id for child in target.children]
+        
         # 先删除相关的通知设置和状态检查记录
-        NotificationSetting.query.filter_by(monitor_target_id=target_id).delete()
+        NotificationSetting.query.filter(NotificationSetting.monitor_target_id.in_(target_ids)).delete(synchronize_session=False)
         
         # 注意：在实际生产环境中，可能需要保留历史状态检查记录
         # 这里为了简化，我们也删除它们
-        StatusCheck.query.filter_by(monitor_target_id=target_id).delete()
+        StatusCheck.query.filter(StatusCheck.monitor_target_id.in_(target_ids)).delete(synchronize_session=False)
         
         # 删除监控目标
+        for child in target.children:
+            db.session.delete(child)
         db.session.delete(target)
+        bump_config_version()
         db.session.commit()
     
     logger.info(f"Admin {current_user.username} deleted monitor target: {target.name}")
@@ -142,14 +193,93 @@ def toggle_monitor_target(target_id):
         target = MonitorTarget.query.get_or_404(target_id)
         target.is_active = not target.is_active
         target.updated_at = datetime.utcnow()
+        # 提交后离开应用上下文时对象会脱离会话，先记录需要的字段
+        status = "启用" if target.is_active else "禁用"
+        target_name = target.name
         
+        bump_config_version()
         db.session.commit()
     
-    status = "启用" if target.is_active else "禁用"
-    logger.info(f"Admin {current_user.username} {status} monitor target: {target.name}")
+    logger.info(f"Admin {current_user.username} {status} monitor target: {target_name}")
     flash(f'监控目标已{status}', 'success')
     return redirect(url_for('admin.monitor_targets'))
 
+# 批量导出监控目标或通知设置
+@admin_bp.route('/export/<kind>')
+@login_required
+@admin_required
+def export_data(kind):
+    from app import app
+    from bulk import EXPORTERS, serialize_records
+    
+    if kind not in EXPORTERS:
+        flash('不支持的导出类型', 'danger')
+        return redirect(url_for('admin.monitor_targets'))
+    
+    fmt = request.args.get('format', 'json')
+    if fmt not in ('json', 'csv'):
+        fmt = 'json'
+    
+    exporter, fields = EXPORTERS[kind]
+    with app.app_context():
+        output = serialize_records(exporter(), fields, fmt)
+    
+    logger.info(f"Admin {current_user.username} exported {kind} as {fmt}")
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/json'
+    return Response(output, mimetype=f'{mimetype}; charset=utf-8',
+                    headers={'Content-Disposition': f'attachment; filename={kind}.{fmt}'})
+
+# 批量导入监控目标或通知设置（支持上传JSON/CSV文件或直接提交JSON数组）
+@admin_bp.route('/import/<kind>', methods=['POST'])
+@login_required
+@admin_required
+def import_data(kind):
+    from app import app
+    from bulk import EXPORTERS, detect_format, parse_records, import_targets, import_notification_settings
+    
+    if kind not in EXPORTERS:
+        return jsonify({'error': '不支持的导入类型'}), 400
+    
+    dry_run = request.values.get('dry_run') in ('1', 'true', 'on')
+    fetch_sample = request.values.get('fetch_sample') in ('1', 'true', 'on')
+    
+    try:
+        upload = request.files.get('file')
+        if upload and upload.filename:
+            fmt = request.values.get('format') or detect_format(upload.filename)
+            records = parse_records(upload.read(), fmt)
+        elif request.is_json:
+            records = parse_records(request.get_data(), 'json')
+        else:
+            raise ValueError('请选择要导入的文件')
+        
+        with app.app_context():
+            if kind == 'targets':
+                report = import_targets(records, dry_run=dry_run, fetch_sample=fetch_sample)
+            else:
+                report = import_notification_settings(records, current_user.id, dry_run=dry_run)
+    except Exception as e:
+        logger.error(f"Error importing {kind}: {str(e)}")
+        if wants_json() or request.is_json:
+            return jsonify({'error': str(e)}), 400
+        flash(f'导入失败: {str(e)}', 'danger')
+        return redirect(url_for('admin.monitor_targets'))
+    
+    logger.info(f"Admin {current_user.username} imported {kind}: {report['created']} created, "
+                f"{report['duplicates']} duplicates, {len(report['errors'])} errors, dry_run={dry_run}")
+    
+    if wants_json() or request.is_json:
+        return jsonify(report)
+    
+    action = '校验通过' if dry_run else '导入'
+    category = 'warning' if report['errors'] else 'success'
+    message = f"{action} {report['created']} 条，跳过重复 {report['duplicates']} 条，错误 {len(report['errors'])} 条"
+    if report['errors']:
+        message += '；首个错误: 第{row}行 {error}'.format(**report['errors'][0])
+    flash(message, category)
+    redirect_endpoint = 'admin.monitor_targets' if kind == 'targets' else 'admin.notification_settings'
+    return redirect(url_for(redirect_endpoint))
+
 # 通知设置管理页面
 @admin_bp.route('/notification_settings')
 @login_required
@@ -160,18 +290,52 @@ def notification_settings():
     with app.app_context():
         monitor_targets = MonitorTarget.query.all()
         
-        # 获取所有通知设置
-        all_settings = []
-        for target in monitor_targets:
-            settings = NotificationSetting.query.filter_by(monitor_target_id=target.id).all()
-            for setting in settings:
-                setting.monitor_target_name = target.name
-                all_settings.append(setting)
+        # 一次查询所有通知设置，按目标顺序排列，未绑定目标的设置（按条件订阅/全局）排在最后
+        target_order = {target.id: index for index, target in enumerate(monitor_targets)}
+        target_names = {target.id: target.name for target in monitor_targets}
+        all_settings = NotificationSetting.query.all()
+        all_settings = [setting for setting in all_settings
+                        if setting.monitor_target_id is None or setting.monitor_target_id in target_names]
+        all_settings.sort(key=lambda setting: (target_order.get(setting.monitor_target_id, len(target_order)), setting.id))
+        for setting in all_settings:
+            setting.monitor_target_name = target_names.get(setting.monitor_target_id, '全部监控目标')
+            setting.filter_summary = describe_filters(setting)
     
     return render_template('admin/notification_settings.html', 
                           notification_settings=all_settings, 
                           monitor_targets=monitor_targets)
 
+# 读取表单中的订阅条件，返回(字段值, 错误信息)
+def read_subscription_filters(form):
+    filters = {
+        'filter_vendor': normalize_vendor(form.get('filter_vendor')),
+        'filter_keyword': form.get('filter_keyword', '').strip() or None,
+        'filter_region': form.get('filter_region', '').strip() or None,
+        'filter_max_price': None,
+    }
+    max_price = form.get('filter_max_price', '').strip()
+    if max_price:
+        try:
+            filters['filter_max_price'] = float(max_price)
+        except ValueError:
+            return filters, f'价格上限无效: {max_price}'
+        if filters['filter_max_price'] < 0:
+            return filters, '价格上限不能为负数'
+    return filters, None
+
+# 订阅条件的说明文字
+def describe_filters(setting):
+    parts = []
+    if setting.filter_vendor:
+        parts.append(f"供应商: {setting.filter_vendor}")
+    if setting.filter_keyword:
+        parts.append(f"关键词: {setting.filter_keyword}")
+    if setting.filter_region:
+        parts.append(f"地区: {setting.filter_region}")
+    if setting.filter_max_price is not None:
+        parts.append(f"价格 ≤ {setting.filter_max_price:g}")
+    return ', '.join(parts)
+
 # 添加通知设置
 @admin_bp.route('/add_notification_setting', methods=['GET', 'POST'])
 @login_required
@@ -198,17 +362,25 @@ def add_notification_setting():
             elif notification_type == 'webhook':
                 settings['url'] = request.form.get('webhook_url', '')
             
+            filters, filter_error = read_subscription_filters(request.form)
+            if filter_error:
+                flash(filter_error, 'danger')
+                return redirect(url_for('admin.add_notification_setting'))
+            
             # 创建新的通知设置，关联到当前管理员用户
             new_setting = NotificationSetting(
                 monitor_target_id=monitor_target_id if monitor_target_id else None,
                 user_id=current_user.id,
                 notification_type=notification_type,
                 settings=settings,
-                enabled=enabled
+                enabled=enabled,
+                **filters
             )
+            filter_summary = describe_filters(new_setting)
         
             with app.app_context():
                 db.session.add(new_setting)
+                bump_config_version()
                 db.session.commit()
             
             with app.app_context():
@@ -216,7 +388,7 @@ def add_notification_setting():
                     target = MonitorTarget.query.get(monitor_target_id)
                     logger.info(f"Admin {current_user.username} added notification setting for {target.name}")
                 else:
-                    logger.info(f"Admin {current_user.username} added global notification setting")
+                    logger.info(f"Admin {current_user.username} added notification subscription: {filter_summary or 'all targets'}")
             flash('通知设置添加成功', 'success')
             return redirect(url_for('admin.notification_settings'))
         
@@ -246,13 +418,21 @@ def edit_notification_setting(setting_id):
         elif request.form['notification_type'] == 'webhook':
             settings['url'] = request.form.get('webhook_url', '')
         
+        filters, filter_error = read_subscription_filters(request.form)
+        if filter_error:
+            flash(filter_error, 'danger')
+            return redirect(url_for('admin.edit_notification_setting', setting_id=setting_id))
+        
         with app.app_context():
             setting = NotificationSetting.query.get_or_404(setting_id)
             setting.monitor_target_id = request.form['monitor_target_id'] if request.form['monitor_target_id'] else None
             setting.notification_type = request.form['notification_type']
             setting.enabled = 'enabled' in request.form
             setting.settings = settings
+            for field, value in filters.items():
+                setattr(setting, field, value)
             
+            bump_config_version()
             db.session.commit()
             
             # 处理日志记录，考虑到可能没有特定监控目标
@@ -260,7 +440,7 @@ def edit_notification_setting(setting_id):
                 target = MonitorTarget.query.get(setting.monitor_target_id)
                 logger.info(f"Admin {current_user.username} updated notification setting for {target.name}")
             else:
-                logger.info(f"Admin {current_user.username} updated global notification setting")
+                logger.info(f"Admin {current_user.username} updated notification subscription: {describe_filters(setting) or 'all targets'}")
         flash('通知设置更新成功', 'success')
         return redirect(url_for('admin.notification_settings'))
         
@@ -278,6 +458,7 @@ def delete_notification_setting(setting_id):
         setting = NotificationSetting.query.get_or_404(setting_id)
         
         db.session.delete(setting)
+        bump_config_version()
         db.session.commit()
         
         # 处理日志记录，考虑到可能没有特定监控目标
@@ -289,75 +470,280 @@ def delete_notification_setting(setting_id):
     flash('通知设置删除成功', 'success')
     return redirect(url_for('admin.notification_settings'))
 
-# 执行立即检查
+# 判断请求方是否期望JSON响应（例如前端通过fetch轮询任务状态）
+def wants_json():
+    if request.args.get('format') == 'json':
+        return True
+    return request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'application/json'
+
+# 检查任务提交后的响应：JSON请求返回任务ID和状态查询地址，页面请求则重定向回来源页面
+def job_submitted_response(job):
+    if wants_json():
+        return jsonify({
+            'job_id': job.id,
+            'status_url': url_for('admin.job_status', job_id=job.id),
+            'total': len(job.target_ids),
+            'joined': sorted(job.joined)
+        }), 202
+    
+    flash(f'检查任务已提交，共 {len(job.target_ids)} 个目标（任务ID: {job.id}）', 'success')
+    
+    # 重定向回来源页面，如果没有来源页面则回退到dashboard
+    referrer = request.headers.get('Referer')
+    if referrer and '/statistics' in referrer:
+        return redirect(url_for('admin.statistics'))
+    if referrer and '/monitor_targets' in referrer:
+        return redirect(url_for('admin.monitor_targets'))
+    return redirect(url_for('dashboard'))
+
+# 执行立即检查（提交后台任务，不阻塞当前请求）
 @admin_bp.route('/check_now/<int:target_id>')
 @login_required
 @admin_required
 def check_now(target_id):
-    from app import app, MonitorTarget, db, StatusCheck
-    from monitor import check_stock_status, send_notification, NotificationSetting
-    import time
+    from app import app, MonitorTarget
+    from jobs import submit_job
     
-    try:
-        with app.app_context():
-            # 获取目标并确保它在当前会话中
-            target = MonitorTarget.query.get_or_404(target_id)
-            
-            logger.info(f"Admin {current_user.username} manually checking {target.name}")
-            
+    with app.app_context():
+        target = MonitorTarget.query.get_or_404(target_id)
+        target_name = target.name
+    
+    job = submit_job([target_id], submitted_by=current_user.username)
+    logger.info(f"Admin {current_user.username} submitted manual check for {target_name} (job {job.id})")
+    return job_submitted_response(job)
+
+# 批量立即检查：检查全部或选中的监控目标
+@admin_bp.route('/check_targets', methods=['POST'])
+@login_required
+@admin_required
+def check_targets():
+    from app import app, MonitorTarget
+    from jobs import submit_job
+    
+    payload = request.get_json(silent=True) or {}
+    scope = payload.get('scope') or request.form.get('scope', 'selected')
+    
+    with app.app_context():
+        if scope == 'all':
+            target_ids = [row.id for row in MonitorTarget.query.with_entities(MonitorTarget.id).filter_by(is_active=True).all()]
+        else:
+            raw_ids = payload.get('target_ids') or request.form.getlist('target_ids')
             try:
-                # 只检查指定的目标，而不是所有目标
-                is_available, message, response_time = check_stock_status(target)
-                
-                # 创建状态检查记录
-                status_check = StatusCheck(
-                    monitor_target_id=target.id,
-                    is_available=is_available,
-                    response_time=response_time,
-                    message=message
-                )
-                db.session.add(status_check)
-                
-                # 检查是否需要发送通知（状态变化时）
-                notification_settings = NotificationSetting.query.filter_by(
-                    monitor_target_id=target.id,
-                    enabled=True
-                ).all()
-                
-                if notification_settings:
-                    # 获取上一次的状态检查结果
-                    previous_check = StatusCheck.query.filter_by(
-                        monitor_target_id=target.id
-                    ).order_by(StatusCheck.timestamp.desc()).offset(1).first()
-                    
-                    # 如果是第一次检查或者状态发生变化，则发送通知
-                    if not previous_check or previous_check.is_available != is_available:
-                        logger.info(f"Status changed for {target.name}, sending notifications")
-                        for notification_setting in notification_settings:
-                            # 确保在同一个会话中使用这些对象
-                            notification_setting = db.session.merge(notification_setting)
-                            send_notification(notification_setting, target, status_check)
-                
-                db.session.commit()
-                
-                logger.info(f"Admin {current_user.username} manually checked {target.name}")
-                flash('已立即执行检查', 'success')
-                
-            except Exception as check_error:
-                # 发生错误时回滚会话
-                db.session.rollback()
-                logger.error(f"Check error for {target.name}: {str(check_error)}")
-                flash(f'检查过程中出错: {str(check_error)}', 'danger')
-                
+                requested_ids = {int(target_id) for target_id in raw_ids}
+            except (TypeError, ValueError):
+                requested_ids = set()
+            target_ids = [row.id for row in MonitorTarget.query.with_entities(MonitorTarget.id).filter(MonitorTarget.id.in_(requested_ids)).all()] if requested_ids else []
+    
+    if not target_ids:
+        if wants_json():
+            return jsonify({'error': '没有可检查的监控目标'}), 400
+        flash('请先选择要检查的监控目标', 'warning')
+        return redirect(url_for('admin.monitor_targets'))
+    
+    job = submit_job(target_ids, submitted_by=current_user.username)
+    logger.info(f"Admin {current_user.username} submitted bulk check for {len(target_ids)} target(s) (job {job.id})")
+    return job_submitted_response(job)
+
+# 查询检查任务状态
+@admin_bp.route('/jobs/<job_id>')
+@login_required
+@admin_required
+def job_status(job_id):
+    from jobs import get_job
+    
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify(job.to_dict())
+
+# 通知投递状态页面
+@admin_bp.route('/outbox')
+@login_required
+@admin_required
+def outbox():
+    from app import MonitorTarget, NotificationOutbox
+    from outbox import OUTBOX_STATUSES, outbox_counts
+    
+    status = request.args.get('status', '')
+    query = NotificationOutbox.query
+    if status in OUTBOX_STATUSES:
+        query = query.filter_by(status=status)
+    entries = query.order_by(NotificationOutbox.id.desc()).limit(200).all()
+    
+    target_ids = {entry.monitor_target_id for entry in entries}
+    target_names = dict(MonitorTarget.query.with_entities(MonitorTarget.id, MonitorTarget.name)
+                        .filter(MonitorTarget.id.in_(target_ids)).all()) if target_ids else {}
+    
+    return render_template('admin/outbox.html', entries=entries, counts=outbox_counts(),
+                           status=status, statuses=OUTBOX_STATUSES, target_names=target_names)
+
+# 重新投递失败的通知（不指定ID时重新投递所有失败的通知）
+@admin_bp.route('/outbox/retry', defaults={'entry_id': None})
+@admin_bp.route('/outbox/retry/<int:entry_id>')
+@login_required
+@admin_required
+def retry_outbox(entry_id):
+    from outbox import requeue_dead
+    
+    try:
+        count = requeue_dead(entry_id)
+        flash(f'已重新投递 {count} 条通知', 'success')
     except Exception as e:
-        logger.error(f"Error manually checking target {target_id}: {str(e)}")
-        flash(f'检查执行失败: {str(e)}', 'danger')
+        logger.error(f"Error requeueing notifications: {str(e)}")
+        flash(f'重新投递失败: {str(e)}', 'danger')
+    return redirect(url_for('admin.outbox', status='dead'))
+
+# 查询出站代理池状态
+@admin_bp.route('/proxies')
+@login_required
+@admin_required
+def proxy_status():
+    from proxies import get_proxy_pool
     
-    # 重定向回来源页面，如果没有来源页面则回退到dashboard
-    referrer = request.headers.get('Referer')
-    if referrer and '/statistics' in referrer:
-        return redirect(url_for('admin.statistics'))
-    return redirect(url_for('dashboard'))
+    return jsonify(get_proxy_pool().to_dict())
+
+# 查询各主机的抓取方式统计（对冲抓取）
+@admin_bp.route('/fetch_routes')
+@login_required
+@admin_required
+def fetch_routes():
+    from hedging import FETCH_HEDGING, get_hedge_router
+    
+    return jsonify({'hedging': FETCH_HEDGING, 'hosts': get_hedge_router().to_dict()})
+
+# 查询日志管道的统计（队列长度、丢弃和限流省略的日志数量）
+@admin_bp.route('/logging_status')
+@login_required
+@admin_required
+def logging_status():
+    from logging_config import logging_stats
+    
+    return jsonify(logging_stats())
+
+# 查询页面快照存储的统计
+@admin_bp.route('/snapshots')
+@login_required
+@admin_required
+def snapshot_status():
+    from app import app
+    from snapshots import snapshot_stats
+
+    with app.app_context():
+        return jsonify(snapshot_stats())
+
+# 用已保存的页面快照测试检查规则（不请求供应商网站），表单字段与编辑监控目标相同，未提供时使用目标当前的规则
+@admin_bp.route('/test_rule/<int:target_id>', methods=['POST'])
+@login_required
+@admin_required
+def test_rule(target_id):
+    from app import app, db, MonitorTarget
+    from snapshots import candidate_target, evaluate_snapshots
+
+    with app.app_context():
+        target = db.session.get(MonitorTarget, target_id)
+        if target is None:
+            return jsonify({'error': '监控目标不存在'}), 404
+        check_type = request.form.get('check_type') or target.check_type
+        check_pattern = request.form.get('check_pattern', target.check_pattern)
+        pattern_error = validate_check_pattern(check_type, check_pattern)
+        if pattern_error:
+            return jsonify({'error': pattern_error}), 400
+        candidate = candidate_target(target, check_type, check_pattern, request.form.get('expected_result'))
+        results = evaluate_snapshots(target, candidate, request.form.get('limit', type=int))
+        db.session.commit()
+
+    return jsonify({
+        'target_id': target_id,
+        'snapshots': len(results),
+        'available': sum(1 for result in results if result['is_available']),
+        'changed': sum(1 for result in results if result['changed']),
+        'results': results
+    })
+
+# 解析搜索参数；搜索页面的时间输入框为北京时间，接口的时间为UTC（或带时区的ISO 8601）
+def search_params(beijing=False):
+    from history_api import ApiError, parse_time
+    from search_index import SEARCH_MAX_PAGE_SIZE, SEARCH_PAGE_SIZE
+    
+    def time_param(name):
+        value = request.args.get(name, '').strip()
+        if value and beijing:
+            value += '+08:00'
+        return parse_time(value, name)
+    
+    try:
+        limit = min(max(int(request.args.get('limit') or SEARCH_PAGE_SIZE), 1), SEARCH_MAX_PAGE_SIZE)
+        target_id = int(request.args['target']) if request.args.get('target') else None
+    except ValueError:
+        raise ApiError('limit 和 target 必须是整数')
+    return {
+        'query': request.args.get('q', '').strip(),
+        'kind': request.args.get('kind') or None,
+        'level': request.args.get('level') or None,
+        'target_id': target_id,
+        'since': time_param('since'),
+        'until': time_param('until'),
+        'before': request.args.get('before') or None,
+        'limit': limit
+    }
+
+# 执行搜索并补充监控目标名称
+def run_search(params):
+    from app import MonitorTarget
+    from search_index import search
+    
+    items, next_cursor = search(**params)
+    target_ids = {item['target_id'] for item in items if item['target_id'] is not None}
+    target_names = dict(MonitorTarget.query.with_entities(MonitorTarget.id, MonitorTarget.name)
+                        .filter(MonitorTarget.id.in_(target_ids)).all()) if target_ids else {}
+    for item in items:
+        item['target'] = target_names.get(item['target_id'])
+    return items, next_cursor
+
+# 全文搜索检查结果和日志
+@admin_bp.route('/search')
+@login_required
+@admin_required
+def search_page():
+    from history_api import ApiError
+    from search_index import KINDS, LEVELS
+    
+    items, next_cursor, error = [], None, None
+    try:
+        items, next_cursor = run_search(search_params(beijing=True))
+    except ApiError as e:
+        error = str(e)
+    except Exception as e:
+        logger.error(f"Error searching index: {str(e)}")
+        error = f'搜索失败: {str(e)}'
+    for item in items:
+        item['timestamp'] = datetime.strptime(item['time'], '%Y-%m-%dT%H:%M:%SZ')
+    args = request.args.to_dict()
+    args.pop('before', None)
+    return render_template('admin/search.html', items=items, next_cursor=next_cursor, error=error,
+                           args=args, kinds=KINDS, levels=LEVELS)
+
+# 全文搜索接口，返回JSON，下一页使用 before=next
+@admin_bp.route('/api/search')
+@login_required
+@admin_required
+def search_api():
+    from history_api import ApiError
+    
+    try:
+        items, next_cursor = run_search(search_params())
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'items': items, 'next': next_cursor})
+
+# 查询全文搜索索引的统计
+@admin_bp.route('/search_status')
+@login_required
+@admin_required
+def search_status():
+    from search_index import index_stats
+    
+    return jsonify(index_stats())
 
 # 监控日志页面
 @admin_bp.route('/logs')
@@ -366,19 +752,31 @@ def check_now(target_id):
 def logs():
     # 从请求参数中获取limit，如果没有则使用默认值500
     limit = request.args.get('limit', 500, type=int)
+    import json
     import re
     from datetime import datetime
+    from logging_config import LOG_FILE
     
     try:
-        with open('logs/app.log', 'r', encoding='utf-8') as f:
-            log_lines = f.readlines()
+        # 日志文件按大小轮转，刚轮转后行数不够时再读取上一个文件
+        log_lines = []
+        for path in (LOG_FILE, f"{LOG_FILE}.1"):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    lines = f.readlines()
+            except FileNotFoundError:
+                if path != LOG_FILE:
+                    break
+                raise
+            lines.reverse()
+            log_lines.extend(lines)
+            if len(log_lines) >= min(limit, 500):
+                break
         
-        # 反转日志，显示最新的在前
-        log_lines.reverse()
-        # 限制显示的日志行数，最多500行
+        # 限制显示的日志行数（最新的在前），最多500行
         log_lines = log_lines[:min(limit, 500)]  
         
-        # 解析日志行并创建结构化的日志对象
+        # 解析日志行并创建结构化的日志对象（文本格式和 LOG_FORMAT=json 格式）
         log_items = []
         log_pattern = r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}) - (.*?) - (\w+) - (.*)$'
         
@@ -386,6 +784,30 @@ def logs():
             line = line.strip()
             if not line:  # 跳过空行
                 continue
+            
+            entry = None
+            if line.startswith('{'):
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    entry = None
+            if isinstance(entry, dict) and 'message' in entry:
+                message = entry['message']
+                if entry.get('suppressed'):
+                    message = f"{message} (省略了{entry['suppressed']}条相似日志)"
+                if entry.get('exception'):
+                    message = f"{message}\n{entry['exception']}"
+                try:
+                    timestamp = datetime.strptime(entry.get('time', ''), '%Y-%m-%d %H:%M:%S,%f')
+                except ValueError:
+                    timestamp = datetime.now()
+                log_items.append({
+                    'timestamp': timestamp,
+                    'source': entry.get('logger', 'system'),
+                    'level': entry.get('level', 'INFO').lower(),
+                    'message': message
+                })
+                continue
                 
             match = re.match(log_pattern, line)
             if match:
@@ -428,7 +850,9 @@ def logs():
 @admin_required
 def statistics():
     from datetime import datetime, timedelta
-    from app import app, MonitorTarget, NotificationSetting, StatusCheck
+    from sqlalchemy.orm import joinedload
+    from app import app, MonitorTarget, NotificationSetting
+    from status_history import failure_reasons, transitions, uptime_summary
     
     # 初始化变量
     total_monitors = 0
@@ -445,13 +869,19 @@ def statistics():
         # 获取通知设置数量
         total_notifications = NotificationSetting.query.count()
         
-        # 获取平均响应时间（如果有数据的话）
-        recent_checks = StatusCheck.query.order_by(StatusCheck.timestamp.desc()).limit(100).all()
-        if recent_checks:
-            avg_response_time = sum(check.response_time for check in recent_checks if check.response_time) / len([check for check in recent_checks if check.response_time])
+        # 过去24小时的可用率、响应时间和状态变化（状态区间和逐条记录都按检查次数统计）
+        since = datetime.utcnow() - timedelta(hours=24)
+        summaries = uptime_summary(since)
+        total_checks = sum(summary['checks'] for summary in summaries.values())
+        if total_checks:
+            avg_response_time = sum(summary['avg_response_time'] * summary['checks'] for summary in summaries.values()) / total_checks
+        recent_transitions = transitions(limit=20)
+        # 按结果代码分组的失败原因
+        reasons = failure_reasons(since)
         
-        # 获取监控目标列表
-        monitor_targets = MonitorTarget.query.all()
+        # 获取监控目标列表，最新状态随目标一次查询预加载
+        monitor_targets = MonitorTarget.query.options(joinedload(MonitorTarget.latest_status)).all()
+        target_names = {target.id: target.name for target in monitor_targets}
     
     # 构建库存状态分布数据
     stock_status_data = {
@@ -493,23 +923,24 @@ def statistics():
         # 真实数据处理
         sample_colors = ['#28a745', '#007bff', '#dc3545', '#ffc107', '#17a2b8']
         for i, target in enumerate(monitor_targets):
-            with app.app_context():
-                # 获取最新状态
-                latest_status = StatusCheck.query.filter_by(monitor_target_id=target.id).order_by(StatusCheck.timestamp.desc()).first()
+            # 获取最新状态
+            latest_status = target.latest_status
             
             # 获取历史响应时间（示例数据）
             response_times = [round(100 + (i+1)*50 + j*10) for j in range(12)]
             
-            # 计算成功率（示例数据）
-            success_rate = 95 + i*2 if i < 4 else 95
+            # 过去24小时按检查次数计算的有库存比例和按时间计算的可用率
+            summary = summaries.get(target.id, {})
             
             monitor_stats.append({
                 'name': target.name,
                 'url': target.url,
                 'status': 'available' if latest_status and latest_status.is_available else 'unavailable',
                 'latest_response_time': latest_status.response_time if latest_status and latest_status.response_time else 0,
-                'last_checked': latest_status.timestamp.strftime('%Y-%m-%d %H:%M:%S') if latest_status else '从未检查',
-                'success_rate': success_rate,
+                'last_checked': latest_status.checked_at.strftime('%Y-%m-%d %H:%M:%S') if latest_status else '从未检查',
+                'success_rate': summary.get('success_rate', 0),
+                'uptime': summary.get('uptime'),
+                'transitions': summary.get('transitions', 0),
                 'response_times': response_times,
                 'color': sample_colors[i % len(sample_colors)]
             })
@@ -530,6 +961,9 @@ def statistics():
                           avg_response_time=avg_response_time,
                           stock_status_data=stock_status_data,
                           monitor_stats=monitor_stats,
+                          recent_transitions=recent_transitions,
+                          reasons=reasons,
+                          target_names=target_names,
                           time_labels=time_labels)
 
 
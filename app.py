@@ -1,22 +1,14 @@
 import os
-import logging
 import sqlite3
+import threading
+import time
 from flask import Flask, jsonify, render_template, redirect, url_for, request, flash
 from flask_sqlalchemy import SQLAlchemy
+from logging_config import setup_logging
 
 # 配置日志
-def setup_logging():
-    logging.basicConfig(
-        level=logging.DEBUG,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler("logs/app.log"),
-            logging.StreamHandler()
-        ]
-    )
-    return logging.getLogger(__name__)
-
-logger = setup_logging()
+# 异步写入、按大小轮转、按模板限流，见 logging_config.py
+logger = setup_logging(__name__)
 logger.info("Starting simplified app")
 
 # 创建Flask应用
@@ -24,7 +16,8 @@ app = Flask(__name__)
 app.config['SECRET_KEY'] = 'dev-secret-key'
 
 # 使用绝对路径的数据库URL，确保在Docker容器中正确配置
-DATABASE_PATH = '/app/instance/database.db'
+# 可通过DATABASE_PATH环境变量覆盖（例如基准测试使用独立的种子数据库）
+DATABASE_PATH = os.environ.get('DATABASE_PATH', '/app/instance/database.db')
 app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{DATABASE_PATH}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
@@ -32,7 +25,7 @@ logger.info(f"Using database URL: {app.config['SQLALCHEMY_DATABASE_URI']}")
 logger.info(f"Current working directory: {os.getcwd()}")
 
 # 确保数据库目录存在
-instance_dir = '/app/instance'
+instance_dir = os.path.dirname(DATABASE_PATH)
 if not os.path.exists(instance_dir):
     try:
         os.makedirs(instance_dir)
@@ -46,21 +39,39 @@ if os.path.exists(instance_dir):
     logger.info(f"Instance directory owner: {os.stat(instance_dir).st_uid}:{os.stat(instance_dir).st_gid}")
 
 # 尝试直接使用sqlite3连接，绕过SQLAlchemy，用于诊断
-logger.info("Attempting direct SQLite connection test...")
-try:
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1")
-    result = cursor.fetchone()
-    conn.close()
-    logger.info(f"Direct SQLite connection successful: {result}")
-except Exception as e:
-    logger.error(f"Direct SQLite connection failed: {str(e)}")
+def check_database_connection():
+    logger.info("Attempting direct SQLite connection test...")
+    try:
+        conn = sqlite3.connect(DATABASE_PATH)
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        result = cursor.fetchone()
+        conn.close()
+        logger.info(f"Direct SQLite connection successful: {result}")
+    except Exception as e:
+        logger.error(f"Direct SQLite connection failed: {str(e)}")
+
+# 快速启动：数据库诊断、建表和首次监控周期在后台线程中执行，Web服务立即开始接受请求
+FAST_START = os.environ.get('FAST_START', '1') != '0'
+# 数据库初始化完成前，普通请求最多等待的秒数（健康检查接口不等待）
+STARTUP_WAIT_SECONDS = float(os.environ.get('STARTUP_WAIT_SECONDS', 30))
+
+# 启动进度，供就绪检查接口使用
+startup_state = {
+    'started_at': time.time(),
+    'db_ready_at': None,
+    'first_cycle_at': None,
+    'error': None
+}
+db_ready = threading.Event()
 
 # 初始化数据库
 db = SQLAlchemy(app)
 
 from datetime import datetime, timedelta
+from urllib.parse import urlsplit
+from sqlalchemy import event
+from sqlalchemy.orm import Session, validates
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from dotenv import load_dotenv
@@ -87,9 +98,9 @@ class User(UserMixin, db.Model):
 
 class MonitorTarget(db.Model):
     id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
+    name = db.Column(db.String(100), nullable=False, index=True)
     url = db.Column(db.String(500), nullable=False)
-    check_type = db.Column(db.String(20), default='text')  # text, selector, api
+    check_type = db.Column(db.String(20), default='text')  # text, selector, api, extractor, product
     check_pattern = db.Column(db.String(500))  # 文本模式、CSS选择器或API路径
     expected_result = db.Column(db.String(500))  # 期望结果
     interval = db.Column(db.Integer, default=300)  # 监控间隔(秒)
@@ -97,16 +108,145 @@ class MonitorTarget(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     use_flaresolverr = db.Column(db.Boolean, default=False)
+    max_bytes = db.Column(db.Integer)  # 单次抓取的最大下载字节数，为空时使用全局默认值
+    parent_id = db.Column(db.Integer, db.ForeignKey('monitor_target.id'), index=True)  # 提取器生成的产品子目标所属的父目标
+    children = db.relationship('MonitorTarget', backref=db.backref('parent', remote_side=[id]), lazy=True)
+    vendor = db.Column(db.String(255), index=True)  # 供应商(URL主机名)，用于仪表盘筛选
+    region = db.Column(db.String(50), index=True)  # 地区（可选），用于按地区订阅通知
+    latest_check_id = db.Column(db.Integer, index=True)  # 最新一次状态检查，避免仪表盘逐个查询
     status_checks = db.relationship('StatusCheck', backref='monitor_target', lazy=True)
     notification_settings = db.relationship('NotificationSetting', backref='monitor_target', lazy=True)
+    latest_status = db.relationship(
+        'StatusCheck',
+        primaryjoin='foreign(MonitorTarget.latest_check_id) == StatusCheck.id',
+        viewonly=True,
+        lazy=True
+    )
+    
+    # 修改URL时同步更新供应商
+    @validates('url')
+    def update_vendor(self, key, url):
+        self.vendor = vendor_from_url(url)
+        return url
+    
+    # 产品子目标所属提取器的配置
+    @property
+    def parent_pattern(self):
+        return self.parent.check_pattern if self.parent is not None else None
+
+# 从URL中提取供应商名称（主机名，去掉www.前缀）
+def vendor_from_url(url):
+    host = (urlsplit(url or '').hostname or '').lower()
+    return host[4:] if host.startswith('www.') else host
 
 class StatusCheck(db.Model):
+    __table_args__ = (
+        # 按目标查询最近的检查记录（上一次状态、历史统计）
+        db.Index('ix_status_check_target_timestamp', 'monitor_target_id', 'timestamp'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     monitor_target_id = db.Column(db.Integer, db.ForeignKey('monitor_target.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     is_available = db.Column(db.Boolean, default=False)
-    response_time = db.Column(db.Float)  # 响应时间(毫秒)
-    message = db.Column(db.Text)  # 状态消息或错误信息
+    response_time = db.Column(db.Float)  # 响应时间(毫秒)，状态区间中为最近一次检查的响应时间
+    message_id = db.Column(db.Integer, db.ForeignKey('status_message.id'), index=True)  # 检查结果消息（结果代码和参数）
+    message_text = db.Column('message', db.Text)  # 旧记录的文本消息，新记录使用message_id
+    # 状态区间（STATUS_STORAGE=runs）：状态不变的检查只更新以下字段，timestamp为状态开始的时间
+    last_checked = db.Column(db.DateTime)  # 区间内最近一次检查的时间，为空时等于timestamp
+    check_count = db.Column(db.Integer, default=1)  # 区间内的检查次数
+    response_time_min = db.Column(db.Float)
+    response_time_max = db.Column(db.Float)
+    response_time_total = db.Column(db.Float)  # 区间内响应时间之和，用于计算平均值
+    
+    # 显示用的消息文本
+    @property
+    def message(self):
+        if self.message_id is not None:
+            from status_messages import get_message
+            message = get_message(self.message_id)
+            if message is not None:
+                return message.render()
+        return self.message_text
+    
+    # 最近一次检查的时间
+    @property
+    def checked_at(self):
+        return self.last_checked or self.timestamp
+    
+    # 把一次状态相同的检查合并到当前区间
+    def extend_run(self, timestamp, response_time):
+        self.check_count = (self.check_count or 1) + 1
+        self.last_checked = timestamp
+        if response_time is not None:
+            # 逐条写入的旧记录没有统计字段，以其响应时间作为初始值
+            values = [value for value in (self.response_time_min, self.response_time_max, self.response_time, response_time)
+                      if value is not None]
+            total = self.response_time_total if self.response_time_total is not None else (self.response_time or 0)
+            self.response_time_min = min(values)
+            self.response_time_max = max(values)
+            self.response_time_total = total + response_time
+            self.response_time = response_time
+
+# 写入状态检查记录时同步更新目标的最新检查记录
+@event.listens_for(StatusCheck, 'after_insert')
+def update_latest_check(mapper, connection, status_check):
+    connection.execute(
+        MonitorTarget.__table__.update()
+        .where(MonitorTarget.__table__.c.id == status_check.monitor_target_id)
+        .values(latest_check_id=status_check.id)
+    )
+
+# 检查结果消息：相同的结果代码和参数只保存一次，状态记录通过message_id引用
+class StatusMessage(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('code', 'params', name='uq_status_message_code_params'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(40), nullable=False, index=True)  # 结果代码，见status_messages.MESSAGE_CODES
+    params = db.Column(db.Text, nullable=False, default='{}')  # 消息参数(规范化的JSON)
+
+# 新写入的检查结果消息在事务提交后才加入进程缓存，回滚时丢弃
+@event.listens_for(Session, 'after_commit')
+def promote_status_messages(session):
+    from status_messages import promote_pending_messages
+    promote_pending_messages(session)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_status_messages(session):
+    from status_messages import discard_pending_messages
+    discard_pending_messages(session)
+
+# 最新状态在事务提交后写入共享内存状态板，供各进程的仪表盘读取
+@event.listens_for(Session, 'after_flush')
+def collect_status_board_updates(session, flush_context):
+    from status_board import collect_updates
+    collect_updates(session)
+
+@event.listens_for(Session, 'after_commit')
+def publish_status_board_updates(session):
+    from status_board import publish_updates
+    publish_updates(session)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_status_board_updates(session):
+    from status_board import discard_updates
+    discard_updates(session)
+
+# 新的状态记录在事务提交后写入全文搜索索引
+@event.listens_for(Session, 'after_flush')
+def collect_search_checks(session, flush_context):
+    from search_index import collect_checks
+    collect_checks(session)
+
+@event.listens_for(Session, 'after_commit')
+def publish_search_checks(session):
+    from search_index import publish_checks
+    publish_checks(session)
+
+@event.listens_for(Session, 'after_rollback')
+def discard_search_checks(session):
+    from search_index import discard_checks
+    discard_checks(session)
 
 class NotificationSetting(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -115,6 +255,68 @@ class NotificationSetting(db.Model):
     notification_type = db.Column(db.String(20), nullable=False)  # telegram, xi_zhi, webhook
     settings = db.Column(db.JSON)  # 存储通知配置(如API密钥、聊天ID等)
     enabled = db.Column(db.Boolean, default=True)
+    # 订阅条件（可选）：未绑定监控目标时按条件匹配，见 subscriptions.py
+    filter_vendor = db.Column(db.String(255))  # 供应商(URL主机名)
+    filter_keyword = db.Column(db.String(100))  # 目标名称包含的关键词
+    filter_region = db.Column(db.String(50))  # 地区
+    filter_max_price = db.Column(db.Float)  # 价格上限
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, index=True)  # 订阅索引据此增量更新
+
+# 通知发件箱：通知与触发它的状态记录在同一事务中写入，由投递任务异步发送并在失败时重试
+class NotificationOutbox(db.Model):
+    __table_args__ = (
+        # 投递任务按状态和下次尝试时间取出待发送的通知
+        db.Index('ix_notification_outbox_status_next', 'status', 'next_attempt_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    idempotency_key = db.Column(db.String(100), nullable=False, unique=True)  # 同一通知重复投递时接收方据此去重
+    notification_setting_id = db.Column(db.Integer, index=True)  # 不设外键：通知设置删除后保留投递记录
+    monitor_target_id = db.Column(db.Integer, index=True)
+    status_check_id = db.Column(db.Integer, db.ForeignKey('status_check.id'))
+    status_check = db.relationship('StatusCheck')
+    notification_type = db.Column(db.String(20), nullable=False)
+    payload = db.Column(db.JSON)  # 通知内容：title、content、data(自定义URL的请求数据)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, delivered, dead
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, default=datetime.utcnow)
+    claim_token = db.Column(db.String(32))  # 取出该通知的投递批次
+    locked_until = db.Column(db.DateTime)  # 投递中的通知超过该时间未完成时（进程退出）重新投递
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    delivered_at = db.Column(db.DateTime)
+
+# 配置版本号：监控目标或通知设置变更时递增，各进程据此判断内存中的配置快照是否过期
+class ConfigVersion(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+# 页面快照：监控周期抓取到的页面内容（按主机共享字典压缩），用于离线测试检查规则，见 snapshots.py
+class PageSnapshot(db.Model):
+    __table_args__ = (
+        # 按页面取最近的快照
+        db.Index('ix_page_snapshot_url_fetched', 'url', 'fetched_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    url = db.Column(db.String(500), nullable=False)
+    monitor_target_id = db.Column(db.Integer, index=True)  # 抓取该页面的监控目标（同一URL的目标共用快照）
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow)
+    last_used_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)  # 超出容量时按此淘汰最久未使用的快照
+    source = db.Column(db.String(20))  # 抓取方式：direct, flaresolverr
+    partial = db.Column(db.Boolean, default=False)  # 流式匹配提前停止下载，只有页面的前一部分
+    digest = db.Column(db.String(40))  # 页面内容的SHA-1，内容不变时不重复保存
+    raw_size = db.Column(db.Integer)  # 压缩前的字节数(UTF-8)
+    size = db.Column(db.Integer)  # 压缩后的字节数
+    dictionary_id = db.Column(db.Integer)
+    body = db.Column(db.LargeBinary)
+
+# 页面快照的压缩字典：同一主机的页面共用一个字典
+class SnapshotDictionary(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    host = db.Column(db.String(255), nullable=False, unique=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 # 初始化登录管理器
 login_manager = LoginManager()
@@ -126,14 +328,14 @@ login_manager.login_view = 'login'
 def load_user(user_id):
     return User.query.get(int(user_id))
 
+# 将UTC时间转换为北京时间(UTC+8)
+def convert_to_beijing_time(utc_time):
+    beijing_time = utc_time + timedelta(hours=8)
+    return beijing_time.strftime('%Y-%m-%d %H:%M:%S')
+
 # 上下文处理器 - 为模板提供工具函数
 @app.context_processor
 def utility_processor():
-    def convert_to_beijing_time(utc_time):
-        # 将UTC时间转换为北京时间(UTC+8)
-        beijing_time = utc_time + timedelta(hours=8)
-        return beijing_time.strftime('%Y-%m-%d %H:%M:%S')
-    
     return dict(convert_to_beijing_time=convert_to_beijing_time)
 
 # 简单的数据模型，保留用于测试
@@ -141,12 +343,52 @@ class TestModel(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     data = db.Column(db.String(50))
 
+# 为已存在的表补充模型中新增的列和索引（create_all不会修改已有的表）
+def upgrade_schema():
+    from sqlalchemy import inspect
+    
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+            logger.info(f"Added column {table.name}.{column.name}")
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    db.session.commit()
+    backfill_target_summary()
+
+# 为旧数据补齐冗余字段（供应商、最新检查记录、通知设置的修改时间）
+def backfill_target_summary():
+    missing_vendor = MonitorTarget.query.filter(MonitorTarget.vendor.is_(None)).all()
+    for target in missing_vendor:
+        target.vendor = vendor_from_url(target.url)
+    db.session.execute(text(
+        'UPDATE monitor_target SET latest_check_id = ('
+        'SELECT id FROM status_check WHERE status_check.monitor_target_id = monitor_target.id '
+        'ORDER BY timestamp DESC, id DESC LIMIT 1'
+        ') WHERE latest_check_id IS NULL'
+    ))
+    # 订阅索引按 updated_at 增量更新，升级前的通知设置没有修改时间
+    NotificationSetting.query.filter(NotificationSetting.updated_at.is_(None)).update(
+        {'updated_at': datetime.utcnow()}, synchronize_session=False
+    )
+    db.session.commit()
+    if missing_vendor:
+        logger.info(f"Backfilled vendor for {len(missing_vendor)} monitor targets")
+
 # 初始化数据库表
 def init_db():
     try:
         with app.app_context():
             logger.info("Initializing database...")
             db.create_all()
+            upgrade_schema()
             logger.info("Database tables created")
             
             # 创建管理员用户（如果不存在）
@@ -171,10 +413,12 @@ def init_db():
             # 查询测试数据
             count = TestModel.query.count()
             logger.info(f"Found {count} test record(s)")
+        return True
     except Exception as e:
         logger.error(f"Database initialization failed: {str(e)}")
         import traceback
         logger.error(traceback.format_exc())
+        return False
 
 from sqlalchemy import text
 
@@ -198,6 +442,43 @@ def test_db_connection():
             'message': str(e)
         }), 500
 
+# 数据库初始化完成前，除健康检查外的请求先等待，超时返回503
+@app.before_request
+def wait_for_database():
+    if request.endpoint in ('healthz', 'readyz', 'static') or db_ready.is_set():
+        return None
+    if not db_ready.wait(STARTUP_WAIT_SECONDS):
+        response = jsonify({'status': 'starting', 'message': '服务正在启动，请稍后重试'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+    return None
+
+# 存活检查：进程能够处理请求即返回200
+@app.route('/healthz')
+def healthz():
+    return jsonify({'status': 'ok'})
+
+# 就绪检查：数据库初始化完成后返回200，附带启动耗时
+@app.route('/readyz')
+def readyz():
+    started_at = startup_state['started_at']
+    
+    def elapsed_ms(timestamp):
+        return round((timestamp - started_at) * 1000, 1) if timestamp else None
+    
+    ready = db_ready.is_set() and startup_state['error'] is None
+    response = jsonify({
+        'status': 'ready' if ready else ('error' if startup_state['error'] else 'starting'),
+        'fast_start': FAST_START,
+        'db_ready_ms': elapsed_ms(startup_state['db_ready_at']),
+        'first_cycle_ms': elapsed_ms(startup_state['first_cycle_at']),
+        'scheduler_running': scheduler.running,
+        'error': startup_state['error']
+    })
+    response.status_code = 200 if ready else 503
+    return response
+
 # 登录页面
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -231,12 +512,18 @@ def logout():
 # 仪表盘页面
 @app.route('/')
 def dashboard():
-    monitor_targets = MonitorTarget.query.all()
+    from target_listing import parse_listing_args, query_targets, status_counts, vendor_options
     
-    # 对每个监控目标，获取最新的状态检查结果
-    for target in monitor_targets:
-        latest_status = StatusCheck.query.filter_by(monitor_target_id=target.id).order_by(StatusCheck.timestamp.desc()).first()
-        target.latest_status = latest_status
+    # 服务端分页、筛选和排序，最新状态随目标一次查询预加载
+    filters = parse_listing_args(request.args)
+    view = 'list' if request.args.get('view') == 'list' else 'cards'
+    monitor_targets, total = [], 0
+    if view == 'cards':
+        monitor_targets, total = query_targets(**filters)
+    counts = status_counts(filters['vendor'])
+    if view == 'list':
+        total = counts[filters['status']]
+    pages = max((total + filters['per_page'] - 1) // filters['per_page'], 1)
     
     # 公共页面，非管理员访问
     is_admin = False
@@ -244,7 +531,123 @@ def dashboard():
     if current_user.is_authenticated:
         is_admin = current_user.is_admin
         
-    return render_template('dashboard.html', monitor_targets=monitor_targets, is_admin=is_admin)
+    return render_template(
+        'dashboard.html',
+        monitor_targets=monitor_targets,
+        is_admin=is_admin,
+        filters=filters,
+        view=view,
+        total=total,
+        pages=pages,
+        counts=counts,
+        vendors=vendor_options()
+    )
+
+# 仪表盘目标列表的JSON接口，供虚拟滚动列表按页加载
+@app.route('/api/dashboard/targets')
+def dashboard_targets_api():
+    from target_listing import parse_listing_args, query_targets, target_summary
+    
+    filters = parse_listing_args(request.args, default_per_page=100)
+    targets, total = query_targets(**filters)
+    return jsonify({
+        'items': [target_summary(target, convert_to_beijing_time) for target in targets],
+        'total': total,
+        'page': filters['page'],
+        'per_page': filters['per_page'],
+        'pages': max((total + filters['per_page'] - 1) // filters['per_page'], 1)
+    })
+
+# 单个目标的状态历史：过去N小时的可用率和状态变化，可选查询某一时刻(?at=ISO时间)的状态
+@app.route('/api/dashboard/targets/<int:target_id>/history')
+def dashboard_target_history_api(target_id):
+    from status_history import status_at, transitions, uptime_summary
+    
+    target = db.session.get(MonitorTarget, target_id)
+    if target is None:
+        return jsonify({'error': '监控目标不存在'}), 404
+    hours = min(max(request.args.get('hours', 24, type=int), 1), 24 * 90)
+    since = datetime.utcnow() - timedelta(hours=hours)
+    result = {
+        'id': target.id,
+        'name': target.name,
+        'hours': hours,
+        'summary': uptime_summary(since, target_ids=[target.id]).get(target.id),
+        'transitions': [
+            {'timestamp': convert_to_beijing_time(item.timestamp), 'is_available': item.is_available, 'message': item.message}
+            for item in transitions(target.id, since, limit=min(max(request.args.get('limit', 50, type=int), 1), 500))
+        ]
+    }
+    if request.args.get('at'):
+        try:
+            # 参数为北京时间
+            when = datetime.fromisoformat(request.args['at']) - timedelta(hours=8)
+        except ValueError:
+            return jsonify({'error': '时间格式无效'}), 400
+        check = status_at(target.id, when)
+        result['status_at'] = None if check is None else {
+            'is_available': check.is_available,
+            'message': check.message,
+            'since': convert_to_beijing_time(check.timestamp),
+        }
+    return jsonify(result)
+
+# 带ETag的JSON响应，客户端数据未变化时返回304
+def conditional_json(payload):
+    response = jsonify(payload)
+    response.add_etag()
+    return response.make_conditional(request)
+
+# 监控目标列表（键集分页，见history_api）
+@app.route('/api/targets')
+def api_targets():
+    from history_api import ApiError, TARGET_FIELDS, list_targets, parse_fields, parse_limit
+
+    try:
+        items, next_cursor = list_targets(
+            after=request.args.get('after'),
+            limit=parse_limit(request.args.get('limit')),
+            vendor=(request.args.get('vendor') or '').strip().lower(),
+            fields=parse_fields(request.args.get('fields'), TARGET_FIELDS)
+        )
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
+    return conditional_json({'items': items, 'next': next_cursor})
+
+# 单个目标的状态记录（键集分页），format=ndjson 时流式导出全部记录
+@app.route('/api/targets/<int:target_id>/checks')
+def api_target_checks(target_id):
+    from flask import Response, g, stream_with_context
+    from history_api import (ApiError, CHECK_FIELDS, NDJSON_MIMETYPE, export_checks, list_checks,
+                             parse_fields, parse_limit, parse_time)
+
+    if db.session.get(MonitorTarget, target_id) is None:
+        return jsonify({'error': '监控目标不存在'}), 404
+    try:
+        options = {
+            'after': request.args.get('after'),
+            'since': parse_time(request.args.get('since'), 'since'),
+            'until': parse_time(request.args.get('until'), 'until'),
+            'descending': request.args.get('order') == 'desc',
+            'fields': parse_fields(request.args.get('fields'), CHECK_FIELDS),
+        }
+        stream = (request.args.get('format') == 'ndjson'
+                  or request.accept_mimetypes.best == NDJSON_MIMETYPE)
+        if not stream:
+            items, next_cursor = list_checks(target_id, limit=parse_limit(request.args.get('limit')), **options)
+            return conditional_json({'items': items, 'next': next_cursor})
+        # 先取第一批，游标无效时仍能返回400
+        chunks = export_checks(target_id, **options)
+        first = next(chunks, '')
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
+    # 导出的查询次数与记录数量成正比，不计入请求的查询预算
+    g.query_budget_exempt = True
+
+    def generate():
+        yield first
+        yield from chunks
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
 
 # 修改密码页面
 @app.route('/change_password', methods=['GET', 'POST'])
@@ -281,22 +684,88 @@ def init_scheduler():
         def monitor_stock_status_wrapper():
             try:
                 from monitor import monitor_stock_status
+                from query_budget import track_job
                 logger.info("Executing scheduled stock monitoring...")
-                monitor_stock_status()
+                with track_job('monitor_stock_status'):
+                    monitor_stock_status(due_only=True)
                 logger.info("Scheduled stock monitoring completed")
+                save_runtime_state()
+                # 立即投递本周期产生的通知，不必等到下一次轮询
+                outbox_job = scheduler.get_job('notification_outbox_job')
+                if outbox_job is not None:
+                    outbox_job.modify(next_run_time=datetime.now())
             except ImportError:
                 logger.warning("Monitor module not found, skipping stock monitoring")
             except Exception as e:
                 logger.error(f"Error in stock monitoring: {str(e)}")
+            finally:
+                if startup_state['first_cycle_at'] is None:
+                    startup_state['first_cycle_at'] = time.time()
         
-        # 添加定时任务，每300秒执行一次库存检查
+        # 保存运行时状态检查点（目标的下次到期时间、对冲抓取和代理统计），见runtime_state
+        def save_runtime_state():
+            try:
+                from runtime_state import save_checkpoint
+                save_checkpoint()
+            except Exception as e:
+                logger.warning(f"Failed to save runtime state checkpoint: {str(e)}")
+        
+        # 恢复上次运行的状态：第一个周期安排在最早到期的目标到期时，而不是重新检查所有目标
+        # 同步启动（FAST_START=0）时第一个周期在下面直接执行，定时任务从一个间隔后开始
+        first_run_time = None
+        try:
+            from config_snapshot import get_config_snapshot
+            from runtime_state import RUNTIME_STATE_INTERVAL, get_target_schedule, register_checkpoint_on_exit, restore_runtime_state
+            with app.app_context():
+                targets = get_config_snapshot().targets
+                restore_runtime_state(targets)
+            if FAST_START:
+                first_run_time = datetime.fromtimestamp(get_target_schedule().first_due(targets, time.time()))
+            scheduler.add_job(
+                func=save_runtime_state,
+                trigger=IntervalTrigger(seconds=RUNTIME_STATE_INTERVAL),
+                id='runtime_state_job',
+                name='Runtime state checkpoint',
+                replace_existing=True,
+                misfire_grace_time=60
+            )
+            register_checkpoint_on_exit()
+        except Exception as e:
+            logger.warning(f"Failed to restore runtime state, checking all targets: {str(e)}")
+            # 没有到期时间的目标都视为到期，立即开始第一个周期
+            if FAST_START:
+                first_run_time = datetime.now()
+        
+        # 添加定时任务，每300秒执行一次库存检查，只检查按监控间隔到期的目标
+        # 快速启动时首次检查由调度器在后台执行，而不是阻塞启动流程；
+        # 没有指定首次运行时间时不传 next_run_time（传入None会使任务处于暂停状态），任务在一个间隔后首次运行
+        job_options = {'next_run_time': first_run_time} if first_run_time is not None else {}
         scheduler.add_job(
             func=monitor_stock_status_wrapper,
             trigger=IntervalTrigger(seconds=300),
             id='stock_monitoring_job',
             name='Periodic stock monitoring',
             replace_existing=True,
-            misfire_grace_time=60  # 允许任务错过后60秒内执行
+            misfire_grace_time=60,  # 允许任务错过后60秒内执行
+            **job_options
+        )
+        
+        # 通知发件箱投递任务，与监控周期相互独立
+        def deliver_outbox_wrapper():
+            try:
+                from outbox import deliver_outbox
+                deliver_outbox()
+            except Exception as e:
+                logger.error(f"Error delivering notifications: {str(e)}")
+        
+        from outbox import OUTBOX_POLL_SECONDS
+        scheduler.add_job(
+            func=deliver_outbox_wrapper,
+            trigger=IntervalTrigger(seconds=OUTBOX_POLL_SECONDS),
+            id='notification_outbox_job',
+            name='Notification outbox delivery',
+            replace_existing=True,
+            misfire_grace_time=60
         )
         
         # 启动调度器
@@ -306,18 +775,54 @@ def init_scheduler():
         logger.info(f"Scheduler running: {scheduler.running}")
         logger.info(f"Scheduled jobs: {len(scheduler.get_jobs())}")
         # 立即执行一次检查，确保功能正常
-        monitor_stock_status_wrapper()
+        if not FAST_START:
+            monitor_stock_status_wrapper()
     except Exception as e:
         logger.error(f"Failed to initialize scheduler: {str(e)}")
 
+# 启动任务：数据库诊断与初始化、启动定时任务
+def run_startup_tasks():
+    check_database_connection()
+    if init_db():
+        startup_state['db_ready_at'] = time.time()
+        logger.info(f"Database ready in {(startup_state['db_ready_at'] - startup_state['started_at']) * 1000:.0f}ms")
+    else:
+        startup_state['error'] = 'Database initialization failed'
+    db_ready.set()
+    
+    # 基准测试等场景需要自行控制监控周期，可通过ENABLE_SCHEDULER=0关闭定时任务
+    if os.environ.get('ENABLE_SCHEDULER', '1') != '0':
+        # 运行监控的进程负责根据数据库重建状态板
+        try:
+            from status_board import rebuild_board
+            with app.app_context():
+                rebuild_board()
+        except Exception as e:
+            logger.warning(f"Failed to rebuild status board, dashboard will query the database: {str(e)}")
+        try:
+            init_scheduler()  # 启动定时任务
+        except Exception:
+            logger.warning("Failed to initialize scheduler, continuing without it")
+    else:
+        logger.info("Scheduler disabled by ENABLE_SCHEDULER=0")
+
 # 应用启动时的初始化
 def init_app():
-    init_db()
+    if FAST_START:
+        threading.Thread(target=run_startup_tasks, name='startup', daemon=True).start()
+    else:
+        run_startup_tasks()
     
+    # 状态记录和日志写入全文搜索索引，见search_index
     try:
-        init_scheduler()  # 启动定时任务
-    except Exception:
-        logger.warning("Failed to initialize scheduler, continuing without it")
+        from search_index import start_search_index
+        start_search_index()
+    except Exception as e:
+        logger.warning(f"Failed to start search index, search is unavailable: {str(e)}")
+    
+    # 按请求统计SQL查询数量和耗时，超出预算时记录警告
+    from query_budget import init_query_budget
+    init_query_budget(app)
     
     try:
         from admin import register_blueprint as register_admin_blueprint
@@ -372,7 +877,9 @@ def create_app():
     return app
 
 # 为gunicorn提供一个默认的应用对象
-application = create_app()
+# 直接运行 app.py 时，页面解析进程（spawn）会以 __mp_main__ 的名称重新导入本模块，此时不创建应用
+if __name__ != '__mp_main__':
+    application = create_app()
 
 # 直接运行时使用
 if __name__ == '__main__':
@@ -0,0 +1,109 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+# 页面查询数量回归检查
+#
+# 在种子数据库上请求主要页面，用 query_budget.assert_max_queries 断言每个页面的
+# 查询数量不超过 query_budgets.json 中的预算。页面会在两种目标数量下各请求一次，
+# 查询数量随目标数量增长（N+1查询）时同样视为失败。
+#
+# 用法示例：
+#   python benchmarks/queries.py --budgets benchmarks/query_budgets.json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='页面SQL查询数量回归检查')
+    parser.add_argument('--small', type=int, default=10, help='第一轮的监控目标数量')
+    parser.add_argument('--large', type=int, default=200, help='第二轮的监控目标数量')
+    parser.add_argument('--budgets', default=os.path.join(BENCH_DIR, 'query_budgets.json'), help='各页面的查询数量预算')
+    parser.add_argument('--workdir', help='工作目录（默认使用临时目录）')
+    args = parser.parse_args(argv)
+    args.budgets = os.path.abspath(args.budgets)
+    return args
+
+
+def add_rows(count, start):
+    from app import app, db, User, NotificationSetting
+    from seed import build_target_rows, build_history_rows
+    from app import MonitorTarget, StatusCheck, backfill_target_summary
+
+    with app.app_context():
+        rows = build_target_rows('http://127.0.0.1:9', count, seed=start)
+        for index, row in enumerate(rows):
+            row['name'] = f'Query Target {start + index}'
+        db.session.execute(MonitorTarget.__table__.insert(), rows)
+        db.session.commit()
+        target_ids = [row[0] for row in db.session.query(MonitorTarget.id).filter(MonitorTarget.id > start).all()]
+        db.session.execute(StatusCheck.__table__.insert(), build_history_rows(target_ids, count * 3))
+        admin = User.query.filter_by(is_admin=True).first()
+        for target_id in target_ids:
+            db.session.add(NotificationSetting(monitor_target_id=target_id, user_id=admin.id,
+                                               notification_type='webhook', settings={'url': 'http://127.0.0.1:9'}))
+        db.session.commit()
+        backfill_target_summary()
+
+
+def measure(client, paths):
+    from query_budget import track_queries
+
+    counts = {}
+    for path in paths:
+        with track_queries(path) as stats:
+            response = client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} returned {response.status_code}')
+        counts[path] = stats.count
+    return counts
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sys.path.insert(0, REPO_ROOT)
+    sys.path.insert(0, BENCH_DIR)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='vps-queries-')
+    os.makedirs(os.path.join(workdir, 'logs'), exist_ok=True)
+    os.chdir(workdir)
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'instance', 'queries.db')
+    os.environ['ENABLE_SCHEDULER'] = '0'
+    os.environ['FAST_START'] = '0'
+
+    import logging
+    from app import app
+    logging.getLogger().setLevel(logging.WARNING)
+
+    with open(args.budgets, 'r', encoding='utf-8') as f:
+        budgets = json.load(f)
+
+    client = app.test_client()
+    response = client.post('/login', data={
+        'username': os.environ.get('ADMIN_USERNAME', 'admin'),
+        'password': os.environ.get('ADMIN_PASSWORD', 'admin123'),
+    })
+    if response.status_code != 302:
+        raise RuntimeError('管理员登录失败')
+
+    add_rows(args.small, 0)
+    small = measure(client, budgets)
+    add_rows(args.large - args.small, args.small)
+    large = measure(client, budgets)
+
+    violations = []
+    for path, budget in budgets.items():
+        if large[path] > budget:
+            violations.append(f'{path}: {large[path]} queries > budget {budget}')
+        if large[path] > small[path]:
+            violations.append(f'{path}: queries grew from {small[path]} to {large[path]} with more targets')
+
+    print(json.dumps({'small': small, 'large': large, 'violations': violations}, ensure_ascii=False, indent=2))
+    return 1 if violations else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
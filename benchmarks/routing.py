@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from collections import namedtuple
+
+# 通知订阅匹配回归检查
+#
+# 生成大量按供应商、关键词、地区、价格上限订阅的通知设置（不需要数据库），
+# 分别用订阅索引和逐个校验所有设置的线性扫描匹配同一组状态变化事件，
+# 检查两者结果一致，并且订阅数量增加时索引额外校验的候选设置（取出但不匹配的设置）
+# 不随订阅数量线性增长。同时记录修改1%的设置后增量更新索引的耗时。
+#
+# 用法示例：
+#   python benchmarks/routing.py --small 1000 --large 50000
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EventTarget = namedtuple('EventTarget', ['id', 'name', 'vendor', 'region'])
+
+REGIONS = ('us', 'eu', 'cn', 'jp', 'uk', 'au')
+WORDS = ('rtx', 'ryzen', 'switch', 'iphone', 'pixel', 'steam deck', 'ps5', 'xbox', 'macbook', 'kindle')
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='通知订阅匹配回归检查')
+    parser.add_argument('--small', type=int, default=1000, help='第一轮的订阅数量')
+    parser.add_argument('--large', type=int, default=50000, help='第二轮的订阅数量')
+    parser.add_argument('--events', type=int, default=2000, help='每轮匹配的事件数量')
+    parser.add_argument('--max-growth', type=float, default=0.2,
+                        help='每个事件额外校验的候选设置数量的增长倍数与订阅数量增长倍数之比的上限')
+    parser.add_argument('--output', help='结果JSON的保存路径')
+    return parser.parse_args(argv)
+
+
+def build_settings(count, rng):
+    from config_snapshot import SettingConfig
+
+    settings = []
+    for setting_id in range(1, count + 1):
+        kind = rng.random()
+        filters = {'filter_vendor': None, 'filter_keyword': None, 'filter_region': None, 'filter_max_price': None}
+        target_id = None
+        if kind < 0.3:
+            target_id = rng.randint(1, count)
+        elif kind < 0.55:
+            filters['filter_vendor'] = f'shop{rng.randint(1, count // 10 + 1)}.example.com'
+        elif kind < 0.75:
+            filters['filter_keyword'] = f'{rng.choice(WORDS)} {rng.randint(1, count // 20 + 1)}'
+        elif kind < 0.9:
+            filters['filter_region'] = rng.choice(REGIONS)
+            filters['filter_max_price'] = float(rng.randint(50, 2000))
+        else:
+            filters['filter_max_price'] = float(rng.randint(1, 20))
+        settings.append(SettingConfig(setting_id, target_id, 1, 'webhook', {}, True, **filters))
+    return settings
+
+
+def build_events(count, subscriptions, rng):
+    from subscriptions import SubscriptionEvent
+
+    events = []
+    for index in range(count):
+        target = EventTarget(
+            rng.randint(1, subscriptions),
+            f'Shop - {rng.choice(WORDS).upper()} {rng.randint(1, subscriptions // 20 + 1)} Edition',
+            f'shop{rng.randint(1, subscriptions // 10 + 1)}.example.com',
+            rng.choice(REGIONS)
+        )
+        price = float(rng.randint(1, 3000)) if rng.random() < 0.5 else None
+        events.append(SubscriptionEvent(target, rng.random() < 0.7, True, price))
+    return events
+
+
+def run_round(count, events_count, seed):
+    from subscriptions import SubscriptionIndex, setting_matches
+
+    rng = random.Random(seed)
+    settings = build_settings(count, rng)
+    events = build_events(events_count, count, rng)
+
+    started = time.perf_counter()
+    index = SubscriptionIndex(settings)
+    build_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    indexed = [[setting.id for setting in index.match(event)] for event in events]
+    indexed_seconds = time.perf_counter() - started
+
+    candidates = sum(len(index.candidates(event, event.target.name.lower())) for event in events)
+
+    changed = [setting._replace(filter_max_price=float(rng.randint(1, 3000))) for setting in rng.sample(settings, count // 100)]
+    started = time.perf_counter()
+    index.update(changed)
+    update_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    linear = [[setting.id for setting in settings if setting_matches(setting, event)] for event in events]
+    linear_seconds = time.perf_counter() - started
+
+    return {
+        'subscriptions': count,
+        'events': events_count,
+        'build_ms': round(build_seconds * 1000, 1),
+        'update_ms': round(update_seconds * 1000, 1),
+        'indexed_us_per_event': round(indexed_seconds / events_count * 1e6, 1),
+        'linear_us_per_event': round(linear_seconds / events_count * 1e6, 1),
+        'notifications': sum(len(ids) for ids in indexed),
+        'wasted_candidates_per_event': round((candidates - sum(len(ids) for ids in indexed)) / events_count, 2),
+        'consistent': indexed == linear,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sys.path.insert(0, REPO_ROOT)
+
+    small = run_round(args.small, args.events, seed=1)
+    large = run_round(args.large, args.events, seed=2)
+    for result in (small, large):
+        print(f"{result['subscriptions']:>7} subscriptions: index {result['indexed_us_per_event']}us/event, "
+              f"linear {result['linear_us_per_event']}us/event, build {result['build_ms']}ms, "
+              f"update 1% {result['update_ms']}ms, {result['notifications']} notifications, "
+              f"{result['wasted_candidates_per_event']} wasted candidates/event")
+
+    failures = []
+    for result in (small, large):
+        if not result['consistent']:
+            failures.append(f"{result['subscriptions']} subscriptions: index and linear scan results differ")
+    growth = large['wasted_candidates_per_event'] / max(small['wasted_candidates_per_event'], 1.0)
+    limit = args.large / args.small * args.max_growth
+    if growth > limit:
+        failures.append(f'wasted candidates per event grew {growth:.1f}x for {args.large / args.small:.0f}x '
+                        f'subscriptions (limit {limit:.1f}x)')
+
+    report = {'rounds': [small, large], 'growth': round(growth, 2), 'failures': failures}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for failure in failures:
+        print(f'FAIL: {failure}')
+    if not failures:
+        print('OK')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# 监控周期基准测试
+#
+# 启动本地桩服务器（供应商页面、JSON接口、FlareSolverr），在临时目录中
+# 生成种子数据库，然后多次执行 monitor_stock_status() 并输出机器可读的结果：
+#   - throughput_checks_per_sec  每秒完成的检查数
+#   - latency_p50/p95/p99_ms     单次检查耗时（来自各次检查结果的response_time）
+#   - status_rows_inserted       新写入的状态记录数（STATUS_STORAGE=runs 时只有状态变化才写入）
+#   - peak_rss_mb / peak_heap_mb 进程峰值内存 / Python堆峰值（--tracemalloc）
+#   - db_writes_per_sec          每秒写入的数据库行数（INSERT/UPDATE/DELETE）
+#
+# 用法示例：
+#   python benchmarks/run.py --targets 200 --history 20000 --cycles 3 \
+#       --output bench.json --thresholds benchmarks/thresholds.json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='VPS库存监控周期基准测试')
+    parser.add_argument('--targets', type=int, default=100, help='种子监控目标数量')
+    parser.add_argument('--history', type=int, default=10000, help='种子历史状态记录数量')
+    parser.add_argument('--cycles', type=int, default=3, help='执行的监控周期数')
+    parser.add_argument('--latency-ms', type=float, default=20, help='桩服务器响应延迟')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='桩服务器错误率')
+    parser.add_argument('--size-kb', type=int, default=200, help='供应商页面大小')
+    parser.add_argument('--solve-latency-ms', type=float, default=200, help='模拟FlareSolverr求解耗时')
+    parser.add_argument('--flaresolverr-ratio', type=float, default=0.1, help='使用FlareSolverr的页面目标比例')
+    parser.add_argument('--challenge', action='store_true', help='桩服务器对直接请求的供应商页面返回Cloudflare验证页面')
+    parser.add_argument('--no-hedging', action='store_true', help='关闭对冲抓取，按use_flaresolverr选择抓取方式')
+    parser.add_argument('--eval-processes', help='页面解析进程数（auto/0/N，默认使用环境变量EVAL_PROCESSES）')
+    parser.add_argument('--log-level', default='WARNING', help='基准测试期间的日志级别（INFO可测量日志管道的开销）')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--gzip', action='store_true', help='桩服务器对支持gzip的客户端压缩响应')
+    parser.add_argument('--proxies', type=int, default=0, help='启动的桩代理数量（0表示直接连接）')
+    parser.add_argument('--bad-proxies', type=int, default=0, help='其中总是返回502的桩代理数量，用于验证自动剔除')
+    parser.add_argument('--proxy-rate-limit', type=float, default=0.0, help='桩代理返回429限流的概率')
+    parser.add_argument('--tracemalloc', action='store_true', help='记录Python堆峰值（会显著降低吞吐量）')
+    parser.add_argument('--workdir', help='工作目录（默认使用临时目录）')
+    parser.add_argument('--output', help='结果JSON输出文件（默认输出到标准输出）')
+    parser.add_argument('--thresholds', help='阈值JSON文件，不满足时以非零状态码退出')
+    args = parser.parse_args(argv)
+    # 运行时会切换到工作目录，先把相对路径转换为绝对路径
+    for name in ('output', 'thresholds', 'workdir'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    return args
+
+
+# 检查结果是否满足阈值，返回违规列表
+def check_thresholds(results, thresholds):
+    violations = []
+    for metric, limits in thresholds.items():
+        value = results.get(metric)
+        if value is None:
+            violations.append(f'{metric}: missing from results')
+            continue
+        if 'min' in limits and value < limits['min']:
+            violations.append(f'{metric}: {value} < min {limits["min"]}')
+        if 'max' in limits and value > limits['max']:
+            violations.append(f'{metric}: {value} > max {limits["max"]}')
+    return violations
+
+
+def run_benchmark(args):
+    sys.path.insert(0, REPO_ROOT)
+    sys.path.insert(0, BENCH_DIR)
+    from stub_server import StubConfig, StubProxyConfig, start_stub_server, start_stub_proxy
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='vps-bench-')
+    os.makedirs(os.path.join(workdir, 'logs'), exist_ok=True)
+    os.chdir(workdir)
+
+    stub_config = StubConfig(args.latency_ms, args.error_rate, args.size_kb, args.solve_latency_ms, args.seed, args.gzip,
+                             args.challenge)
+    server, base_url = start_stub_server(stub_config)
+
+    # 桩代理：前 --bad-proxies 个总是失败，其余按 --proxy-rate-limit 概率限流
+    proxy_servers = []
+    for index in range(args.proxies):
+        error_rate = 1.0 if index < args.bad_proxies else 0.0
+        proxy_config = StubProxyConfig(error_rate=error_rate, rate_limit_rate=args.proxy_rate_limit, seed=args.seed + index)
+        proxy_servers.append(start_stub_proxy(proxy_config))
+    if proxy_servers:
+        os.environ['PROXY_POOL'] = ','.join(url for _, url in proxy_servers)
+
+    # app模块在导入时读取这些环境变量，必须在导入之前设置
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'instance', 'bench.db')
+    os.environ['ENABLE_SCHEDULER'] = '0'
+    os.environ['FAST_START'] = '0'
+    os.environ['FLARESOLVERR_URL'] = f'{base_url}/v1'
+    if args.no_hedging:
+        os.environ['FETCH_HEDGING'] = '0'
+    if args.eval_processes is not None:
+        os.environ['EVAL_PROCESSES'] = args.eval_processes
+
+    import logging
+    from sqlalchemy import event
+
+    from seed import seed_database
+    from app import app, db, StatusCheck
+    from monitor import monitor_stock_status, fetch_stats, cycle_stats
+    from proxies import get_proxy_pool
+    from hedging import get_hedge_router
+    from evaluation import get_evaluation_pool
+    from logging_config import logging_stats
+
+    # 基准测试期间默认降低日志级别，避免日志I/O干扰测量
+    logging.getLogger().setLevel(args.log_level.upper())
+
+    seed_start = time.perf_counter()
+    target_count, history_count = seed_database(
+        base_url, args.targets, args.history, args.flaresolverr_ratio, args.size_kb, args.seed
+    )
+    seed_seconds = time.perf_counter() - seed_start
+
+    # 统计写入的行数
+    write_counter = {'rows': 0, 'statements': 0}
+
+    with app.app_context():
+        engine = db.engine
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def count_writes(conn, cursor, statement, parameters, context, executemany):
+            verb = statement.lstrip()[:6].upper()
+            if verb in ('INSERT', 'UPDATE', 'DELETE'):
+                write_counter['statements'] += 1
+                write_counter['rows'] += len(parameters) if executemany and parameters else 1
+
+        last_id = db.session.query(db.func.max(StatusCheck.id)).scalar() or 0
+
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    cycle_seconds = []
+    cycle_memory = []
+    results = []
+    fetch_totals = {'bytes_read': 0, 'bytes_saved': 0, 'early_stops': 0}
+    for _ in range(args.cycles):
+        start = time.perf_counter()
+        results.extend(monitor_stock_status())
+        cycle_seconds.append(time.perf_counter() - start)
+        # 每个周期开始时统计会被重置，这里累计各周期的结果
+        stats = fetch_stats.to_dict()
+        for key in fetch_totals:
+            fetch_totals[key] += stats[key]
+        cycle_memory.append(cycle_stats.to_dict())
+
+    peak_heap_mb = None
+    if args.tracemalloc:
+        peak_heap_mb = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 2)
+        tracemalloc.stop()
+
+    with app.app_context():
+        status_rows = db.session.query(db.func.count(StatusCheck.id)).filter(StatusCheck.id > last_id).scalar()
+    latencies = [result['response_time'] for result in results if result['response_time'] is not None]
+    available = sum(1 for result in results if result['is_available'])
+
+    total_seconds = sum(cycle_seconds)
+    checks = len(results)
+    server.shutdown()
+    for proxy, _ in proxy_servers:
+        proxy.shutdown()
+
+    return {
+        'targets': target_count,
+        'history_rows': history_count,
+        'cycles': args.cycles,
+        'seed_seconds': round(seed_seconds, 3),
+        'cycle_seconds': [round(s, 3) for s in cycle_seconds],
+        'checks': checks,
+        'available_checks': available,
+        'throughput_checks_per_sec': round(checks / total_seconds, 2) if total_seconds else 0.0,
+        'latency_p50_ms': round(percentile(latencies, 50), 2),
+        'latency_p95_ms': round(percentile(latencies, 95), 2),
+        'latency_p99_ms': round(percentile(latencies, 99), 2),
+        # Linux上ru_maxrss单位为KB
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 2),
+        'peak_heap_mb': peak_heap_mb,
+        # 各周期的分块提交和常驻内存，目标数量增加时周期结束时的内存应基本不变
+        'cycle_memory': cycle_memory,
+        'status_rows_inserted': status_rows,
+        'db_write_rows': write_counter['rows'],
+        'db_write_statements': write_counter['statements'],
+        'db_writes_per_sec': round(write_counter['rows'] / total_seconds, 2) if total_seconds else 0.0,
+        'fetch_bytes_read': fetch_totals['bytes_read'],
+        'fetch_bytes_saved': fetch_totals['bytes_saved'],
+        'fetch_early_stops': fetch_totals['early_stops'],
+        'stub_requests': stub_config.requests,
+        'stub_solver_requests': stub_config.solver_requests,
+        'fetch_routes': get_hedge_router().to_dict(),
+        'evaluation_pool': get_evaluation_pool().to_dict() if get_evaluation_pool() else None,
+        'proxy_requests': [proxy.config.requests for proxy, _ in proxy_servers],
+        'proxy_max_in_flight': [proxy.config.max_in_flight for proxy, _ in proxy_servers],
+        'proxy_pool': get_proxy_pool().to_dict()['proxies'] if proxy_servers else [],
+        'stub_bytes_sent': stub_config.bytes_sent,
+        'logging': logging_stats(),
+        'config': {
+            'latency_ms': args.latency_ms,
+            'error_rate': args.error_rate,
+            'size_kb': args.size_kb,
+            'solve_latency_ms': args.solve_latency_ms,
+            'flaresolverr_ratio': args.flaresolverr_ratio,
+            'seed': args.seed,
+            'gzip': args.gzip,
+            'proxies': args.proxies,
+            'bad_proxies': args.bad_proxies,
+            'proxy_rate_limit': args.proxy_rate_limit,
+            'challenge': args.challenge,
+            'hedging': not args.no_hedging,
+            'eval_processes': os.environ.get('EVAL_PROCESSES', 'auto'),
+            'log_level': args.log_level.upper(),
+        },
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_benchmark(args)
+
+    exit_code = 0
+    if args.thresholds:
+        with open(args.thresholds, 'r', encoding='utf-8') as f:
+            thresholds = json.load(f)
+        violations = check_thresholds(results, thresholds)
+        results['threshold_violations'] = violations
+        if violations:
+            exit_code = 1
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+import random
+from datetime import datetime, timedelta
+
+# 生成基准测试用的种子数据：N个监控目标 + M条历史状态记录
+#
+# 目标类型按比例混合（文本/选择器/API），部分目标走FlareSolverr，
+# 所有URL都指向本地桩服务器，保证结果可复现。
+
+# 默认的检查类型分布
+DEFAULT_MIX = (('text', 0.5), ('selector', 0.3), ('api', 0.2))
+
+
+def build_target_rows(base_url, count, flaresolverr_ratio=0.1, size_kb=None, mix=DEFAULT_MIX, seed=42):
+    rng = random.Random(seed)
+    size_query = f'?size_kb={size_kb}' if size_kb else ''
+    now = datetime.utcnow()
+    rows = []
+    for i in range(1, count + 1):
+        roll = rng.random()
+        check_type = mix[-1][0]
+        acc = 0.0
+        for name, weight in mix:
+            acc += weight
+            if roll < acc:
+                check_type = name
+                break
+
+        row = {
+            'name': f'Bench Target {i}',
+            'check_type': check_type,
+            'interval': 300,
+            'is_active': True,
+            'created_at': now,
+            'updated_at': now,
+            'use_flaresolverr': False,
+            'max_bytes': None,
+        }
+        if check_type == 'api':
+            row.update(url=f'{base_url}/api/{i}', check_pattern='data.stock.available', expected_result='True')
+        elif check_type == 'selector':
+            row.update(url=f'{base_url}/vendor/{i}{size_query}', check_pattern='.product .stock', expected_result='In Stock')
+            row['use_flaresolverr'] = rng.random() < flaresolverr_ratio
+        else:
+            row.update(url=f'{base_url}/vendor/{i}{size_query}', check_pattern='In Stock', expected_result='')
+            row['use_flaresolverr'] = rng.random() < flaresolverr_ratio
+        rows.append(row)
+    return rows
+
+
+def build_history_rows(target_ids, count, seed=42):
+    rng = random.Random(seed)
+    if not target_ids:
+        return []
+    now = datetime.utcnow()
+    rows = []
+    for i in range(count):
+        target_id = target_ids[i % len(target_ids)]
+        available = target_id % 3 != 0
+        rows.append({
+            'monitor_target_id': target_id,
+            # 历史记录按时间倒序分布，最近的记录离现在最近
+            'timestamp': now - timedelta(seconds=300 * (count - i) // len(target_ids) + 1),
+            'is_available': available,
+            'response_time': round(rng.uniform(20, 800), 2),
+            'message': '找到匹配文本: In Stock' if available else '未找到匹配文本: In Stock',
+        })
+    return rows
+
+
+# 向已初始化的数据库写入种子数据（需要在app模块导入之后调用）
+def seed_database(base_url, targets, history, flaresolverr_ratio=0.1, size_kb=None, seed=42, batch_size=5000):
+    from app import app, db, MonitorTarget, StatusCheck, backfill_target_summary
+
+    with app.app_context():
+        target_rows = build_target_rows(base_url, targets, flaresolverr_ratio, size_kb, seed=seed)
+        for start in range(0, len(target_rows), batch_size):
+            db.session.execute(MonitorTarget.__table__.insert(), target_rows[start:start + batch_size])
+        db.session.commit()
+
+        target_ids = [row[0] for row in db.session.query(MonitorTarget.id).order_by(MonitorTarget.id).all()]
+        history_rows = build_history_rows(target_ids, history, seed=seed)
+        for start in range(0, len(history_rows), batch_size):
+            db.session.execute(StatusCheck.__table__.insert(), history_rows[start:start + batch_size])
+        db.session.commit()
+        backfill_target_summary()
+
+    return len(target_rows), len(history_rows)
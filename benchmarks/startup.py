@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+# 冷启动基准测试
+#
+# 在临时目录中生成种子数据库，然后用gunicorn启动应用（与Docker镜像的启动方式一致），
+# 测量从进程启动到以下时间点的耗时：
+#   - first_response_ms  /healthz 首次返回200（进程开始处理请求）
+#   - ready_ms           /readyz 返回200（数据库初始化完成）
+#   - first_page_ms      仪表盘首页首次返回200
+#   - first_cycle_ms     首次监控周期完成（来自 /readyz，快速启动模式下在后台执行）
+#
+# 用法示例：
+#   python benchmarks/startup.py --targets 500 --thresholds benchmarks/startup_thresholds.json
+#   python benchmarks/startup.py --targets 500 --no-fast-start   # 对比旧的同步启动方式
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='VPS库存监控冷启动基准测试')
+    parser.add_argument('--targets', type=int, default=200, help='种子监控目标数量')
+    parser.add_argument('--history', type=int, default=10000, help='种子历史状态记录数量')
+    parser.add_argument('--latency-ms', type=float, default=20, help='桩服务器响应延迟')
+    parser.add_argument('--size-kb', type=int, default=50, help='供应商页面大小')
+    parser.add_argument('--no-fast-start', action='store_true', help='使用FAST_START=0同步启动，用于对比')
+    parser.add_argument('--wait-first-cycle', type=float, default=0, help='等待首次监控周期完成的最长秒数（0表示不等待）')
+    parser.add_argument('--timeout', type=float, default=600, help='等待服务就绪的最长秒数')
+    parser.add_argument('--workdir', help='工作目录（默认使用临时目录）')
+    parser.add_argument('--output', help='结果JSON输出文件（默认输出到标准输出）')
+    parser.add_argument('--thresholds', help='阈值JSON文件，不满足时以非零状态码退出')
+    args = parser.parse_args(argv)
+    for name in ('output', 'thresholds', 'workdir'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+    return args
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# 请求URL，返回(状态码, JSON内容)；连接失败返回(None, None)
+def fetch(url):
+    try:
+        with urllib.request.urlopen(url, timeout=5) as response:
+            body = response.read()
+            status = response.status
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        status = e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return None, None
+    try:
+        return status, json.loads(body)
+    except ValueError:
+        return status, None
+
+
+# 轮询URL直到返回200，返回从start开始的耗时(毫秒)
+def wait_for(url, start, deadline, interval=0.01):
+    while time.perf_counter() < deadline:
+        status, payload = fetch(url)
+        if status == 200:
+            return round((time.perf_counter() - start) * 1000, 1), payload
+        time.sleep(interval)
+    return None, None
+
+
+def seed(args, workdir, base_url):
+    # 在子进程中同步初始化并写入种子数据，避免本进程加载app模块
+    code = (
+        'import sys; sys.path.insert(0, {root!r}); sys.path.insert(0, {bench!r})\n'
+        'from seed import seed_database\n'
+        'seed_database({base!r}, {targets}, {history}, size_kb={size_kb})\n'
+    ).format(root=REPO_ROOT, bench=BENCH_DIR, base=base_url, targets=args.targets,
+             history=args.history, size_kb=args.size_kb)
+    env = dict(os.environ, ENABLE_SCHEDULER='0', FAST_START='0')
+    subprocess.run([sys.executable, '-c', code], cwd=workdir, env=env, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def run_startup(args):
+    sys.path.insert(0, BENCH_DIR)
+    from stub_server import StubConfig, start_stub_server
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='vps-startup-')
+    os.makedirs(os.path.join(workdir, 'logs'), exist_ok=True)
+    server, base_url = start_stub_server(StubConfig(latency_ms=args.latency_ms, size_kb=args.size_kb))
+
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'instance', 'startup.db')
+    os.environ['FLARESOLVERR_URL'] = f'{base_url}/v1'
+    seed(args, workdir, base_url)
+
+    port = free_port()
+    app_url = f'http://127.0.0.1:{port}'
+    env = dict(os.environ, ENABLE_SCHEDULER='1', FAST_START='0' if args.no_fast_start else '1')
+    command = [
+        sys.executable, '-m', 'gunicorn', '--bind', f'127.0.0.1:{port}', '--workers', '1',
+        '--chdir', workdir, '--pythonpath', REPO_ROOT, '--timeout', str(int(args.timeout)), 'app:application'
+    ]
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = start + args.timeout
+        first_response_ms, _ = wait_for(f'{app_url}/healthz', start, deadline)
+        ready_ms, readiness = wait_for(f'{app_url}/readyz', start, deadline)
+        first_page_ms, _ = wait_for(f'{app_url}/', start, deadline)
+
+        first_cycle_ms = readiness.get('first_cycle_ms') if readiness else None
+        if args.wait_first_cycle and first_cycle_ms is None:
+            cycle_deadline = time.perf_counter() + args.wait_first_cycle
+            while time.perf_counter() < cycle_deadline:
+                _, readiness = fetch(f'{app_url}/readyz')
+                if readiness and readiness.get('first_cycle_ms') is not None:
+                    first_cycle_ms = readiness['first_cycle_ms']
+                    break
+                time.sleep(0.1)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+        server.shutdown()
+
+    return {
+        'targets': args.targets,
+        'history_rows': args.history,
+        'fast_start': not args.no_fast_start,
+        'first_response_ms': first_response_ms,
+        'ready_ms': ready_ms,
+        'first_page_ms': first_page_ms,
+        # 应用内部记录的耗时（从模块导入开始计算）
+        'app_db_ready_ms': readiness.get('db_ready_ms') if readiness else None,
+        'first_cycle_ms': first_cycle_ms,
+    }
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = run_startup(args)
+
+    exit_code = 0
+    if args.thresholds:
+        from run import check_thresholds
+        with open(args.thresholds, 'r', encoding='utf-8') as f:
+            thresholds = json.load(f)
+        violations = check_thresholds(results, thresholds)
+        results['threshold_violations'] = violations
+        if violations:
+            exit_code = 1
+
+    output = json.dumps(results, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
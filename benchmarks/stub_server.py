@@ -0,0 +1,330 @@
+import gzip
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+# 本地基准测试用的供应商页面/API桩服务器与FlareSolverr模拟端点
+#
+# 路由说明：
+#   GET  /vendor/<id>   模拟WHMCS风格的产品页面（HTML）
+#   GET  /api/<id>      模拟库存JSON接口，路径 data.stock.available
+#   POST /v1            模拟FlareSolverr的 request.get 命令
+#
+# 每个请求都可以通过查询参数覆盖默认行为：
+#   latency_ms  响应延迟(毫秒)
+#   error_rate  返回500错误的概率(0~1)
+#   size_kb     HTML页面的目标大小(KB)，用内联脚本填充
+#   stock       强制库存状态(1/0)，默认由id决定（id % 3 != 0 为有货）
+#   challenge   1表示直接请求供应商页面时返回Cloudflare验证页面（403），FlareSolverr请求不受影响
+#
+# 启用gzip后，客户端声明支持gzip时响应体会被压缩（Content-Encoding: gzip）
+#
+# start_stub_proxy() 另外启动一个模拟的HTTP正向代理，用于测试代理池（延迟、502错误、429限流）
+
+
+class StubConfig:
+    def __init__(self, latency_ms=20, error_rate=0.0, size_kb=200, solve_latency_ms=200, seed=42, gzip=False,
+                 challenge=False):
+        self.latency_ms = latency_ms
+        # 所有直接请求的供应商页面都返回验证页面（可在运行中切换）
+        self.challenge = challenge
+        self.gzip = gzip
+        self.error_rate = error_rate
+        self.size_kb = size_kb
+        self.solve_latency_ms = solve_latency_ms
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.solver_requests = 0
+        self.bytes_sent = 0
+
+    def roll_error(self, error_rate):
+        with self.lock:
+            return self.random.random() < error_rate
+
+    def record(self, size):
+        with self.lock:
+            self.requests += 1
+            self.bytes_sent += size
+
+
+CHALLENGE_PAGE = (
+    '<!DOCTYPE html><html><head><title>Just a moment...</title></head><body>'
+    '<div id="cf-browser-verification">Checking your browser before accessing the site.</div>'
+    '<script>window._cf_chl_opt={cvId: "3"};</script></body></html>'
+)
+
+
+# 根据id判断是否有库存，保证每次运行结果可复现
+def is_in_stock(item_id, override=None):
+    if override is not None:
+        return override == '1'
+    return item_id % 3 != 0
+
+
+# 生成模拟的供应商产品页面
+def render_vendor_page(item_id, in_stock, size_kb):
+    status_html = (
+        '<span class="stock in-stock">In Stock</span><a class="btn order" href="/cart.php?a=add">Order Now</a>'
+        if in_stock else
+        '<span class="stock out-of-stock">Out of Stock</span>'
+    )
+    head = (
+        '<!DOCTYPE html><html><head><meta charset="utf-8">'
+        f'<title>VPS Plan {item_id}</title></head><body>'
+        '<div id="order-standard_cart"><div class="products">'
+        f'<div class="product" id="product{item_id}">'
+        f'<header><span class="name">VPS Plan {item_id}</span></header>'
+        f'<div class="price">${item_id % 50 + 5}.00 USD</div>'
+        f'<div class="qty">{(item_id % 7) if in_stock else 0} Available</div>'
+        f'{status_html}</div></div></div>'
+    )
+    tail = '</body></html>'
+    # 用内联JS填充页面，模拟真实供应商页面中体积庞大的脚本
+    filler_size = max(0, size_kb * 1024 - len(head) - len(tail))
+    filler_line = 'var _cfg_%d = {"k": "abcdefghijklmnopqrstuvwxyz0123456789"};\n'
+    lines = []
+    total = 0
+    i = 0
+    while total < filler_size:
+        line = filler_line % i
+        lines.append(line)
+        total += len(line)
+        i += 1
+    half = len(lines) // 2
+    leading = '<script>' + ''.join(lines[:half]) + '</script>' if half else ''
+    trailing = '<script>' + ''.join(lines[half:]) + '</script>' if lines[half:] else ''
+    # 库存区块位于页面中部：前面是内联配置脚本，后面是体积庞大的JS包，与真实供应商页面类似
+    return head.replace('<div id="order-standard_cart">', leading + '<div id="order-standard_cart">', 1) + trailing + tail
+
+
+def make_handler(config):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            # 基准测试时不输出访问日志
+            pass
+
+        def _params(self):
+            parsed = urlparse(self.path)
+            query = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+            return parsed.path, query
+
+        def _send(self, status, body, content_type, headers=None):
+            data = body.encode('utf-8') if isinstance(body, str) else body
+            compress = config.gzip and 'gzip' in self.headers.get('Accept-Encoding', '')
+            if compress:
+                data = gzip.compress(data, compresslevel=6)
+            self.send_response(status)
+            self.send_header('Content-Type', content_type)
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            if compress:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            config.record(len(data))
+
+        def _delay_and_fail(self, query, latency_ms):
+            time.sleep(float(query.get('latency_ms', latency_ms)) / 1000.0)
+            error_rate = float(query.get('error_rate', config.error_rate))
+            if config.roll_error(error_rate):
+                self._send(500, 'Internal Server Error', 'text/plain')
+                return True
+            return False
+
+        def do_GET(self):
+            path, query = self._params()
+            parts = path.strip('/').split('/')
+            if len(parts) != 2 or not parts[1].isdigit():
+                self._send(404, 'Not Found', 'text/plain')
+                return
+
+            kind, item_id = parts[0], int(parts[1])
+            if self._delay_and_fail(query, config.latency_ms):
+                return
+
+            in_stock = is_in_stock(item_id, query.get('stock'))
+            if kind == 'vendor' and (config.challenge or query.get('challenge') == '1'):
+                self._send(403, CHALLENGE_PAGE, 'text/html; charset=utf-8', {'Server': 'cloudflare', 'cf-mitigated': 'challenge'})
+            elif kind == 'vendor':
+                size_kb = int(query.get('size_kb', config.size_kb))
+                self._send(200, render_vendor_page(item_id, in_stock, size_kb), 'text/html; charset=utf-8')
+            elif kind == 'api':
+                payload = {'data': {'stock': {'available': in_stock, 'quantity': item_id % 7 if in_stock else 0}}}
+                self._send(200, json.dumps(payload), 'application/json')
+            else:
+                self._send(404, 'Not Found', 'text/plain')
+
+        def do_POST(self):
+            path, query = self._params()
+            length = int(self.headers.get('Content-Length', 0))
+            try:
+                payload = json.loads(self.rfile.read(length) or b'{}')
+            except ValueError:
+                payload = {}
+
+            if path.rstrip('/') != '/v1':
+                self._send(404, 'Not Found', 'text/plain')
+                return
+
+            # 模拟FlareSolverr：浏览器求解耗时 + 目标页面渲染
+            with config.lock:
+                config.solver_requests += 1
+            if self._delay_and_fail(query, config.solve_latency_ms):
+                return
+
+            target = urlparse(payload.get('url', ''))
+            target_query = {k: v[0] for k, v in parse_qs(target.query).items()}
+            target_parts = target.path.strip('/').split('/')
+            if payload.get('cmd') != 'request.get' or len(target_parts) != 2 or not target_parts[1].isdigit():
+                body = {'status': 'error', 'message': 'Unsupported request'}
+            else:
+                item_id = int(target_parts[1])
+                size_kb = int(target_query.get('size_kb', config.size_kb))
+                html = render_vendor_page(item_id, is_in_stock(item_id, target_query.get('stock')), size_kb)
+                body = {
+                    'status': 'ok',
+                    'message': 'Challenge not detected!',
+                    'solution': {
+                        'url': payload.get('url'),
+                        'status': 200,
+                        'response': html,
+                        'cookies': [{'name': 'cf_clearance', 'value': f'stub-{item_id}', 'domain': target.hostname}],
+                        'userAgent': 'Mozilla/5.0 (stub-flaresolverr)',
+                    },
+                }
+            self._send(200, json.dumps(body), 'application/json')
+
+    return StubHandler
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端提前断开（流式抓取提前停止）是正常情况，不打印堆栈
+        import sys
+        if isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            return
+        super().handle_error(request, client_address)
+
+
+# 模拟HTTP正向代理：转发绝对URL形式的GET请求，可注入延迟、错误(502)和限流(429)
+class StubProxyConfig:
+    def __init__(self, latency_ms=0, error_rate=0.0, rate_limit_rate=0.0, seed=42):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.max_in_flight = 0
+        self.in_flight = 0
+
+    def roll(self):
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return self.random.random()
+
+    def done(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+def make_proxy_handler(config):
+    import http.client
+
+    class StubProxyHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status, body=b''):
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            roll = config.roll()
+            try:
+                time.sleep(config.latency_ms / 1000.0)
+                if roll < config.error_rate:
+                    self._reply(502, b'Bad Gateway')
+                    return
+                if roll < config.error_rate + config.rate_limit_rate:
+                    self._reply(429, b'Too Many Requests')
+                    return
+
+                target = urlparse(self.path)
+                headers = {k: v for k, v in self.headers.items()
+                           if k.lower() not in ('proxy-connection', 'proxy-authorization', 'connection', 'host')}
+                conn = http.client.HTTPConnection(target.hostname, target.port or 80, timeout=30)
+                path = target.path + (f'?{target.query}' if target.query else '')
+                conn.request('GET', path, headers=headers)
+                upstream = conn.getresponse()
+                body = upstream.read()
+                self.send_response(upstream.status)
+                for key, value in upstream.getheaders():
+                    if key.lower() not in ('connection', 'transfer-encoding', 'content-length'):
+                        self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                conn.close()
+            finally:
+                config.done()
+
+    return StubProxyHandler
+
+
+# 启动桩代理，返回(server, proxy_url)
+def start_stub_proxy(config=None, host='127.0.0.1', port=0):
+    config = config or StubProxyConfig()
+    server = StubServer((host, port), make_proxy_handler(config))
+    server.config = config
+    thread = threading.Thread(target=server.serve_forever, name='stub-proxy', daemon=True)
+    thread.start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+# 在后台线程中启动桩服务器，返回(server, base_url)
+def start_stub_server(config=None, host='127.0.0.1', port=0):
+    config = config or StubConfig()
+    server = StubServer((host, port), make_handler(config))
+    server.config = config
+    thread = threading.Thread(target=server.serve_forever, name='stub-server', daemon=True)
+    thread.start()
+    return server, f'http://{host}:{server.server_address[1]}'
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='启动本地供应商/FlareSolverr桩服务器')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency-ms', type=float, default=20)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--size-kb', type=int, default=200)
+    parser.add_argument('--solve-latency-ms', type=float, default=200)
+    parser.add_argument('--gzip', action='store_true', help='客户端支持时压缩响应')
+    args = parser.parse_args()
+
+    stub_config = StubConfig(args.latency_ms, args.error_rate, args.size_kb, args.solve_latency_ms, gzip=args.gzip)
+    server, base_url = start_stub_server(stub_config, args.host, args.port)
+    print(f"Stub server listening on {base_url} (FlareSolverr endpoint: {base_url}/v1)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
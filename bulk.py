@@ -0,0 +1,421 @@
+import csv
+import io
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 批量插入时每条语句包含的行数
+IMPORT_BATCH_SIZE = 1000
+# 试运行抓取样本页面时的并发数
+SAMPLE_FETCH_WORKERS = int(os.environ.get('SAMPLE_FETCH_WORKERS', 8))
+
+CHECK_TYPES = ('text', 'selector', 'api', 'extractor')
+NOTIFICATION_TYPES = ('telegram', 'xi_zhi', 'webhook')
+
+# 导出/导入的字段
+TARGET_FIELDS = ['name', 'url', 'check_type', 'check_pattern', 'expected_result', 'interval', 'is_active', 'use_flaresolverr', 'max_bytes', 'region']
+SETTING_FIELDS = ['target_url', 'target_check_pattern', 'notification_type', 'settings', 'enabled',
+                  'filter_vendor', 'filter_keyword', 'filter_region', 'filter_max_price']
+FILTER_FIELDS = ('filter_vendor', 'filter_keyword', 'filter_region', 'filter_max_price')
+
+
+# 解析布尔值（兼容CSV中的各种写法）
+def parse_bool(value, default=False):
+    if value is None or value == '':
+        return default
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('1', 'true', 'yes', 'y', 'on', '是')
+
+
+# 根据文件名推断格式
+def detect_format(filename, default='json'):
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    if filename and filename.lower().endswith('.json'):
+        return 'json'
+    return default
+
+
+# 把上传的文本解析为记录列表
+def parse_records(data, fmt):
+    if isinstance(data, bytes):
+        data = data.decode('utf-8-sig')
+    if fmt == 'csv':
+        return list(csv.DictReader(io.StringIO(data)))
+    records = json.loads(data or '[]')
+    if isinstance(records, dict):
+        # 兼容 {"items": [...]} 形式
+        records = records.get('items', [])
+    if not isinstance(records, list):
+        raise ValueError('JSON数据必须是数组')
+    return records
+
+
+# 把记录列表序列化为JSON或CSV文本
+def serialize_records(records, fields, fmt):
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+        writer.writeheader()
+        for record in records:
+            row = dict(record)
+            if isinstance(row.get('settings'), dict):
+                row['settings'] = json.dumps(row['settings'], ensure_ascii=False)
+            writer.writerow(row)
+        return buffer.getvalue()
+    return json.dumps(records, ensure_ascii=False, indent=2)
+
+
+# 校验并规范化一条监控目标记录，返回(row, error)
+def validate_target_record(record):
+    name = (record.get('name') or '').strip()
+    url = (record.get('url') or '').strip()
+    check_type = (record.get('check_type') or 'text').strip()
+    check_pattern = (record.get('check_pattern') or '').strip()
+
+    if not name:
+        return None, '名称不能为空'
+    if len(name) > 100:
+        return None, '名称长度不能超过100'
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.netloc:
+        return None, f'URL无效: {url}'
+    if len(url) > 500:
+        return None, 'URL长度不能超过500'
+    if check_type not in CHECK_TYPES:
+        return None, f'检查类型无效: {check_type}'
+    if not check_pattern:
+        return None, '检查模式不能为空'
+    if len(check_pattern) > 500:
+        return None, '检查模式长度不能超过500'
+
+    try:
+        interval = int(record.get('interval') or 300)
+    except (TypeError, ValueError):
+        return None, f'监控间隔无效: {record.get("interval")}'
+    if interval <= 0:
+        return None, '监控间隔必须为正整数'
+
+    try:
+        max_bytes = int(record.get('max_bytes') or 0) or None
+    except (TypeError, ValueError):
+        return None, f'最大下载字节数无效: {record.get("max_bytes")}'
+
+    region = (record.get('region') or '').strip() or None
+    if region and len(region) > 50:
+        return None, '地区长度不能超过50'
+
+    return {
+        'name': name,
+        'url': url,
+        'check_type': check_type,
+        'check_pattern': check_pattern,
+        'expected_result': (record.get('expected_result') or '').strip(),
+        'interval': interval,
+        'is_active': parse_bool(record.get('is_active'), True),
+        'use_flaresolverr': parse_bool(record.get('use_flaresolverr'), False),
+        'max_bytes': max_bytes,
+        'region': region,
+    }, None
+
+
+# 预编译检查规则，返回错误信息（无错误时返回None）
+def compile_rule(row):
+    if row['check_type'] == 'text':
+        from matcher import RuleSyntaxError, compile_rule as compile_text_rule
+        try:
+            compile_text_rule(row['check_pattern'])
+        except RuleSyntaxError as e:
+            return f'文本规则无效: {str(e)}'
+    elif row['check_type'] == 'selector':
+        try:
+            import soupsieve
+            soupsieve.compile(row['check_pattern'])
+        except Exception as e:
+            return f'CSS选择器无效: {str(e)}'
+    elif row['check_type'] == 'extractor':
+        from extractors import ExtractorSpecError, parse_spec
+        try:
+            parse_spec(row['check_pattern'])
+        except ExtractorSpecError as e:
+            return str(e)
+    elif row['check_type'] == 'api':
+        if any(not part for part in row['check_pattern'].split('.')):
+            return f'API路径无效: {row["check_pattern"]}'
+    return None
+
+
+# 抓取样本页面并用规则试运行，返回每个索引对应的检查结果
+def evaluate_samples(rows):
+    from app import MonitorTarget
+    from monitor import check_stock_status
+
+    def evaluate(row):
+        # 使用未加入会话的临时对象，不会写入数据库
+        target = MonitorTarget(**row)
+        is_available, message, response_time = check_stock_status(target)
+        return {'is_available': is_available, 'message': message.render(), 'response_time': round(response_time, 2)}
+
+    with ThreadPoolExecutor(max_workers=SAMPLE_FETCH_WORKERS) as executor:
+        return list(executor.map(evaluate, rows))
+
+
+# 导出所有监控目标
+def export_targets():
+    from app import MonitorTarget
+
+    # 提取器生成的产品子目标会在导入后的首次检查中重新生成，不导出
+    targets = MonitorTarget.query.filter(MonitorTarget.parent_id.is_(None)).order_by(MonitorTarget.id).all()
+    return [{field: getattr(target, field) for field in TARGET_FIELDS} for target in targets]
+
+
+# 导出所有通知设置（通过URL+检查模式关联监控目标，方便跨实例迁移）
+def export_notification_settings():
+    from app import MonitorTarget, NotificationSetting
+
+    targets = {target.id: target for target in MonitorTarget.query.all()}
+    records = []
+    for setting in NotificationSetting.query.order_by(NotificationSetting.id).all():
+        target = targets.get(setting.monitor_target_id)
+        records.append({
+            'target_url': target.url if target else '',
+            'target_check_pattern': target.check_pattern if target else '',
+            'notification_type': setting.notification_type,
+            'settings': setting.settings or {},
+            'enabled': setting.enabled,
+            'filter_vendor': setting.filter_vendor or '',
+            'filter_keyword': setting.filter_keyword or '',
+            'filter_region': setting.filter_region or '',
+            'filter_max_price': setting.filter_max_price,
+        })
+    return records
+
+
+# 批量导入监控目标：校验、按URL+检查模式去重，并在一个事务中批量插入
+def import_targets(records, dry_run=False, fetch_sample=False):
+    from app import db, MonitorTarget, vendor_from_url
+    from config_snapshot import bump_config_version
+
+    report = {'total': len(records), 'created': 0, 'duplicates': 0, 'errors': [], 'dry_run': dry_run}
+
+    existing_keys = {(url, pattern) for url, pattern in db.session.query(MonitorTarget.url, MonitorTarget.check_pattern).all()}
+    rows = []
+    row_numbers = []
+    for index, record in enumerate(records, start=1):
+        if not isinstance(record, dict):
+            report['errors'].append({'row': index, 'error': '记录格式无效'})
+            continue
+        row, error = validate_target_record(record)
+        if error is None:
+            error = compile_rule(row)
+        if error:
+            report['errors'].append({'row': index, 'error': error})
+            continue
+
+        key = (row['url'], row['check_pattern'])
+        if key in existing_keys:
+            report['duplicates'] += 1
+            continue
+        existing_keys.add(key)
+        # 批量插入不经过模型的校验器，需要手动填充供应商
+        row['vendor'] = vendor_from_url(row['url'])
+        rows.append(row)
+        row_numbers.append(index)
+
+    if dry_run:
+        report['created'] = len(rows)
+        if fetch_sample and rows:
+            report['samples'] = [
+                dict(row=number, name=row['name'], **result)
+                for number, row, result in zip(row_numbers, rows, evaluate_samples(rows))
+            ]
+        return report
+
+    try:
+        for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+            db.session.execute(MonitorTarget.__table__.insert(), rows[start:start + IMPORT_BATCH_SIZE])
+        bump_config_version()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    report['created'] = len(rows)
+    logger.info(f"Imported {len(rows)} monitor targets ({report['duplicates']} duplicates, {len(report['errors'])} errors)")
+    return report
+
+
+# 校验通知设置的订阅条件，返回(字段值, 错误信息)
+def parse_subscription_filters(record):
+    from subscriptions import normalize_vendor
+
+    filters = {field: (str(record.get(field) or '').strip() or None) for field in FILTER_FIELDS}
+    filters['filter_vendor'] = normalize_vendor(filters['filter_vendor'])
+    if filters['filter_max_price'] is not None:
+        try:
+            filters['filter_max_price'] = float(filters['filter_max_price'])
+        except ValueError:
+            return None, f'价格上限无效: {record.get("filter_max_price")}'
+        if filters['filter_max_price'] < 0:
+            return None, '价格上限不能为负数'
+    return filters, None
+
+
+# 批量导入通知设置，关联到指定用户
+def import_notification_settings(records, user_id, dry_run=False):
+    from app import db, MonitorTarget, NotificationSetting
+    from config_snapshot import bump_config_version
+
+    report = {'total': len(records), 'created': 0, 'duplicates': 0, 'errors': [], 'dry_run': dry_run}
+
+    target_ids = {
+        (url, pattern): target_id
+        for target_id, url, pattern in db.session.query(MonitorTarget.id, MonitorTarget.url, MonitorTarget.check_pattern).all()
+    }
+    existing_keys = {
+        (setting.monitor_target_id, setting.notification_type, json.dumps(setting.settings or {}, sort_keys=True),
+         tuple(getattr(setting, field) for field in FILTER_FIELDS))
+        for setting in NotificationSetting.query.all()
+    }
+
+    rows = []
+    for index, record in enumerate(records, start=1):
+        if not isinstance(record, dict):
+            report['errors'].append({'row': index, 'error': '记录格式无效'})
+            continue
+
+        notification_type = (record.get('notification_type') or '').strip()
+        if notification_type not in NOTIFICATION_TYPES:
+            report['errors'].append({'row': index, 'error': f'通知类型无效: {notification_type}'})
+            continue
+
+        settings = record.get('settings') or {}
+        if isinstance(settings, str):
+            try:
+                settings = json.loads(settings)
+            except ValueError:
+                report['errors'].append({'row': index, 'error': '通知配置不是有效的JSON'})
+                continue
+        if not isinstance(settings, dict):
+            report['errors'].append({'row': index, 'error': '通知配置必须是对象'})
+            continue
+
+        filters, error = parse_subscription_filters(record)
+        if error:
+            report['errors'].append({'row': index, 'error': error})
+            continue
+
+        # 未指定目标URL表示不绑定目标（按条件订阅或全局通知设置）
+        target_url = (record.get('target_url') or '').strip()
+        target_id = None
+        if target_url:
+            target_id = target_ids.get((target_url, (record.get('target_check_pattern') or '').strip()))
+            if target_id is None:
+                report['errors'].append({'row': index, 'error': f'未找到监控目标: {target_url}'})
+                continue
+
+        key = (target_id, notification_type, json.dumps(settings, sort_keys=True), tuple(filters.values()))
+        if key in existing_keys:
+            report['duplicates'] += 1
+            continue
+        existing_keys.add(key)
+        rows.append({
+            'monitor_target_id': target_id,
+            'user_id': user_id,
+            'notification_type': notification_type,
+            'settings': settings,
+            'enabled': parse_bool(record.get('enabled'), True),
+            **filters
+        })
+
+    report['created'] = len(rows)
+    if dry_run or not rows:
+        return report
+
+    try:
+        for start in range(0, len(rows), IMPORT_BATCH_SIZE):
+            db.session.execute(NotificationSetting.__table__.insert(), rows[start:start + IMPORT_BATCH_SIZE])
+        bump_config_version()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    logger.info(f"Imported {len(rows)} notification settings ({report['duplicates']} duplicates, {len(report['errors'])} errors)")
+    return report
+
+
+EXPORTERS = {
+    'targets': (export_targets, TARGET_FIELDS),
+    'notification_settings': (export_notification_settings, SETTING_FIELDS),
+}
+
+
+# 命令行入口：
+#   python bulk.py export targets --format csv -o targets.csv
+#   python bulk.py import targets targets.csv --dry-run --fetch-sample
+#   python bulk.py import notification_settings settings.json --user admin
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='批量导入/导出监控目标和通知设置')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = subparsers.add_parser('export', help='导出数据')
+    export_parser.add_argument('kind', choices=sorted(EXPORTERS))
+    export_parser.add_argument('--format', choices=['json', 'csv'], default=None)
+    export_parser.add_argument('-o', '--output', help='输出文件（默认输出到标准输出）')
+
+    import_parser = subparsers.add_parser('import', help='导入数据')
+    import_parser.add_argument('kind', choices=sorted(EXPORTERS))
+    import_parser.add_argument('file')
+    import_parser.add_argument('--format', choices=['json', 'csv'], default=None)
+    import_parser.add_argument('--dry-run', action='store_true', help='只校验，不写入数据库')
+    import_parser.add_argument('--fetch-sample', action='store_true', help='试运行时抓取样本页面验证规则')
+    import_parser.add_argument('--user', help='通知设置关联的用户名（默认第一个管理员）')
+
+    args = parser.parse_args(argv)
+
+    # 命令行工具不需要启动定时任务，数据库初始化完成后再继续
+    os.environ.setdefault('ENABLE_SCHEDULER', '0')
+    os.environ.setdefault('FAST_START', '0')
+    from app import app, User
+
+    with app.app_context():
+        if args.command == 'export':
+            exporter, fields = EXPORTERS[args.kind]
+            fmt = args.format or detect_format(args.output)
+            output = serialize_records(exporter(), fields, fmt)
+            if args.output:
+                with open(args.output, 'w', encoding='utf-8', newline='') as f:
+                    f.write(output)
+            else:
+                print(output)
+            return 0
+
+        fmt = args.format or detect_format(args.file)
+        with open(args.file, 'rb') as f:
+            records = parse_records(f.read(), fmt)
+
+        if args.kind == 'targets':
+            report = import_targets(records, dry_run=args.dry_run, fetch_sample=args.fetch_sample)
+        else:
+            query = User.query.filter_by(username=args.user) if args.user else User.query.filter_by(is_admin=True)
+            user = query.order_by(User.id).first()
+            if user is None:
+                parser.error('未找到用户')
+            report = import_notification_settings(records, user.id, dry_run=args.dry_run)
+
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
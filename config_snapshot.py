@@ -0,0 +1,156 @@
+import logging
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+from types import MappingProxyType
+from sqlalchemy import func, or_
+from subscriptions import SubscriptionIndex, SubscriptionEvent, normalize_filter, normalize_vendor
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 监控配置的内存快照
+#
+# 快照包含所有启用的监控目标和通知订阅索引（见 subscriptions.py），构建后不可修改。
+# config_version 表中的版本号由管理后台的增删改操作递增，
+# 每个进程只在版本号变化时重新构建快照，监控循环本身不再查询配置表。
+# 订阅索引在重建快照时增量更新：只读取 updated_at 晚于上次构建的通知设置和启用设置的ID列表。
+
+TARGET_FIELDS = (
+    'id', 'name', 'url', 'check_type', 'check_pattern', 'expected_result', 'interval',
+    'is_active', 'use_flaresolverr', 'max_bytes', 'parent_id', 'vendor', 'region'
+)
+
+# 监控目标的只读配置，属性名与MonitorTarget一致，可直接传给检查函数
+TargetConfig = namedtuple('TargetConfig', TARGET_FIELDS + ('parent_pattern',))
+
+# 通知设置的只读配置，属性名与NotificationSetting一致
+SETTING_FIELDS = (
+    'id', 'monitor_target_id', 'user_id', 'notification_type', 'settings', 'enabled',
+    'filter_vendor', 'filter_keyword', 'filter_region', 'filter_max_price'
+)
+SettingConfig = namedtuple('SettingConfig', SETTING_FIELDS)
+
+# 增量更新订阅索引时向前多读取的时间，避免遗漏与上次构建几乎同时提交的修改（重复应用没有副作用）
+SUBSCRIPTION_OVERLAP = timedelta(seconds=60)
+
+
+class ConfigSnapshot:
+    __slots__ = ('version', 'targets', 'targets_by_id', 'subscriptions', 'child_names', 'built_at')
+
+    def __init__(self, version, targets, subscriptions, child_names):
+        self.version = version
+        self.targets = tuple(targets)
+        self.targets_by_id = MappingProxyType({target.id: target for target in self.targets})
+        self.subscriptions = subscriptions
+        self.child_names = MappingProxyType(child_names)
+        self.built_at = datetime.utcnow()
+
+    # 目标状态变化时需要通知的设置
+    def subscribers_for(self, target, is_available, changed, price=None):
+        return self.subscriptions.match(SubscriptionEvent(target, is_available, changed, price))
+
+    # 提取器目标已有的产品名称
+    def children_of(self, parent_id):
+        return self.child_names.get(parent_id, frozenset())
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+# 读取数据库中的配置版本号
+def current_version():
+    from app import db, ConfigVersion
+
+    version = db.session.query(ConfigVersion.version).filter_by(id=1).scalar()
+    return version or 0
+
+
+# 递增配置版本号，与配置修改在同一事务中提交
+def bump_config_version():
+    from app import db, ConfigVersion
+
+    table = ConfigVersion.__table__
+    result = db.session.execute(
+        table.update().where(table.c.id == 1).values(version=table.c.version + 1, updated_at=datetime.utcnow())
+    )
+    if result.rowcount == 0:
+        db.session.execute(table.insert().values(id=1, version=1, updated_at=datetime.utcnow()))
+    # 提交后通知各进程重新加载状态板中的目标信息
+    db.session.info['config_changed'] = True
+
+
+# 通知设置的只读配置，筛选条件已规范化
+def setting_config(row):
+    return SettingConfig(
+        row.id, row.monitor_target_id, row.user_id, row.notification_type,
+        MappingProxyType(dict(row.settings or {})), bool(row.enabled),
+        normalize_vendor(row.filter_vendor), normalize_filter(row.filter_keyword),
+        normalize_filter(row.filter_region), row.filter_max_price
+    )
+
+
+# 构建或增量更新订阅索引
+def build_subscriptions(previous=None):
+    from app import db, NotificationSetting
+
+    columns = [getattr(NotificationSetting, field) for field in SETTING_FIELDS]
+    watermark = db.session.query(func.max(NotificationSetting.updated_at)).scalar()
+    if previous is None or previous.watermark is None:
+        rows = db.session.query(*columns).filter_by(enabled=True).all()
+        return SubscriptionIndex([setting_config(row) for row in rows], watermark)
+
+    # 删除的设置不会留下修改记录，通过启用设置的ID列表找出
+    enabled_ids = {row[0] for row in db.session.query(NotificationSetting.id).filter_by(enabled=True).all()}
+    removed_ids = [setting_id for setting_id in previous.settings if setting_id not in enabled_ids]
+    rows = db.session.query(*columns).filter(
+        or_(NotificationSetting.updated_at >= previous.watermark - SUBSCRIPTION_OVERLAP,
+            NotificationSetting.id.in_(list(enabled_ids - set(previous.settings))))
+    ).all()
+    if not rows and not removed_ids:
+        return previous
+    return previous.update([setting_config(row) for row in rows], removed_ids, watermark)
+
+
+# 从数据库构建配置快照（只读取列值，不把ORM对象留在会话中）
+def build_snapshot(version, previous=None):
+    from app import db, MonitorTarget
+
+    columns = [getattr(MonitorTarget, field) for field in TARGET_FIELDS]
+    rows = db.session.query(*columns).all()
+    patterns = {row.id: row.check_pattern for row in rows}
+
+    targets = []
+    child_names = {}
+    for row in rows:
+        if row.parent_id is not None:
+            child_names.setdefault(row.parent_id, set()).add(row.check_pattern)
+        if row.is_active:
+            targets.append(TargetConfig(*row, patterns.get(row.parent_id)))
+
+    return ConfigSnapshot(
+        version,
+        targets,
+        build_subscriptions(previous.subscriptions if previous is not None else None),
+        {parent_id: frozenset(names) for parent_id, names in child_names.items()}
+    )
+
+
+# 获取当前配置快照：版本号未变化时直接返回缓存的快照
+def get_config_snapshot():
+    global _snapshot
+
+    version = current_version()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _snapshot_lock:
+        if _snapshot is None or _snapshot.version != version:
+            # 先读取版本号再读取数据：构建期间发生的修改会在下一次检查时触发重建
+            _snapshot = build_snapshot(version, _snapshot)
+            bound, unbound = _snapshot.subscriptions.counts()
+            logger.info(f"Rebuilt config snapshot v{version}: {len(_snapshot.targets)} active targets, "
+                        f"{bound} target settings, {unbound} filtered/global settings")
+        return _snapshot
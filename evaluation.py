@@ -0,0 +1,160 @@
+import os
+import atexit
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 页面解析进程池
+#
+# 选择器和提取器检查需要用BeautifulSoup解析HTML，这是纯Python的CPU密集型工作，
+# 在同一个进程中受GIL限制无法并行。启用进程池后，监控周期把抓取到的页面和该页面上的
+# 选择器/提取器规则交给常驻的解析进程，主进程继续抓取下一个页面：
+#   - 较大的页面通过共享内存传递（只传递名称和长度，不经过pickle），较小的页面直接传递
+#   - 解析进程常驻，提取器配置和CSS选择器的编译结果在进程内缓存
+#   - 解析进程只返回选择器匹配的文本和提取到的产品记录，判断库存、写入数据库和发送通知仍在主进程中进行
+# 文本检查使用多关键词扫描，API检查解析JSON，都很快，仍在主进程中完成。
+
+# 解析进程数：auto 表示CPU核心数（单核时不启用），0 表示不启用进程池
+EVAL_PROCESSES = os.environ.get('EVAL_PROCESSES', 'auto')
+# 超过该大小（字节，UTF-8编码后）的页面通过共享内存传递
+EVAL_SHM_MIN_BYTES = int(os.environ.get('EVAL_SHM_MIN_BYTES', 64 * 1024))
+# 等待解析结果的最长秒数，超时后在主进程中解析
+EVAL_TIMEOUT = float(os.environ.get('EVAL_TIMEOUT', 60))
+
+
+# 解析进程数
+def pool_size():
+    if EVAL_PROCESSES == 'auto':
+        cores = os.cpu_count() or 1
+        return cores if cores > 1 else 0
+    try:
+        return max(int(EVAL_PROCESSES), 0)
+    except ValueError:
+        return 0
+
+
+# 页面解析任务：selectors 为CSS选择器列表，extractors 为提取器配置列表
+# 返回 {'selectors': {选择器: 匹配元素的文本列表或None}, 'products': {提取器配置: 产品列表}, 'errors': {规则: 错误信息}}
+def evaluate_rules(content, selectors=(), extractors=()):
+    from bs4 import BeautifulSoup
+    from extractors import extract_products
+
+    soup = BeautifulSoup(content, 'html.parser')
+    results = {'selectors': {}, 'products': {}, 'errors': {}}
+    for selector in selectors:
+        try:
+            elements = soup.select(selector)
+            results['selectors'][selector] = [element.get_text().strip() for element in elements] or None
+        except Exception as e:
+            results['errors'][('selector', selector)] = (e.__class__.__name__, str(e))
+    for pattern in extractors:
+        try:
+            results['products'][pattern] = extract_products(soup, pattern)
+        except Exception as e:
+            results['errors'][('extractor', pattern)] = (e.__class__.__name__, str(e))
+    return results
+
+
+# 解析进程中执行的任务：页面为共享内存时按名称读取
+def _evaluate_in_worker(content, shm_name, size, selectors, extractors):
+    if shm_name is not None:
+        # 解析进程与主进程共用同一个resource_tracker，共享内存由主进程在取得结果后删除
+        shm = SharedMemory(name=shm_name)
+        try:
+            with shm.buf[:size] as view:
+                content = str(view, 'utf-8')
+        finally:
+            shm.close()
+    return evaluate_rules(content, selectors, extractors)
+
+
+# 预先导入解析所需的模块，第一个任务不需要等待导入
+def _warm_up():
+    import bs4  # noqa: F401
+    import extractors  # noqa: F401
+
+
+# 已提交的解析任务：在主进程中等待结果并释放共享内存
+class Evaluation:
+    def __init__(self, future, shm=None):
+        self.future = future
+        self.shm = shm
+        self._results = None
+        self.lock = threading.Lock()
+
+    def result(self):
+        with self.lock:
+            if self._results is None:
+                try:
+                    self._results = self.future.result(timeout=EVAL_TIMEOUT)
+                finally:
+                    self.release()
+            return self._results
+
+    def release(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+
+class EvaluationPool:
+    def __init__(self, processes):
+        self.processes = processes
+        # 使用spawn启动解析进程：主进程中有调度器和数据库连接等线程，fork不安全
+        self.executor = ProcessPoolExecutor(max_workers=processes, mp_context=get_context('spawn'),
+                                            initializer=_warm_up)
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.shared_bytes = 0
+
+    # 提交页面和规则，返回Evaluation
+    def submit(self, content, selectors=(), extractors=()):
+        data = content.encode('utf-8')
+        shm = None
+        if len(data) >= EVAL_SHM_MIN_BYTES:
+            shm = SharedMemory(create=True, size=len(data))
+            shm.buf[:len(data)] = data
+            args = (None, shm.name, len(data))
+        else:
+            args = (content, None, 0)
+        try:
+            future = self.executor.submit(_evaluate_in_worker, *args, tuple(selectors), tuple(extractors))
+        except Exception:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+            raise
+        with self.lock:
+            self.submitted += 1
+            if shm is not None:
+                self.shared_bytes += len(data)
+        return Evaluation(future, shm)
+
+    def to_dict(self):
+        with self.lock:
+            return {'processes': self.processes, 'submitted': self.submitted, 'shared_bytes': self.shared_bytes}
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+# 获取全局解析进程池，未启用时返回None
+def get_evaluation_pool():
+    global _pool
+    if _pool is None and pool_size() > 0:
+        with _pool_lock:
+            if _pool is None:
+                _pool = EvaluationPool(pool_size())
+                atexit.register(_pool.shutdown)
+                logger.info(f"Evaluation process pool started with {_pool.processes} processes")
+    return _pool
@@ -0,0 +1,119 @@
+import logging
+import re
+from collections import namedtuple
+from functools import lru_cache
+from status_messages import check_message
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 多产品页面提取器
+#
+# 提取器类型的监控目标在检查模式中填写预设名称或自定义选择器：
+#
+#   whmcs
+#   item=.product; name=.name; stock=.qty; price=.price
+#
+# item 为每个产品块的选择器（必填），name/stock/price 为产品块内的选择器；
+# 选择器中可以用逗号给出多个候选，取第一个匹配的元素。
+
+PRESETS = {
+    # WHMCS standard_cart 产品列表页
+    'whmcs': {
+        'item': '.product',
+        'name': 'header span[id$="-name"], .product-title, .name, header',
+        'stock': '.qty',
+        'price': '.product-pricing .price, .price',
+    },
+    # SolusVM/Blesta等常见的表格式价格页
+    'table': {
+        'item': 'table tbody tr',
+        'name': 'td:nth-of-type(1)',
+        'stock': 'td.stock, td:nth-of-type(2)',
+        'price': 'td.price, td:last-child',
+    },
+}
+
+# 表示缺货的常见文字
+OUT_OF_STOCK_MARKERS = ('out of stock', 'sold out', 'unavailable', '缺货', '售罄', '无货', '已售完')
+
+ProductRecord = namedtuple('ProductRecord', ['name', 'available', 'stock', 'price', 'stock_text'])
+
+_NUMBER_RE = re.compile(r'(\d+(?:[.,]\d+)?)')
+
+
+class ExtractorSpecError(ValueError):
+    pass
+
+
+# 解析提取器配置（带缓存）
+@lru_cache(maxsize=256)
+def parse_spec(pattern):
+    pattern = (pattern or '').strip() or 'whmcs'
+    if pattern in PRESETS:
+        return tuple(sorted(PRESETS[pattern].items()))
+
+    spec = {}
+    for part in pattern.split(';'):
+        part = part.strip()
+        if not part:
+            continue
+        if '=' not in part:
+            raise ExtractorSpecError(f'提取器配置格式错误: {part}')
+        key, selector = part.split('=', 1)
+        key = key.strip()
+        if key not in ('item', 'name', 'stock', 'price'):
+            raise ExtractorSpecError(f'未知的提取器字段: {key}')
+        spec[key] = selector.strip()
+
+    if not spec.get('item'):
+        raise ExtractorSpecError('提取器配置缺少 item 选择器')
+    return tuple(sorted(spec.items()))
+
+
+def _select_text(element, selector):
+    if not selector:
+        return ''
+    found = element.select_one(selector)
+    return found.get_text(' ', strip=True) if found is not None else ''
+
+
+def _parse_number(text, integer=False):
+    match = _NUMBER_RE.search(text or '')
+    if not match:
+        return None
+    value = match.group(1).replace(',', '')
+    try:
+        return int(float(value)) if integer else float(value)
+    except ValueError:
+        return None
+
+
+# 从已解析的页面中提取所有产品的库存记录
+def extract_products(soup, pattern):
+    spec = dict(parse_spec(pattern))
+    records = []
+    seen = set()
+    for item in soup.select(spec['item']):
+        name = _select_text(item, spec.get('name')) or item.get_text(' ', strip=True)[:100]
+        if not name or name in seen:
+            continue
+        seen.add(name)
+
+        stock_text = _select_text(item, spec.get('stock'))
+        stock = _parse_number(stock_text, integer=True)
+        lowered = (stock_text or item.get_text(' ', strip=True)).lower()
+        if stock is not None:
+            available = stock > 0
+        else:
+            available = not any(marker in lowered for marker in OUT_OF_STOCK_MARKERS)
+
+        price_text = _select_text(item, spec.get('price'))
+        records.append(ProductRecord(name, available, stock, _parse_number(price_text), stock_text))
+    return records
+
+
+# 生成单个产品的状态消息
+def describe_product(record):
+    return check_message('product_status', available=record.available, stock=record.stock,
+                         stock_text=record.stock_text, price=record.price)
@@ -0,0 +1,255 @@
+import os
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 对冲抓取：直接请求与FlareSolverr竞速
+#
+# FETCH_HEDGING=1（默认）时，抓取页面不再完全由监控目标的 use_flaresolverr 决定：
+#   - 先发出直接请求；直接请求超过对冲延迟仍未完成、失败或返回Cloudflare验证页面时，
+#     再发出FlareSolverr请求，先得到有效页面的一方胜出，另一方被取消
+#     （直接请求停止读取并关闭连接；FlareSolverr请求无法中止，结果被丢弃）
+#   - 按主机记录两种方式的延迟和直接请求遇到验证页面的比例：经常遇到验证页面的主机
+#     直接使用FlareSolverr，每隔 HEDGE_PROBE_SECONDS 再试一次直接请求，验证关闭后自动切回
+#   - 未勾选 use_flaresolverr 且从未遇到验证页面的主机，只在返回验证页面时才使用FlareSolverr，
+#     不会因为普通的慢速或错误给FlareSolverr增加负担
+# FETCH_HEDGING=0 时按 use_flaresolverr 选择抓取方式（旧的行为）。
+
+FETCH_HEDGING = os.environ.get('FETCH_HEDGING', '1') != '0'
+# 对冲延迟的上限(毫秒)：直接请求超过该时间未完成时发出FlareSolverr请求，没有延迟数据的主机使用该值
+HEDGE_DELAY_MS = float(os.environ.get('HEDGE_DELAY_MS', 2000))
+# 对冲延迟的下限(毫秒)，以及相对于主机直接请求平均延迟的倍数
+HEDGE_MIN_DELAY_MS = float(os.environ.get('HEDGE_MIN_DELAY_MS', 250))
+HEDGE_LATENCY_FACTOR = float(os.environ.get('HEDGE_LATENCY_FACTOR', 2.0))
+# 优先使用FlareSolverr的主机每隔多少秒重新尝试直接请求
+HEDGE_PROBE_SECONDS = float(os.environ.get('HEDGE_PROBE_SECONDS', 600))
+# 执行对冲请求的线程数
+HEDGE_WORKERS = int(os.environ.get('HEDGE_WORKERS', 16))
+
+# 直接请求遇到验证页面的比例超过该值时，主机优先使用FlareSolverr
+CHALLENGE_PREFER_SOLVER = 0.5
+EWMA_ALPHA = 0.3
+
+DIRECT = 'direct'
+SOLVER = 'flaresolverr'
+
+# Cloudflare验证页面的特征
+CHALLENGE_STATUSES = (403, 429, 503)
+CHALLENGE_MARKERS = (
+    '<title>just a moment...</title>',
+    'cf-browser-verification',
+    'cf_chl_opt',
+    'challenge-platform',
+    '<title>attention required! | cloudflare</title>',
+)
+
+
+# 直接请求返回了Cloudflare验证页面
+class ChallengeError(Exception):
+    pass
+
+
+# 判断响应是否为Cloudflare验证页面（只检查响应头和页面开头）
+# 正常页面也可能引用 challenge-platform 脚本，状态码为200时只认验证页面特有的标记
+def is_challenge(status_code, headers, head_text=''):
+    if headers.get('cf-mitigated', '').lower() == 'challenge':
+        return True
+    lowered = head_text[:8192].lower()
+    if status_code in CHALLENGE_STATUSES:
+        return 'cloudflare' in headers.get('Server', '').lower() or any(marker in lowered for marker in CHALLENGE_MARKERS)
+    return '<title>just a moment...</title>' in lowered or 'cf_chl_opt' in lowered
+
+
+# 重启后恢复的主机统计字段（probe_at 为绝对时间）
+ROUTE_STATE_FIELDS = ('direct_ms', 'solver_ms', 'challenge_rate', 'challenges', 'probe_at', 'wins', 'hedges')
+
+
+class HostRoute:
+    def __init__(self):
+        self.direct_ms = None
+        self.solver_ms = None
+        self.challenge_rate = 0.0
+        self.challenges = 0
+        self.probe_at = 0.0
+        self.wins = {DIRECT: 0, SOLVER: 0}
+        self.hedges = 0
+
+    def _latency(self, current, latency_ms):
+        if current is None:
+            return latency_ms
+        return current + EWMA_ALPHA * (latency_ms - current)
+
+    @property
+    def prefers_solver(self):
+        return self.challenge_rate > CHALLENGE_PREFER_SOLVER
+
+    # 对冲延迟：主机直接请求平均延迟的若干倍，限制在上下限之间
+    @property
+    def hedge_delay_ms(self):
+        if self.direct_ms is None:
+            return HEDGE_DELAY_MS
+        return min(max(self.direct_ms * HEDGE_LATENCY_FACTOR, HEDGE_MIN_DELAY_MS), HEDGE_DELAY_MS)
+
+    def to_dict(self, now):
+        return {
+            'prefers': SOLVER if self.prefers_solver else DIRECT,
+            'direct_ms': round(self.direct_ms, 1) if self.direct_ms is not None else None,
+            'flaresolverr_ms': round(self.solver_ms, 1) if self.solver_ms is not None else None,
+            'challenge_rate': round(self.challenge_rate, 3),
+            'challenges': self.challenges,
+            'hedges': self.hedges,
+            'wins': dict(self.wins),
+            'next_probe_seconds': round(max(0.0, self.probe_at - now), 1) if self.prefers_solver else None,
+        }
+
+
+class HedgeRouter:
+    def __init__(self):
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS, thread_name_prefix='hedge-fetch')
+
+    def route(self, host):
+        with self.lock:
+            route = self.hosts.get(host)
+            if route is None:
+                route = self.hosts[host] = HostRoute()
+            return route
+
+    # 本次抓取的计划：(首先使用的方式, 对冲延迟秒数或None)
+    # 对冲延迟为None时只在首选方式失败后才使用另一种方式
+    def plan(self, host, use_flaresolverr):
+        route = self.route(host)
+        now = time.time()
+        with self.lock:
+            if route.prefers_solver:
+                if now < route.probe_at:
+                    return SOLVER, None
+                # 定期重新尝试直接请求，同时在对冲延迟后发出FlareSolverr请求
+                route.probe_at = now + HEDGE_PROBE_SECONDS
+                return DIRECT, route.hedge_delay_ms / 1000
+            if use_flaresolverr or route.challenges:
+                return DIRECT, route.hedge_delay_ms / 1000
+            return DIRECT, None
+
+    def record(self, host, path, latency_ms=None, challenge=None):
+        route = self.route(host)
+        with self.lock:
+            if path == DIRECT and challenge is not None:
+                was_preferring_solver = route.prefers_solver
+                route.challenge_rate += EWMA_ALPHA * ((1.0 if challenge else 0.0) - route.challenge_rate)
+                if challenge:
+                    route.challenges += 1
+                if route.prefers_solver and not was_preferring_solver:
+                    route.probe_at = time.time() + HEDGE_PROBE_SECONDS
+                    logger.info(f"Host {host} is serving challenge pages, using FlareSolverr first")
+                elif was_preferring_solver and not route.prefers_solver:
+                    logger.info(f"Host {host} no longer serves challenge pages, using direct requests first")
+            if latency_ms is not None:
+                if path == DIRECT:
+                    route.direct_ms = route._latency(route.direct_ms, latency_ms)
+                else:
+                    route.solver_ms = route._latency(route.solver_ms, latency_ms)
+
+    def record_win(self, host, path, hedged):
+        route = self.route(host)
+        with self.lock:
+            route.wins[path] += 1
+            route.hedges += int(hedged)
+
+    def to_dict(self):
+        now = time.time()
+        with self.lock:
+            return {host: route.to_dict(now) for host, route in self.hosts.items()}
+
+    # 导出/恢复按主机记录的统计，用于重启后保留（见runtime_state）
+    def export_state(self):
+        with self.lock:
+            return {host: {field: getattr(route, field) for field in ROUTE_STATE_FIELDS}
+                    for host, route in self.hosts.items()}
+
+    def restore_state(self, state):
+        with self.lock:
+            for host, fields in state.items():
+                route = self.hosts.setdefault(host, HostRoute())
+                for field in ROUTE_STATE_FIELDS:
+                    if field in fields:
+                        setattr(route, field, fields[field])
+        return len(state)
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+# 获取全局的对冲路由（按主机记录的抓取方式统计）
+def get_hedge_router():
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = HedgeRouter()
+    return _router
+
+
+# 执行一次抓取并计时，返回(方式, 页面内容或None, 耗时毫秒, 是否为验证页面)
+def _attempt(path, fetch, cancel):
+    started = time.perf_counter()
+    try:
+        content = fetch(cancel)
+        challenge = False if content is not None else None
+    except ChallengeError:
+        content = None
+        challenge = True
+    except Exception as e:
+        logger.error("Hedged %s fetch failed: %s", path, str(e))
+        content = None
+        challenge = None
+    return path, content, (time.perf_counter() - started) * 1000, challenge
+
+
+# 对冲抓取页面，返回(页面内容, 胜出的方式)；两种方式都失败时内容为None
+# direct_fetch(cancel) 直接请求，cancel被设置时应尽快停止，返回验证页面时抛出ChallengeError
+# solver_fetch(cancel) 通过FlareSolverr请求
+def hedged_fetch(host, use_flaresolverr, direct_fetch, solver_fetch):
+    router = get_hedge_router()
+    first, delay = router.plan(host, use_flaresolverr)
+    fetchers = {DIRECT: direct_fetch, SOLVER: solver_fetch}
+    other = SOLVER if first == DIRECT else DIRECT
+    cancel = threading.Event()
+
+    pending = {router.executor.submit(_attempt, first, fetchers[first], cancel)}
+    launched = {first}
+    hedged = False
+    try:
+        if delay is not None:
+            done, _ = wait(pending, timeout=delay)
+            if not done:
+                # 首选方式超过对冲延迟仍未完成，同时发出另一种请求
+                pending.add(router.executor.submit(_attempt, other, fetchers[other], cancel))
+                launched.add(other)
+                hedged = True
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, content, latency_ms, challenge = future.result()
+                # 被取消的请求不计入统计
+                if not cancel.is_set():
+                    router.record(host, path, latency_ms if content is not None else None, challenge)
+                if content is not None:
+                    router.record_win(host, path, hedged)
+                    return content, path
+                # 首选方式失败：验证页面、勾选了FlareSolverr或主机遇到过验证页面时改用另一种方式
+                if other not in launched and (challenge or use_flaresolverr or first == SOLVER
+                                              or router.route(host).challenges):
+                    pending.add(router.executor.submit(_attempt, other, fetchers[other], cancel))
+                    launched.add(other)
+        return None, first
+    finally:
+        # 取消仍在进行的请求
+        cancel.set()
@@ -0,0 +1,230 @@
+import os
+import json
+import base64
+import logging
+from datetime import datetime
+from sqlalchemy import tuple_
+from sqlalchemy.orm import contains_eager
+from status_messages import get_message, preload_messages
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 监控目标和状态历史的JSON接口
+#
+# /api/targets 和 /api/targets/<id>/checks 使用键集分页（keyset pagination）：
+# 目标按ID、状态记录按 (timestamp, id) 排序，下一页从上一页最后一条记录之后开始，
+# 状态记录的查询走 ix_status_check_target_timestamp 索引（SQLite的索引隐含ID），
+# 翻到多深的位置每页的耗时都相同，不需要OFFSET扫描。
+#   - 游标（cursor）是不透明的字符串，由上一页响应中的 next 给出
+#   - fields 参数只返回指定的字段，逗号分隔
+#   - JSON响应带ETag，客户端通过 If-None-Match 重新验证时数据未变化返回304
+#   - format=ndjson（或 Accept: application/x-ndjson）时流式输出所有匹配的记录，每行一个JSON对象，
+#     按批次查询数据库，内存占用与导出的总数量无关
+# 时间均为UTC，格式为ISO 8601。
+
+# 每页默认和最大的记录数量
+API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 100))
+API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 1000))
+# 流式导出时每批查询的记录数量
+API_EXPORT_BATCH = int(os.environ.get('API_EXPORT_BATCH', 1000))
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+TARGET_FIELDS = ('id', 'name', 'url', 'check_type', 'vendor', 'region', 'interval', 'is_active', 'parent_id',
+                 'status', 'last_checked', 'response_time', 'created_at')
+CHECK_FIELDS = ('id', 'timestamp', 'last_checked', 'is_available', 'response_time', 'message', 'code',
+                'check_count', 'response_time_min', 'response_time_max', 'response_time_avg')
+
+
+# 请求参数无效
+class ApiError(ValueError):
+    pass
+
+
+def _isoformat(value):
+    return value.isoformat(timespec='seconds') + 'Z' if value is not None else None
+
+
+# 解析ISO 8601格式的UTC时间参数（可带Z或时区）
+def parse_time(value, name):
+    if not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise ApiError(f'{name} 时间格式无效')
+    if parsed.tzinfo is not None:
+        parsed = (parsed - parsed.utcoffset()).replace(tzinfo=None)
+    return parsed
+
+
+# 解析 fields 参数，为空时返回全部字段
+def parse_fields(value, allowed):
+    if not value:
+        return allowed
+    fields = tuple(dict.fromkeys(field.strip() for field in value.split(',') if field.strip()))
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ApiError(f"未知字段: {', '.join(unknown)}")
+    return fields or allowed
+
+
+def parse_limit(value):
+    if value in (None, ''):
+        return API_PAGE_SIZE
+    try:
+        return min(max(int(value), 1), API_MAX_PAGE_SIZE)
+    except ValueError:
+        raise ApiError('limit 必须是整数')
+
+
+# 游标：上一页最后一条记录的排序键
+def encode_cursor(*key):
+    # 时间保留微秒，否则同一秒内的记录会被跳过或重复
+    raw = json.dumps([part.isoformat() if isinstance(part, datetime) else part for part in key],
+                     separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, types):
+    try:
+        parts = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        if not isinstance(parts, list) or len(parts) != len(types):
+            raise ValueError(cursor)
+        return tuple(parse_time(part, 'after') if kind is datetime else kind(part) for part, kind in zip(parts, types))
+    except (ValueError, TypeError):
+        raise ApiError('after 游标无效')
+
+
+def _project(item, fields):
+    return {field: item[field] for field in fields}
+
+
+# 一页监控目标（按ID升序，已预加载最新状态），返回 (记录列表, 下一页游标)
+def list_targets(after=None, limit=API_PAGE_SIZE, vendor='', fields=TARGET_FIELDS):
+    from app import MonitorTarget, StatusCheck
+    from status_board import board_targets
+
+    after_id = decode_cursor(after, (int,))[0] if after else None
+    targets = board_targets()
+    if targets is not None:
+        # 状态板可用时不访问数据库，目标已按ID排序
+        targets = [target for target in targets
+                   if (after_id is None or target.id > after_id) and (not vendor or target.vendor == vendor)][:limit + 1]
+        next_cursor = encode_cursor(targets[limit - 1].id) if len(targets) > limit else None
+        return [_project(_target_item(target), fields) for target in targets[:limit]], next_cursor
+
+    query = (
+        MonitorTarget.query
+        .outerjoin(StatusCheck, MonitorTarget.latest_check_id == StatusCheck.id)
+        .options(contains_eager(MonitorTarget.latest_status))
+    )
+    if after_id is not None:
+        query = query.filter(MonitorTarget.id > after_id)
+    if vendor:
+        query = query.filter(MonitorTarget.vendor == vendor)
+    # 多取一条判断是否还有下一页
+    targets = query.order_by(MonitorTarget.id).limit(limit + 1).all()
+    next_cursor = encode_cursor(targets[limit - 1].id) if len(targets) > limit else None
+    return [_project(_target_item(target), fields) for target in targets[:limit]], next_cursor
+
+
+def _target_item(target):
+    latest = target.latest_status
+    return {
+        'id': target.id,
+        'name': target.name,
+        'url': target.url,
+        'check_type': target.check_type,
+        'vendor': target.vendor,
+        'region': target.region,
+        'interval': target.interval,
+        'is_active': bool(target.is_active),
+        'parent_id': target.parent_id,
+        'status': 'unknown' if latest is None else ('available' if latest.is_available else 'unavailable'),
+        'last_checked': _isoformat(latest.checked_at) if latest is not None else None,
+        'response_time': latest.response_time if latest is not None else None,
+        'created_at': _isoformat(target.created_at),
+    }
+
+
+# 状态记录的查询：只选择需要的列，不创建ORM对象
+def _checks_query(target_id, since=None, until=None, descending=False):
+    from app import db, StatusCheck
+
+    query = db.session.query(
+        StatusCheck.id, StatusCheck.timestamp, StatusCheck.last_checked, StatusCheck.is_available,
+        StatusCheck.response_time, StatusCheck.message_id, StatusCheck.message_text, StatusCheck.check_count,
+        StatusCheck.response_time_min, StatusCheck.response_time_max, StatusCheck.response_time_total
+    ).filter(StatusCheck.monitor_target_id == target_id)
+    if since is not None:
+        query = query.filter(StatusCheck.timestamp >= since)
+    if until is not None:
+        query = query.filter(StatusCheck.timestamp < until)
+    if descending:
+        return query.order_by(StatusCheck.timestamp.desc(), StatusCheck.id.desc())
+    return query.order_by(StatusCheck.timestamp, StatusCheck.id)
+
+
+def _after(query, key, descending):
+    from app import StatusCheck
+
+    position = tuple_(StatusCheck.timestamp, StatusCheck.id)
+    return query.filter(position < tuple_(*key) if descending else position > tuple_(*key))
+
+
+def _check_item(row):
+    message = get_message(row.message_id) if row.message_id is not None else None
+    count = row.check_count or 1
+    # 逐条写入的旧记录没有统计字段，以其响应时间代替
+    total = row.response_time_total if row.response_time_total is not None else row.response_time
+    return {
+        'id': row.id,
+        'timestamp': _isoformat(row.timestamp),
+        'last_checked': _isoformat(row.last_checked or row.timestamp),
+        'is_available': bool(row.is_available),
+        'response_time': row.response_time,
+        'message': message.render() if message is not None else row.message_text,
+        'code': message.code if message is not None else None,
+        'check_count': count,
+        'response_time_min': row.response_time_min if row.response_time_min is not None else row.response_time,
+        'response_time_max': row.response_time_max if row.response_time_max is not None else row.response_time,
+        'response_time_avg': round(total / count, 2) if total is not None else None,
+    }
+
+
+def _fetch_checks(query, key, limit, descending):
+    if key is not None:
+        query = _after(query, key, descending)
+    rows = query.limit(limit).all()
+    preload_messages(row.message_id for row in rows)
+    return rows
+
+
+# 一页状态记录，返回 (记录列表, 下一页游标)
+def list_checks(target_id, after=None, limit=API_PAGE_SIZE, since=None, until=None, descending=False,
+                fields=CHECK_FIELDS):
+    key = decode_cursor(after, (datetime, int)) if after else None
+    rows = _fetch_checks(_checks_query(target_id, since, until, descending), key, limit + 1, descending)
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.timestamp, last.id)
+    return [_project(_check_item(row), fields) for row in rows[:limit]], next_cursor
+
+
+# 逐批导出状态记录，每行一个JSON对象
+def export_checks(target_id, after=None, since=None, until=None, descending=False, fields=CHECK_FIELDS,
+                  batch_size=None):
+    batch_size = batch_size or API_EXPORT_BATCH
+    key = decode_cursor(after, (datetime, int)) if after else None
+    query = _checks_query(target_id, since, until, descending)
+    while True:
+        rows = _fetch_checks(query, key, batch_size, descending)
+        if not rows:
+            return
+        yield ''.join(json.dumps(_project(_check_item(row), fields), ensure_ascii=False) + '\n' for row in rows)
+        if len(rows) < batch_size:
+            return
+        key = (rows[-1].timestamp, rows[-1].id)
@@ -0,0 +1,182 @@
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 后台检查线程数
+CHECK_WORKERS = int(os.environ.get('CHECK_WORKERS', 4))
+# 内存中保留的检查任务数量，超出后丢弃最早完成的任务
+JOB_HISTORY_LIMIT = int(os.environ.get('JOB_HISTORY_LIMIT', 200))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+# 正在进行的检查：target_id -> Future（定时任务与手动检查共享）
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+# 检查任务：job_id -> CheckJob
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+
+
+# 获取后台检查线程池（延迟创建）
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=CHECK_WORKERS, thread_name_prefix='check-worker')
+        return _executor
+
+
+# 登记一次检查，返回(future, is_owner)；已有进行中的检查时返回其future
+def _claim(target_id):
+    with _inflight_lock:
+        future = _inflight.get(target_id)
+        if future is not None:
+            return future, False
+        future = Future()
+        _inflight[target_id] = future
+        return future, True
+
+
+# 执行已登记的检查并发布结果
+def _run_claimed(target_id, future, func, *args):
+    try:
+        result = func(*args)
+    except Exception as e:
+        with _inflight_lock:
+            _inflight.pop(target_id, None)
+        future.set_exception(e)
+    else:
+        with _inflight_lock:
+            _inflight.pop(target_id, None)
+        future.set_result(result)
+
+
+# 在当前线程中执行检查；如果该目标已有进行中的检查，则等待并复用其结果
+def run_single_flight(target_id, func, *args):
+    future, is_owner = _claim(target_id)
+    if is_owner:
+        _run_claimed(target_id, future, func, *args)
+    else:
+        logger.info("Check for target %s already in flight, joining it", target_id)
+    return future.result()
+
+
+# 在后台线程中检查单个监控目标，返回(future, joined)
+def submit_check(target_id):
+    future, is_owner = _claim(target_id)
+    if is_owner:
+        get_executor().submit(_run_claimed, target_id, future, check_target_by_id, target_id)
+    else:
+        logger.info("Check for target %s already in flight, joining it", target_id)
+    return future, not is_owner
+
+
+# 按ID检查监控目标并提交结果（在后台线程中运行，使用独立的应用上下文）
+def check_target_by_id(target_id):
+    from app import app, db, MonitorTarget
+    from monitor import process_target
+    from query_budget import track_job
+
+    with app.app_context():
+        target = db.session.get(MonitorTarget, target_id)
+        if target is None:
+            raise ValueError(f"监控目标不存在: {target_id}")
+
+        try:
+            with track_job(f'check_target:{target_id}'):
+                result = process_target(target)
+                db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        logger.info("Background check completed for %s", target.name)
+        return result
+
+
+# 一次手动检查任务，可包含一个或多个监控目标
+class CheckJob:
+    def __init__(self, target_ids, submitted_by=None):
+        self.id = uuid.uuid4().hex
+        self.target_ids = list(target_ids)
+        self.submitted_by = submitted_by
+        self.created_at = datetime.utcnow()
+        self.futures = {}
+        self.joined = set()
+
+    def start(self):
+        for target_id in self.target_ids:
+            future, joined = submit_check(target_id)
+            self.futures[target_id] = future
+            if joined:
+                self.joined.add(target_id)
+
+    @property
+    def done(self):
+        return all(future.done() for future in self.futures.values())
+
+    def to_dict(self):
+        results = []
+        failed = 0
+        for target_id in self.target_ids:
+            future = self.futures.get(target_id)
+            item = {'target_id': target_id, 'joined': target_id in self.joined}
+            if future is None or not future.done():
+                item['status'] = 'running'
+            elif future.exception() is not None:
+                failed += 1
+                item['status'] = 'failed'
+                item['error'] = str(future.exception())
+            else:
+                item['status'] = 'done'
+                item['result'] = future.result()
+            results.append(item)
+
+        if not self.done:
+            status = 'running'
+        elif self.target_ids and failed == len(self.target_ids):
+            status = 'failed'
+        else:
+            status = 'done'
+
+        return {
+            'job_id': self.id,
+            'status': status,
+            'submitted_by': self.submitted_by,
+            'created_at': self.created_at.isoformat(),
+            'total': len(self.target_ids),
+            'completed': sum(1 for item in results if item['status'] != 'running'),
+            'failed': failed,
+            'results': results
+        }
+
+
+# 提交检查任务并立即返回
+def submit_job(target_ids, submitted_by=None):
+    job = CheckJob(target_ids, submitted_by)
+    with _jobs_lock:
+        _jobs[job.id] = job
+        # 只淘汰已完成的旧任务，进行中的任务始终可以查询
+        while len(_jobs) > JOB_HISTORY_LIMIT:
+            oldest_id, oldest = next(iter(_jobs.items()))
+            if not oldest.done:
+                break
+            del _jobs[oldest_id]
+    job.start()
+    logger.info(f"Submitted check job {job.id} for {len(job.target_ids)} target(s)")
+    return job
+
+
+# 根据ID获取检查任务
+def get_job(job_id):
+    with _jobs_lock:
+        return _jobs.get(job_id)
@@ -0,0 +1,232 @@
+import os
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# 日志配置
+#
+# 业务代码只把日志记录放入一个有界队列（QueueHandler），由后台的监听线程（QueueListener）
+# 格式化并写入文件和控制台，监控线程不再等待磁盘I/O：
+#   - LOG_FORMAT=json 时每行输出一个JSON对象，便于日志采集；默认为文本格式
+#   - 日志文件按大小轮转（LOG_MAX_BYTES / LOG_BACKUP_COUNT）
+#   - LOG_LEVELS 按logger设置级别，如 monitor=WARNING,hedging=DEBUG
+#   - 同一条日志模板（logger + 未格式化的消息，如 "Checking stock status for: %s"）对同一个目标在
+#     LOG_RATE_WINDOW 秒内最多输出 LOG_RATE_LIMIT 条，超出的被丢弃，
+#     窗口结束后的第一条日志附带被省略的数量；ERROR及以上级别不受限制。目标取日志的 target_id
+#     （extra={'target_id': ...}），没有时取第一个参数（通常是目标名称或URL），一个频繁出错的目标
+#     不会使其他目标的同一条日志被丢弃
+#   - 队列已满时丢弃新的日志并计数，不阻塞调用方
+# 逐个目标输出的日志使用 %s 参数而不是f-string：被过滤或限流的日志不需要格式化，
+# 格式化在监听线程中进行，而且同一模板的日志可以按模板限流。
+
+LOG_FILE = os.environ.get('LOG_FILE', 'logs/app.log')
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+# 按logger设置的级别，逗号分隔的 名称=级别
+LOG_LEVELS = os.environ.get('LOG_LEVELS', 'apscheduler=WARNING,urllib3=WARNING,tzlocal=WARNING')
+# text 或 json
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text').lower()
+# 日志文件轮转的大小(字节)和保留的文件数，LOG_MAX_BYTES=0 表示不轮转（多个进程写同一文件时使用外部轮转）
+LOG_MAX_BYTES = int(os.environ.get('LOG_MAX_BYTES', 10 * 1024 * 1024))
+LOG_BACKUP_COUNT = int(os.environ.get('LOG_BACKUP_COUNT', 5))
+# 是否通过队列和后台线程写日志，0表示在调用线程中直接写入
+LOG_ASYNC = os.environ.get('LOG_ASYNC', '1') != '0'
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# 同一日志模板在窗口内最多输出的条数，0表示不限流
+LOG_RATE_LIMIT = int(os.environ.get('LOG_RATE_LIMIT', 100))
+LOG_RATE_WINDOW = float(os.environ.get('LOG_RATE_WINDOW', 60))
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# 参数为这些类型时才延迟到监听线程中格式化，其他对象可能在格式化之前被修改
+_IMMUTABLE_ARGS = (str, int, float, bool, type(None))
+# 限流分桶数量的上限，超出时清理过期的分桶
+MAX_RATE_BUCKETS = 50000
+
+
+# 每条日志输出为一行JSON，字段与文本格式相同
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        if getattr(record, 'suppressed', 0):
+            # 只在第一行后附加，保持“时间 - 来源 - 级别 - 消息”的格式
+            first, sep, rest = text.partition('\n')
+            text = f"{first} (省略了{record.suppressed}条相似日志){sep}{rest}"
+        return text
+
+
+# 日志对应的目标：target_id，没有时取第一个参数
+def rate_limit_subject(record):
+    target_id = getattr(record, 'target_id', None)
+    if target_id is not None:
+        return target_id
+    args = record.args
+    if isinstance(args, tuple) and args and isinstance(args[0], (str, int)):
+        return args[0]
+    return None
+
+
+# 按日志模板限流：同一 (logger, 模板, 目标) 在窗口内超过 LOG_RATE_LIMIT 条后丢弃
+class RateLimitFilter(logging.Filter):
+    def __init__(self, limit=LOG_RATE_LIMIT, window=LOG_RATE_WINDOW):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.lock = threading.Lock()
+        # (logger, 模板, 目标) -> [窗口开始时间, 已输出条数, 已省略条数]
+        self.buckets = {}
+        self.suppressed_total = 0
+
+    def filter(self, record):
+        # 不使用队列时每个处理器都会调用过滤器，同一条日志只判断一次
+        decision = getattr(record, 'rate_limited', None)
+        if decision is not None:
+            return not decision
+        record.rate_limited = not self._allow(record)
+        return not record.rate_limited
+
+    def _allow(self, record):
+        if self.limit <= 0 or record.levelno >= logging.ERROR:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else id(record.msg), rate_limit_subject(record))
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None or now - bucket[0] >= self.window:
+                suppressed = bucket[2] if bucket is not None else 0
+                self.buckets[key] = [now, 1, 0]
+                if len(self.buckets) > MAX_RATE_BUCKETS:
+                    # 模板或目标数量异常（例如f-string日志），清理过期的分桶；仍然过多时全部清除
+                    self.buckets = {k: v for k, v in self.buckets.items() if now - v[0] < self.window}
+                    if len(self.buckets) > MAX_RATE_BUCKETS // 2:
+                        self.buckets = {key: self.buckets[key]}
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if bucket[1] < self.limit:
+                bucket[1] += 1
+                return True
+            bucket[2] += 1
+            self.suppressed_total += 1
+            return False
+
+
+# 放入有界队列的日志处理器：队列已满时丢弃日志，不阻塞调用方
+class BoundedQueueHandler(QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    # 只在调用线程中处理异常信息和可变参数，其余格式化留给监听线程
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        if record.args and not all(isinstance(arg, _IMMUTABLE_ARGS) for arg in (
+                record.args.values() if isinstance(record.args, dict) else record.args)):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+
+# 解析 LOG_LEVELS
+def parse_levels(value):
+    levels = {}
+    for item in (value or '').split(','):
+        name, sep, level = item.partition('=')
+        if sep and name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+_listener = None
+_queue_handler = None
+_rate_limit = None
+
+
+# 配置根logger，返回调用模块的logger
+def setup_logging(name=None):
+    global _listener, _queue_handler, _rate_limit
+
+    formatter = JsonFormatter() if LOG_FORMAT == 'json' else TextFormatter(TEXT_FORMAT)
+    handlers = []
+    if LOG_FILE:
+        os.makedirs(os.path.dirname(LOG_FILE) or '.', exist_ok=True)
+        if LOG_MAX_BYTES > 0:
+            handlers.append(RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT,
+                                                encoding='utf-8'))
+        else:
+            handlers.append(logging.FileHandler(LOG_FILE, encoding='utf-8'))
+    handlers.append(logging.StreamHandler())
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for logger_name, level in parse_levels(LOG_LEVELS).items():
+        logging.getLogger(logger_name).setLevel(level)
+
+    _rate_limit = RateLimitFilter()
+    if LOG_ASYNC:
+        _queue_handler = BoundedQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _queue_handler.addFilter(_rate_limit)
+        root.addHandler(_queue_handler)
+        _listener = QueueListener(_queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        # 退出时写完队列中剩余的日志
+        atexit.register(_listener.stop)
+    else:
+        for handler in handlers:
+            handler.addFilter(_rate_limit)
+            root.addHandler(handler)
+    return logging.getLogger(name)
+
+
+# 在日志管道中增加一个处理器（例如全文搜索索引），与文件和控制台处理器一样经过限流，
+# 异步模式下在监听线程中调用
+def add_handler(handler):
+    if _listener is not None:
+        _listener.handlers = _listener.handlers + (handler,)
+    else:
+        if _rate_limit is not None:
+            handler.addFilter(_rate_limit)
+        logging.getLogger().addHandler(handler)
+
+
+# 日志管道的统计：队列中等待写入、因队列已满丢弃和被限流省略的日志数量
+def logging_stats():
+    return {
+        'async': _queue_handler is not None,
+        'format': LOG_FORMAT,
+        'queued': _queue_handler.queue.qsize() if _queue_handler is not None else 0,
+        'dropped': _queue_handler.dropped if _queue_handler is not None else 0,
+        'suppressed': _rate_limit.suppressed_total if _rate_limit is not None else 0,
+    }
@@ -0,0 +1,372 @@
+import logging
+import re
+from collections import namedtuple
+from functools import lru_cache
+from status_messages import check_message
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 可选依赖：pyahocorasick 提供C实现的Aho-Corasick自动机，
+# 未安装时退化为逐个关键词的 str 查找（同样是C实现，只是需要多次扫描）
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# 文本检查的多条件规则语法（检查模式以 expr: 开头）：
+#
+#   expr: "Add to cart"i & !"Out of Stock"i & !/sold\s*out/i
+#
+#   "文本"      区分大小写的关键词；后缀 i 表示忽略大小写
+#   /正则/标志  正则表达式，支持标志 i、m、s
+#   裸词        不含空白和运算符的关键词，如 有货
+#   & | !       与、或、非（也可写作 AND、OR、NOT），支持括号
+#
+# 不以 expr: 开头的检查模式保持原有行为：区分大小写的单个子串匹配。
+EXPR_PREFIX = 'expr:'
+
+
+class Term(namedtuple('Term', ['kind', 'value', 'flags'])):
+    __slots__ = ()
+
+    @property
+    def ignore_case(self):
+        return 'i' in self.flags
+
+
+class RuleSyntaxError(ValueError):
+    pass
+
+
+_TOKEN_RE = re.compile(r'''
+    \s*(?:
+        (?P<lparen>\()
+      | (?P<rparen>\))
+      | (?P<op>&&?|\|\|?|!)
+      | "(?P<literal>(?:[^"\\]|\\.)*)"(?P<literal_flags>i?)
+      | /(?P<regex>(?:[^/\\]|\\.)+)/(?P<regex_flags>[ims]*)
+      | (?P<word>[^\s()&|!"/]+)
+    )''', re.VERBOSE)
+
+_KEYWORDS = {'and': '&', 'or': '|', 'not': '!'}
+
+
+def _tokenize(source):
+    tokens = []
+    position = 0
+    source = source.rstrip()
+    while position < len(source):
+        match = _TOKEN_RE.match(source, position)
+        if not match or match.end() == position:
+            raise RuleSyntaxError(f'无法解析规则，位置 {position}: {source[position:position + 20]}')
+        position = match.end()
+        if match.group('lparen'):
+            tokens.append(('(', None))
+        elif match.group('rparen'):
+            tokens.append((')', None))
+        elif match.group('op'):
+            tokens.append((match.group('op')[0], None))
+        elif match.group('literal') is not None:
+            value = re.sub(r'\\(.)', r'\1', match.group('literal'))
+            if not value:
+                raise RuleSyntaxError('关键词不能为空')
+            tokens.append(('term', Term('literal', value, match.group('literal_flags'))))
+        elif match.group('regex') is not None:
+            tokens.append(('term', Term('regex', match.group('regex').replace('\\/', '/'), ''.join(sorted(set(match.group('regex_flags')))))))
+        else:
+            word = match.group('word')
+            if word.lower() in _KEYWORDS:
+                tokens.append((_KEYWORDS[word.lower()], None))
+            else:
+                tokens.append(('term', Term('literal', word, '')))
+    return tokens
+
+
+# 递归下降解析：or := and ('|' and)*；and := unary ('&' unary)*；unary := '!' unary | atom
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        return self.tokens[self.position][0] if self.position < len(self.tokens) else None
+
+    def take(self):
+        token = self.tokens[self.position]
+        self.position += 1
+        return token
+
+    def parse(self):
+        node = self.parse_or()
+        if self.peek() is not None:
+            raise RuleSyntaxError(f'多余的内容: {self.peek()}')
+        return node
+
+    def parse_or(self):
+        nodes = [self.parse_and()]
+        while self.peek() == '|':
+            self.take()
+            nodes.append(self.parse_and())
+        return nodes[0] if len(nodes) == 1 else ('or', tuple(nodes))
+
+    def parse_and(self):
+        nodes = [self.parse_unary()]
+        while self.peek() == '&':
+            self.take()
+            nodes.append(self.parse_unary())
+        return nodes[0] if len(nodes) == 1 else ('and', tuple(nodes))
+
+    def parse_unary(self):
+        if self.peek() == '!':
+            self.take()
+            return ('not', self.parse_unary())
+        if self.peek() == '(':
+            self.take()
+            node = self.parse_or()
+            if self.peek() != ')':
+                raise RuleSyntaxError('缺少右括号')
+            self.take()
+            return node
+        if self.peek() == 'term':
+            return ('term', self.take()[1])
+        raise RuleSyntaxError('规则不完整' if self.peek() is None else f'意外的符号: {self.peek()}')
+
+
+@lru_cache(maxsize=1024)
+def compile_regex(pattern, flags=''):
+    re_flags = 0
+    if 'i' in flags:
+        re_flags |= re.IGNORECASE
+    if 'm' in flags:
+        re_flags |= re.MULTILINE
+    if 's' in flags:
+        re_flags |= re.DOTALL
+    return re.compile(pattern, re_flags)
+
+
+# 编译后的文本规则
+class Rule:
+    def __init__(self, source, node, terms, is_expression):
+        self.source = source
+        self.node = node
+        self.terms = terms
+        self.is_expression = is_expression
+
+    def evaluate(self, hits):
+        return _evaluate(self.node, hits)
+
+    # 只根据已命中的关键词判断结果，无法确定时返回None
+    def evaluate_partial(self, hits):
+        return _evaluate_partial(self.node, hits)
+
+    def describe(self, term):
+        if term.kind == 'regex':
+            return f'/{term.value}/{term.flags}'
+        return f'"{term.value}"i' if term.ignore_case else term.value
+
+
+def _evaluate(node, hits):
+    kind = node[0]
+    if kind == 'term':
+        return node[1] in hits
+    if kind == 'not':
+        return not _evaluate(node[1], hits)
+    if kind == 'and':
+        return all(_evaluate(child, hits) for child in node[1])
+    return any(_evaluate(child, hits) for child in node[1])
+
+
+# 三值逻辑求值：尚未命中的关键词视为未知(None)，用于流式匹配时提前判断结果
+def _evaluate_partial(node, hits):
+    kind = node[0]
+    if kind == 'term':
+        return True if node[1] in hits else None
+    if kind == 'not':
+        value = _evaluate_partial(node[1], hits)
+        return None if value is None else not value
+    values = [_evaluate_partial(child, hits) for child in node[1]]
+    if kind == 'and':
+        if False in values:
+            return False
+        return None if None in values else True
+    if True in values:
+        return True
+    return None if None in values else False
+
+
+def _collect_terms(node, terms):
+    if node[0] == 'term':
+        if node[1] not in terms:
+            terms.append(node[1])
+    elif node[0] == 'not':
+        _collect_terms(node[1], terms)
+    else:
+        for child in node[1]:
+            _collect_terms(child, terms)
+
+
+# 编译文本检查模式（带缓存），语法错误时抛出RuleSyntaxError
+@lru_cache(maxsize=4096)
+def compile_rule(pattern):
+    pattern = pattern or ''
+    if not pattern.lstrip().startswith(EXPR_PREFIX):
+        term = Term('literal', pattern, '')
+        return Rule(pattern, ('term', term), (term,), False)
+
+    source = pattern.lstrip()[len(EXPR_PREFIX):]
+    node = _Parser(_tokenize(source)).parse()
+    terms = []
+    _collect_terms(node, terms)
+    for term in terms:
+        if term.kind == 'regex':
+            try:
+                compile_regex(term.value, term.flags)
+            except re.error as e:
+                raise RuleSyntaxError(f'正则表达式无效: {str(e)}')
+    return Rule(pattern, node, tuple(terms), True)
+
+
+# 关键词集合匹配器：一次扫描找出文本中出现的所有关键词
+# 空关键词与 '' in text 一致，总是命中（自动机不接受空关键词，单独处理）
+class LiteralSetMatcher:
+    def __init__(self, literals):
+        self.literals = tuple(literals)
+        self.automaton = None
+        words = [literal for literal in self.literals if literal]
+        if ahocorasick is not None and len(words) > 1:
+            automaton = ahocorasick.Automaton()
+            for literal in words:
+                automaton.add_word(literal, literal)
+            automaton.make_automaton()
+            self.automaton = automaton
+            self.always = {''} if len(words) < len(self.literals) else set()
+
+    def find(self, text):
+        if self.automaton is None:
+            return {literal for literal in self.literals if literal in text}
+        found = set(self.always)
+        total = len(self.literals)
+        for _, literal in self.automaton.iter(text):
+            found.add(literal)
+            if len(found) == total:
+                break
+        return found
+
+
+@lru_cache(maxsize=1024)
+def build_literal_matcher(literals):
+    return LiteralSetMatcher(literals)
+
+
+# 单个页面的扫描结果，同一页面上的所有目标规则共享一次扫描
+class PageScan:
+    def __init__(self, content, rules=(), results=None):
+        self.content = content
+        self._lowered = None
+        # results: 预先计算好的关键词结果（例如来自流式扫描）
+        self._results = dict(results or {})
+        self._pending = set()
+        for rule in rules:
+            self._pending.update(rule.terms)
+
+    @property
+    def lowered(self):
+        if self._lowered is None:
+            self._lowered = self.content.lower()
+        return self._lowered
+
+    # 扫描尚未计算过的关键词（包括预先登记的其他目标的关键词）
+    def _scan(self, terms):
+        pending = {term for term in terms if term not in self._results}
+        pending.update(term for term in self._pending if term not in self._results)
+        self._pending.clear()
+        if not pending:
+            return
+
+        sensitive = sorted({term.value for term in pending if term.kind == 'literal' and not term.ignore_case})
+        insensitive = sorted({term.value.lower() for term in pending if term.kind == 'literal' and term.ignore_case})
+        found_sensitive = build_literal_matcher(tuple(sensitive)).find(self.content) if sensitive else set()
+        found_insensitive = build_literal_matcher(tuple(insensitive)).find(self.lowered) if insensitive else set()
+
+        for term in pending:
+            if term.kind == 'regex':
+                self._results[term] = compile_regex(term.value, term.flags).search(self.content) is not None
+            elif term.ignore_case:
+                self._results[term] = term.value.lower() in found_insensitive
+            else:
+                self._results[term] = term.value in found_sensitive
+
+    # 返回(是否匹配, 命中的关键词列表)
+    def evaluate(self, rule):
+        self._scan(rule.terms)
+        hits = {term for term in rule.terms if self._results.get(term)}
+        return rule.evaluate(hits), [rule.describe(term) for term in rule.terms if term in hits]
+
+
+# 流式扫描：逐块匹配已解码的文本，所有规则结果确定后即可停止读取
+# 块之间保留一段重叠文本，避免关键词跨块时漏匹配；正则表达式只在
+# 重叠窗口（STREAM_REGEX_OVERLAP个字符）内跨块匹配
+STREAM_REGEX_OVERLAP = 4096
+
+
+class StreamScanner:
+    def __init__(self, rules):
+        self.rules = list(rules)
+        terms = set()
+        for rule in self.rules:
+            terms.update(rule.terms)
+        self.literal_terms = [term for term in terms if term.kind == 'literal']
+        self.regex_terms = [term for term in terms if term.kind == 'regex']
+        self.sensitive = build_literal_matcher(tuple(sorted({t.value for t in self.literal_terms if not t.ignore_case})))
+        self.insensitive = build_literal_matcher(tuple(sorted({t.value.lower() for t in self.literal_terms if t.ignore_case})))
+
+        longest = max((len(term.value) for term in self.literal_terms), default=0)
+        self.overlap = max(longest - 1, STREAM_REGEX_OVERLAP if self.regex_terms else 0)
+        self.hits = set()
+        self.results = {}
+        self.decided = not self.rules
+        self._tail = ''
+
+    def feed(self, text):
+        if self.decided or not text:
+            return self.decided
+        window = self._tail + text
+
+        found_sensitive = self.sensitive.find(window) if self.sensitive.literals else set()
+        found_insensitive = self.insensitive.find(window.lower()) if self.insensitive.literals else set()
+        for term in self.literal_terms:
+            if term in self.hits:
+                continue
+            if (term.value.lower() in found_insensitive) if term.ignore_case else (term.value in found_sensitive):
+                self.hits.add(term)
+        for term in self.regex_terms:
+            if term not in self.hits and compile_regex(term.value, term.flags).search(window):
+                self.hits.add(term)
+
+        self._tail = window[-self.overlap:] if self.overlap else ''
+        self.decided = all(rule.evaluate_partial(self.hits) is not None for rule in self.rules)
+        return self.decided
+
+    # 读取结束（或提前停止）后，未命中的关键词记为不存在
+    def finish(self):
+        for term in self.literal_terms + self.regex_terms:
+            self.results[term] = term in self.hits
+        return self.results
+
+
+# 对文本内容执行检查模式，返回(是否有库存, 结果消息)
+def match_text(pattern, content, page=None):
+    rule = compile_rule(pattern)
+    page = page or PageScan(content)
+    matched, hit_terms = page.evaluate(rule)
+
+    if not rule.is_expression:
+        if matched:
+            return True, check_message('text_found', pattern=pattern)
+        return False, check_message('text_missing', pattern=pattern)
+
+    hits_text = ', '.join(hit_terms) if hit_terms else '无'
+    if matched:
+        return True, check_message('rule_matched', hits=hits_text)
+    return False, check_message('rule_unmatched', hits=hits_text)
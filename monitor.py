@@ -1,11 +1,26 @@
-import logging
+import codecs
+import itertools
+import json
 import logging
 import os
 import requests
+import resource
+import threading
 import time
+from collections import deque
 from datetime import datetime
-from bs4 import BeautifulSoup
-from app import app, db, MonitorTarget, StatusCheck, NotificationSetting
+from urllib.parse import urlsplit
+from app import app, db, MonitorTarget, StatusCheck
+from matcher import PageScan, RuleSyntaxError, StreamScanner, compile_rule, match_text
+from extractors import ExtractorSpecError, describe_product, extract_products
+from evaluation import get_evaluation_pool
+from snapshots import SNAPSHOT_STORE, save_snapshot
+from config_snapshot import bump_config_version, get_config_snapshot
+from proxies import get_proxy_pool
+from hedging import DIRECT, FETCH_HEDGING, SOLVER, ChallengeError, hedged_fetch, is_challenge
+from status_history import record_check
+from status_messages import check_message
+from outbox import OUTBOX_SEND_TIMEOUT, NotificationConfigError, enqueue_notification
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -16,89 +31,479 @@ FLARESOLVERR_URL = os.environ.get('FLARESOLVERR_URL', 'http://localhost:8191/v1'
 # 使用FlareSolverr获取页面内容
 def get_page_with_flaresolverr(url):
     try:
-        payload = {
-            "cmd": "request.get",
-            "url": url,
-            "maxTimeout": 60000
-        }
-        response = requests.post(FLARESOLVERR_URL, json=payload)
-        data = response.json()
-        
-        if data.get("status") == "ok":
-            logger.info(f"Successfully fetched {url} using FlareSolverr")
-            return data["solution"]["response"]
-        else:
-            logger.error(f"Failed to fetch {url} with FlareSolverr: {data.get('message')}")
-            return None
+        # 配置了代理池时，由FlareSolverr通过分配的代理访问目标页面
+        with get_proxy_pool().acquire(urlsplit(url).hostname) as lease:
+            payload = {
+                "cmd": "request.get",
+                "url": url,
+                "maxTimeout": 60000
+            }
+            payload.update(lease.flaresolverr_payload())
+            try:
+                response = requests.post(FLARESOLVERR_URL, json=payload)
+                data = response.json()
+            except Exception:
+                # FlareSolverr本身不可用，与代理无关
+                lease.mark(success=True)
+                raise
+            
+            if data.get("status") == "ok":
+                lease.mark(data["solution"].get("status"))
+                logger.info("Successfully fetched %s using FlareSolverr", url)
+                return data["solution"]["response"]
+            else:
+                lease.mark(success=lease.url is None or 'proxy' not in str(data.get('message', '')).lower())
+                logger.error("Failed to fetch %s with FlareSolverr: %s", url, data.get('message'))
+                return None
     except Exception as e:
-        logger.error(f"Error using FlareSolverr for {url}: {str(e)}")
+        logger.error("Error using FlareSolverr for %s: %s", url, str(e))
         return None
 
+# 流式读取的块大小
+STREAM_CHUNK_SIZE = 16 * 1024
+# 单次直接抓取的默认最大下载字节数（解压后），可被监控目标的max_bytes覆盖
+FETCH_MAX_BYTES = int(os.environ.get('FETCH_MAX_BYTES', 5 * 1024 * 1024))
+# 文本检查是否使用流式匹配（结果确定后提前停止下载）
+STREAM_FETCH = os.environ.get('STREAM_FETCH', '1') != '0'
+
+# 直接抓取的字节统计，每个监控周期重置一次
+class FetchStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self.lock:
+            self.fetches = 0
+            self.early_stops = 0
+            self.truncated = 0
+            self.bytes_read = 0
+            self.bytes_saved = 0
+    
+    def record(self, bytes_read, bytes_saved, early_stop, truncated):
+        with self.lock:
+            self.fetches += 1
+            self.bytes_read += bytes_read
+            self.bytes_saved += bytes_saved
+            self.early_stops += int(early_stop)
+            self.truncated += int(truncated)
+    
+    def to_dict(self):
+        with self.lock:
+            return {
+                'fetches': self.fetches,
+                'early_stops': self.early_stops,
+                'truncated': self.truncated,
+                'bytes_read': self.bytes_read,
+                'bytes_saved': self.bytes_saved
+            }
+
+fetch_stats = FetchStats()
+
+# 每个监控周期按块提交：处理完这么多目标后提交一次并清空会话，
+# 会话中的对象和页面内容不会随目标数量增长，某一块提交失败也只回滚这一块
+MONITOR_CHUNK_SIZE = max(int(os.environ.get('MONITOR_CHUNK_SIZE', 200)), 1)
+
+# 进程的常驻内存(MB)，读取失败时返回None
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return pages * resource.getpagesize() / (1024 * 1024)
+
+# 进程常驻内存的峰值(MB)，Linux上ru_maxrss单位为KB
+def peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# 监控周期的分块提交和内存统计，每个周期开始时重置
+class CycleStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+    
+    def reset(self):
+        with self.lock:
+            self.chunks = 0
+            self.failed_chunks = 0
+            self.rolled_back = 0
+            self.rss_start_mb = current_rss_mb()
+            self.peak_start_mb = peak_rss_mb()
+    
+    def record_chunk(self, targets, committed):
+        with self.lock:
+            self.chunks += 1
+            if not committed:
+                self.failed_chunks += 1
+                self.rolled_back += targets
+    
+    def to_dict(self):
+        with self.lock:
+            rss_end = current_rss_mb()
+            peak = peak_rss_mb()
+            return {
+                'chunk_size': MONITOR_CHUNK_SIZE,
+                'chunks': self.chunks,
+                'failed_chunks': self.failed_chunks,
+                'rolled_back_targets': self.rolled_back,
+                'rss_start_mb': round(self.rss_start_mb, 2) if self.rss_start_mb is not None else None,
+                'rss_end_mb': round(rss_end, 2) if rss_end is not None else None,
+                # 峰值是进程级的高水位，本周期没有超过之前的峰值时增长为0
+                'peak_rss_mb': round(peak, 2),
+                'peak_rss_growth_mb': round(peak - self.peak_start_mb, 2)
+            }
+
+cycle_stats = CycleStats()
+
 # 直接使用requests获取页面内容
-def get_page_direct(url):
+# 以流式方式读取并解码：提供stream_scanner时逐块匹配，结果确定后立即停止读取；
+# 超过max_bytes时截断，避免超大页面占用内存
+def get_page_direct(url, max_bytes=None, stream_scanner=None):
     try:
-        headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-        }
-        response = requests.get(url, headers=headers, timeout=30)
-        response.raise_for_status()
-        logger.info(f"Successfully fetched {url} directly")
-        return response.text
+        return read_page_direct(url, max_bytes, stream_scanner)
     except Exception as e:
-        logger.error(f"Error fetching {url} directly: {str(e)}")
+        logger.error("Error fetching %s directly: %s", url, str(e))
         return None
 
-# 根据监控目标类型检查库存状态
-def check_stock_status(monitor_target):
+# 直接请求页面，失败时抛出异常；返回Cloudflare验证页面时抛出ChallengeError
+# cancel被设置时（对冲抓取中另一方已胜出）停止读取并返回None
+def read_page_direct(url, max_bytes=None, stream_scanner=None, cancel=None):
+    headers = {
+        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+        # 协商压缩传输（gzip/deflate，安装brotli后还包括br）
+        "Accept-Encoding": requests.utils.DEFAULT_ACCEPT_ENCODING
+    }
+    max_bytes = max_bytes or FETCH_MAX_BYTES
+    
+    with get_proxy_pool().acquire(urlsplit(url).hostname) as lease, \
+            requests.get(url, headers=headers, timeout=30, stream=True, **lease.requests_kwargs()) as response:
+        lease.mark(response.status_code)
+        try:
+            decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+        except LookupError:
+            decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+        
+        # 先检查响应头和第一块内容是否为Cloudflare验证页面
+        first = next(chunks, b'')
+        if is_challenge(response.status_code, response.headers, first.decode('latin-1')):
+            raise ChallengeError(f"Challenge page returned (HTTP {response.status_code})")
+        response.raise_for_status()
+        
+        parts = []
+        bytes_read = 0
+        early_stop = False
+        truncated = False
+        cancelled = False
+        for chunk in itertools.chain([first], chunks):
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                break
+            if bytes_read + len(chunk) > max_bytes:
+                chunk = chunk[:max_bytes - bytes_read]
+                truncated = True
+            bytes_read += len(chunk)
+            text = decoder.decode(chunk)
+            parts.append(text)
+            if stream_scanner is not None and stream_scanner.feed(text):
+                early_stop = True
+                truncated = False
+                break
+            if truncated:
+                break
+        else:
+            parts.append(decoder.decode(b'', final=True))
+        
+        # 提前停止时，根据Content-Length估算节省的传输字节数
+        bytes_saved = 0
+        if early_stop or truncated or cancelled:
+            content_length = response.headers.get('Content-Length')
+            if content_length and content_length.isdigit():
+                bytes_saved = max(0, int(content_length) - response.raw.tell())
+    
+    fetch_stats.record(bytes_read, bytes_saved, early_stop, truncated)
+    if cancelled:
+        logger.info("Direct fetch of %s cancelled after %d bytes", url, bytes_read)
+        return None
+    if stream_scanner is not None:
+        stream_scanner.finish()
+    if truncated:
+        logger.warning("Fetched %s truncated at %d bytes (limit %d)", url, bytes_read, max_bytes)
+    elif early_stop:
+        logger.info("Fetched %s directly, stopped early after %d bytes", url, bytes_read)
+    else:
+        logger.info("Successfully fetched %s directly", url)
+    return ''.join(parts)
+
+# 获取页面内容，返回(页面内容, 抓取方式)
+# 启用对冲抓取时直接请求与FlareSolverr竞速（见 hedging.py），否则根据监控目标配置选择
+def fetch_page(monitor_target, stream_scanner=None):
+    url = monitor_target.url
+    if not FETCH_HEDGING:
+        if monitor_target.use_flaresolverr:
+            return get_page_with_flaresolverr(url), SOLVER
+        return get_page_direct(url, monitor_target.max_bytes, stream_scanner), DIRECT
+    
+    return hedged_fetch(
+        urlsplit(url).hostname,
+        monitor_target.use_flaresolverr,
+        lambda cancel: read_page_direct(url, monitor_target.max_bytes, stream_scanner, cancel),
+        lambda cancel: get_page_with_flaresolverr(url)
+    )
+
+# 页面分组键：URL和抓取方式都相同的目标共享同一次抓取
+def page_key(monitor_target):
+    return (monitor_target.url, bool(monitor_target.use_flaresolverr))
+
+# 需要解析HTML的检查类型
+PARSED_CHECK_TYPES = ('selector', 'extractor', 'product')
+
+# 提取器目标发现新产品时是否自动创建子目标
+EXTRACTOR_AUTO_CREATE = os.environ.get('EXTRACTOR_AUTO_CREATE', '1') != '0'
+
+# 同一监控周期内共享的页面：内容只抓取一次，文本规则只扫描一次，HTML只解析一次
+class SharedPage:
+    def __init__(self, rules=(), streaming=False):
+        self.rules = rules
+        # 组内全部是直接抓取的文本检查时，可以流式匹配并提前停止
+        self.streaming = streaming
+        self.fetched = False
+        self.content = None
+        self.source = None
+        self.fetch_time = 0
+        self._scan = None
+        self._soup = None
+        self._products = None
+        self._selections = None
+        self._evaluation = None
+        # 离线（页面快照）时不发出任何网络请求
+        self.offline = False
+    
+    # 为一组共享页面的目标创建SharedPage
+    @classmethod
+    def for_targets(cls, targets):
+        rules = collect_text_rules(targets)
+        # 对冲抓取时勾选了FlareSolverr的目标也会先直接请求，同样可以流式匹配
+        streaming = STREAM_FETCH and bool(rules) and len(rules) == len(targets) and (FETCH_HEDGING or not any(
+            target.use_flaresolverr for target in targets
+        ))
+        return cls(rules, streaming)
+    
+    # 用已保存的页面内容（快照）创建SharedPage，检查时不发出网络请求
+    @classmethod
+    def from_content(cls, targets, content, source=None):
+        page = cls(collect_text_rules(targets))
+        page.content = content
+        page.source = source
+        page.fetched = True
+        page.offline = True
+        return page
+    
+    def load(self, monitor_target):
+        if not self.fetched:
+            start_time = time.time()
+            partial = False
+            if self.streaming:
+                scanner = StreamScanner(self.rules)
+                self.content, self.source = fetch_page(monitor_target, scanner)
+                # FlareSolverr胜出时流式匹配的结果不完整，改为扫描完整页面
+                if self.content is not None and self.source == DIRECT:
+                    self._scan = PageScan(self.content, self.rules, scanner.results)
+                    # 结果确定后提前停止了下载
+                    partial = scanner.decided
+            else:
+                self.content, self.source = fetch_page(monitor_target)
+            self.fetch_time = (time.time() - start_time) * 1000
+            self.fetched = True
+            if SNAPSHOT_STORE and self.content:
+                try:
+                    save_snapshot(monitor_target.url, self.content, monitor_target.id, self.source, partial)
+                except Exception as e:
+                    logger.error(f"Error saving page snapshot of {monitor_target.url}: {str(e)}")
+        return self.content
+    
+    @property
+    def scan(self):
+        if self._scan is None:
+            self._scan = PageScan(self.content, self.rules)
+        return self._scan
+    
+    @property
+    def soup(self):
+        if self._soup is None:
+            # 只有选择器和提取器目标需要解析HTML，按需导入bs4
+            from bs4 import BeautifulSoup
+            self._soup = BeautifulSoup(self.content, 'html.parser')
+        return self._soup
+    
+    # 把组内选择器和提取器目标的解析交给解析进程池（见 evaluation.py），返回是否已提交
+    def submit_evaluation(self, targets):
+        pool = get_evaluation_pool()
+        if pool is None or not self.content:
+            return False
+        selectors = {target.check_pattern for target in targets if target.check_type == 'selector' and target.check_pattern}
+        extractors = {target.check_pattern for target in targets if target.check_type == 'extractor'}
+        extractors.update(target.parent_pattern for target in targets
+                          if target.check_type == 'product' and target.parent_pattern is not None)
+        if not selectors and not extractors:
+            return False
+        self._evaluation = pool.submit(self.content, sorted(selectors), sorted(extractors))
+        return True
+    
+    # 解析进程池返回的结果；未提交或解析失败时返回None，由调用方在本进程中解析
+    def _evaluated(self, kind, key):
+        if self._evaluation is None:
+            return None
+        try:
+            results = self._evaluation.result()
+        except Exception as e:
+            logger.error(f"Evaluation process failed, parsing in process: {str(e)}")
+            self._evaluation = None
+            return None
+        error = results['errors'].get((kind, key))
+        if error is not None:
+            error_type, error_message = error
+            raise ExtractorSpecError(error_message) if error_type == 'ExtractorSpecError' else RuntimeError(error_message)
+        bucket = results['selectors'] if kind == 'selector' else results['products']
+        if key not in bucket:
+            return None
+        return (bucket[key],)
+    
+    # CSS选择器匹配的元素文本列表，没有匹配元素时返回None
+    def select_texts(self, selector):
+        if self._selections is None:
+            self._selections = {}
+        if selector not in self._selections:
+            evaluated = self._evaluated('selector', selector)
+            if evaluated is not None:
+                self._selections[selector] = evaluated[0]
+            else:
+                self._selections[selector] = [element.get_text().strip() for element in self.soup.select(selector)] or None
+        return self._selections[selector]
+    
+    # 提取页面上的所有产品记录，同一提取器配置只解析一次
+    def products(self, pattern):
+        if self._products is None:
+            self._products = {}
+        if pattern not in self._products:
+            evaluated = self._evaluated('extractor', pattern)
+            self._products[pattern] = evaluated[0] if evaluated is not None else extract_products(self.soup, pattern)
+        return self._products[pattern]
+    
+    # 释放共享内存、页面内容和解析结果，组内目标处理完毕后调用
+    def release(self):
+        if self._evaluation is not None:
+            self._evaluation.release()
+            self._evaluation = None
+        if self._soup is not None:
+            # 解析树内部有循环引用，显式拆开后立即回收，不必等待垃圾回收
+            self._soup.decompose()
+            self._soup = None
+        self.content = None
+        self._scan = None
+        self._products = None
+        self._selections = None
+
+# 预编译一组目标的文本规则，用于在共享页面上一次性扫描
+def collect_text_rules(targets):
+    rules = []
+    for target in targets:
+        if target.check_type == 'text':
+            try:
+                rules.append(compile_rule(target.check_pattern))
+            except RuleSyntaxError:
+                pass
+    return rules
+
+# 根据监控目标类型检查库存状态，返回(是否有库存, 结果消息CheckMessage, 响应时间)
+def check_stock_status(monitor_target, shared_page=None):
     start_time = time.time()
     is_available = False
-    message = ""
+    message = check_message('empty')
+    
+    # 未提供共享页面时（例如手动检查单个目标）单独抓取
+    if shared_page is None:
+        shared_page = SharedPage.for_targets([monitor_target])
+    # 复用其他目标已抓取的页面时，响应时间仍计入原始抓取耗时
+    reused_time = shared_page.fetch_time if shared_page.fetched else 0
     
     try:
         # 获取页面内容
-        if monitor_target.use_flaresolverr:
-            content = get_page_with_flaresolverr(monitor_target.url)
-        else:
-            content = get_page_direct(monitor_target.url)
+        content = shared_page.load(monitor_target)
         
         if not content:
-            message = "无法获取页面内容"
-            response_time = (time.time() - start_time) * 1000  # 计算响应时间
+            message = check_message('fetch_failed')
+            response_time = (time.time() - start_time) * 1000 + reused_time  # 计算响应时间
             return is_available, message, response_time
         
         # 根据检查类型判断库存状态
         if monitor_target.check_type == 'text':
-            # 文本匹配检查
-            if monitor_target.check_pattern in content:
-                is_available = True
-                message = f"找到匹配文本: {monitor_target.check_pattern}"
-            else:
-                message = f"未找到匹配文本: {monitor_target.check_pattern}"
+            # 文本匹配检查（支持 expr: 多条件规则）
+            try:
+                is_available, message = match_text(monitor_target.check_pattern, content, shared_page.scan)
+            except RuleSyntaxError as e:
+                message = check_message('rule_invalid', error=str(e))
         
         elif monitor_target.check_type == 'selector':
             # CSS选择器检查
-            soup = BeautifulSoup(content, 'html.parser')
-            elements = soup.select(monitor_target.check_pattern)
+            texts = shared_page.select_texts(monitor_target.check_pattern)
             
-            if elements:
-                element_text = ' '.join([elem.get_text().strip() for elem in elements])
+            if texts:
+                element_text = ' '.join(texts)
                 
                 if monitor_target.expected_result:
                     if monitor_target.expected_result in element_text:
                         is_available = True
-                        message = f"选择器元素包含期望结果: {monitor_target.expected_result}"
+                        message = check_message('selector_expected', expected=monitor_target.expected_result)
                     else:
-                        message = f"选择器元素不包含期望结果"
+                        message = check_message('selector_unexpected')
                 else:
                     is_available = True
-                    message = f"找到选择器元素: {monitor_target.check_pattern}"
+                    message = check_message('selector_found', selector=monitor_target.check_pattern)
+            else:
+                message = check_message('selector_missing', selector=monitor_target.check_pattern)
+        
+        elif monitor_target.check_type == 'extractor':
+            # 多产品页面：一次解析得到所有产品的库存记录
+            try:
+                products = shared_page.products(monitor_target.check_pattern)
+                available_products = [product for product in products if product.available]
+                is_available = bool(available_products)
+                message = check_message('extractor_summary', total=len(products), available=len(available_products))
+            except ExtractorSpecError as e:
+                message = check_message('extractor_invalid', error=str(e))
+        
+        elif monitor_target.check_type == 'product':
+            # 提取器生成的产品子目标：复用父目标页面的提取结果
+            parent_pattern = monitor_target.parent_pattern
+            if parent_pattern is None:
+                message = check_message('product_parent_missing')
             else:
-                message = f"未找到选择器元素: {monitor_target.check_pattern}"
+                try:
+                    products = shared_page.products(parent_pattern)
+                    product = next((item for item in products if item.name == monitor_target.check_pattern), None)
+                    if product is None:
+                        message = check_message('product_missing', name=monitor_target.check_pattern)
+                    else:
+                        is_available = product.available
+                        message = describe_product(product)
+                except ExtractorSpecError as e:
+                    message = check_message('extractor_invalid', error=str(e))
         
         elif monitor_target.check_type == 'api':
             # API响应检查
             try:
-                response_json = requests.get(monitor_target.url).json()
+                # 优先复用已抓取的内容，非JSON内容（如FlareSolverr渲染的页面）时再单独请求
+                try:
+                    response_json = json.loads(content)
+                except ValueError:
+                    if shared_page.offline:
+                        raise
+                    with get_proxy_pool().acquire(urlsplit(monitor_target.url).hostname) as lease:
+                        api_response = requests.get(monitor_target.url, **lease.requests_kwargs())
+                        lease.mark(api_response.status_code)
+                    response_json = api_response.json()
                 
                 # 简单的路径解析，如 'data.stock.available'
                 if monitor_target.check_pattern:
@@ -114,192 +519,326 @@ def check_stock_status(monitor_target):
                         if monitor_target.expected_result:
                             if str(value) == monitor_target.expected_result:
                                 is_available = True
-                                message = f"API响应符合期望结果"
+                                message = check_message('api_expected')
                             else:
-                                message = f"API响应不符合期望结果"
+                                message = check_message('api_unexpected')
                         else:
                             is_available = True
-                            message = f"API响应包含路径: {monitor_target.check_pattern}"
+                            message = check_message('api_path_found', path=monitor_target.check_pattern)
                     else:
-                        message = f"API响应中未找到路径: {monitor_target.check_pattern}"
+                        message = check_message('api_path_missing', path=monitor_target.check_pattern)
             except Exception as e:
-                message = f"API检查失败: {str(e)}"
+                message = check_message('api_error', error=str(e))
         
     except Exception as e:
-        message = f"检查过程中发生错误: {str(e)}"
-        logger.error(f"Error checking status for {monitor_target.name}: {str(e)}")
+        message = check_message('check_error', error=str(e))
+        logger.error("Error checking status for %s: %s", monitor_target.name, str(e))
     
     # 计算响应时间
-    response_time = (time.time() - start_time) * 1000  # 转换为毫秒
+    response_time = (time.time() - start_time) * 1000 + reused_time  # 转换为毫秒
     
     return is_available, message, response_time
 
-# 发送Telegram通知
+# 检查通知服务的响应：除408、429以外的4xx说明通知配置有误（Token、Chat ID、URL等），重试不会成功，
+# 抛出NotificationConfigError由发件箱直接移入死信；其他错误抛出异常由发件箱重试
+def check_notification_response(response, service):
+    if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+        raise NotificationConfigError(f"{service}通知被拒绝（HTTP {response.status_code}），请检查通知设置")
+    response.raise_for_status()
+
+# 发送Telegram通知（失败时抛出异常，由发件箱重试）
 def send_telegram_notification(chat_id, token, message):
-    try:
-        url = f"https://api.telegram.org/bot{token}/sendMessage"
-        payload = {
-            "chat_id": chat_id,
-            "text": message,
-            "parse_mode": "HTML"
-        }
-        response = requests.post(url, json=payload)
-        response.raise_for_status()
-        logger.info(f"Telegram notification sent successfully")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to send Telegram notification: {str(e)}")
-        return False
+    url = f"https://api.telegram.org/bot{token}/sendMessage"
+    payload = {
+        "chat_id": chat_id,
+        "text": message,
+        "parse_mode": "HTML"
+    }
+    response = requests.post(url, json=payload, timeout=OUTBOX_SEND_TIMEOUT)
+    check_notification_response(response, 'Telegram')
+    logger.info(f"Telegram notification sent successfully")
 
-# 发送微信(息知)通知
+# 发送微信(息知)通知（失败时抛出异常，由发件箱重试）
 def send_xi_zhi_notification(token, title, message):
-    try:
-        url = f"https://xizhi.qqoq.net/{token}.send"
-        payload = {
-            "title": title,
-            "content": message
-        }
-        response = requests.post(url, data=payload)
-        response.raise_for_status()
-        logger.info(f"Xi Zhi notification sent successfully")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to send Xi Zhi notification: {str(e)}")
-        return False
+    url = f"https://xizhi.qqoq.net/{token}.send"
+    payload = {
+        "title": title,
+        "content": message
+    }
+    response = requests.post(url, data=payload, timeout=OUTBOX_SEND_TIMEOUT)
+    check_notification_response(response, '微信(息知)')
+    logger.info(f"Xi Zhi notification sent successfully")
 
-# 发送自定义URL通知
-def send_webhook_notification(url, data):
-    try:
-        response = requests.post(url, json=data)
-        response.raise_for_status()
-        logger.info(f"Webhook notification sent successfully")
-        return True
-    except Exception as e:
-        logger.error(f"Failed to send webhook notification: {str(e)}")
-        return False
+# 发送自定义URL通知（失败时抛出异常，由发件箱重试）
+def send_webhook_notification(url, data, idempotency_key=None):
+    headers = {'Idempotency-Key': idempotency_key} if idempotency_key else None
+    response = requests.post(url, json=data, headers=headers, timeout=OUTBOX_SEND_TIMEOUT)
+    check_notification_response(response, '自定义URL')
+    logger.info(f"Webhook notification sent successfully")
 
-# 发送通知
+# 生成通知内容
+def build_notification(monitor_target, status_check):
+    title = f"{monitor_target.name} 库存状态更新"
+    
+    if status_check.is_available:
+        content = f"🎉 好消息！{monitor_target.name} 现在有库存了！\n\n" \
+                 f"📅 检测时间: {status_check.timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n" \
+                 f"🔗 链接: {monitor_target.url}\n" \
+                 f"💬 详情: {status_check.message}"
+    else:
+        content = f"😔 {monitor_target.name} 仍然没有库存\n\n" \
+                 f"📅 检测时间: {status_check.timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n" \
+                 f"🔗 链接: {monitor_target.url}\n" \
+                 f"💬 详情: {status_check.message}"
+    
+    data = {
+        "monitor_name": monitor_target.name,
+        "url": monitor_target.url,
+        "is_available": status_check.is_available,
+        "timestamp": status_check.timestamp.isoformat(),
+        "message": status_check.message,
+        "response_time": status_check.response_time
+    }
+    return {'title': title, 'content': content, 'data': data}
+
+# 按通知类型投递一条发件箱中的通知，settings为当前的通知设置
+def deliver_notification(notification_type, settings, payload, idempotency_key):
+    if notification_type == 'telegram':
+        token = settings.get('token', os.environ.get('TELEGRAM_BOT_TOKEN', ''))
+        chat_id = settings.get('chat_id', '')
+        if not (token and chat_id):
+            raise NotificationConfigError('Telegram通知缺少Token或Chat ID')
+        send_telegram_notification(chat_id, token, payload['content'])
+    
+    elif notification_type == 'xi_zhi':
+        token = settings.get('token', os.environ.get('XI_ZHI_TOKEN', ''))
+        if not token:
+            raise NotificationConfigError('微信(息知)通知缺少Token')
+        send_xi_zhi_notification(token, payload['title'], payload['content'])
+    
+    elif notification_type == 'webhook':
+        webhook_url = settings.get('url', '')
+        if not webhook_url:
+            raise NotificationConfigError('自定义URL通知缺少URL')
+        send_webhook_notification(webhook_url, dict(payload['data'], idempotency_key=idempotency_key), idempotency_key)
+    
+    else:
+        raise NotificationConfigError(f"不支持的通知类型: {notification_type}")
+
+# 发送通知：写入发件箱，与状态记录在同一事务中提交，由投递任务发送
 def send_notification(notification_setting, monitor_target, status_check):
     try:
-        settings = notification_setting.settings or {}
-        title = f"{monitor_target.name} 库存状态更新"
-        
-        if status_check.is_available:
-            content = f"🎉 好消息！{monitor_target.name} 现在有库存了！\n\n" \
-                     f"📅 检测时间: {status_check.timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n" \
-                     f"🔗 链接: {monitor_target.url}\n" \
-                     f"💬 详情: {status_check.message}"
-        else:
-            content = f"😔 {monitor_target.name} 仍然没有库存\n\n" \
-                     f"📅 检测时间: {status_check.timestamp.strftime('%Y-%m-%d %H:%M:%S')}\n" \
-                     f"🔗 链接: {monitor_target.url}\n" \
-                     f"💬 详情: {status_check.message}"
-        
-        if notification_setting.notification_type == 'telegram':
-            token = settings.get('token', os.environ.get('TELEGRAM_BOT_TOKEN', ''))
-            chat_id = settings.get('chat_id', '')
-            if token and chat_id:
-                send_telegram_notification(chat_id, token, content)
-        
-        elif notification_setting.notification_type == 'xi_zhi':
-            token = settings.get('token', os.environ.get('XI_ZHI_TOKEN', ''))
-            if token:
-                send_xi_zhi_notification(token, title, content)
-        
-        elif notification_setting.notification_type == 'webhook':
-            webhook_url = settings.get('url', '')
-            if webhook_url:
-                webhook_data = {
-                    "monitor_name": monitor_target.name,
-                    "url": monitor_target.url,
-                    "is_available": status_check.is_available,
-                    "timestamp": status_check.timestamp.isoformat(),
-                    "message": status_check.message,
-                    "response_time": status_check.response_time
-                }
-                send_webhook_notification(webhook_url, webhook_data)
-        
+        enqueue_notification(notification_setting, monitor_target, status_check,
+                             build_notification(monitor_target, status_check))
     except Exception as e:
-        logger.error(f"Error sending notification: {str(e)}")
+        logger.error(f"Error queueing notification: {str(e)}")
+
+# 获取监控目标最近一次的状态检查结果
+def get_previous_check(target_id):
+    return StatusCheck.query.filter_by(
+        monitor_target_id=target_id
+    ).order_by(StatusCheck.timestamp.desc()).first()
+
+# 检查单个监控目标：执行检查、写入状态记录，并在状态变化时发送通知
+# 定时任务和手动检查共用此函数，调用方负责提交数据库事务
+# target 可以是MonitorTarget或配置快照中的TargetConfig；通知设置从配置快照中读取
+def process_target(target, config=None, shared_page=None):
+    if config is None:
+        config = get_config_snapshot()
+    if shared_page is None:
+        shared_page = SharedPage.for_targets([target])
+    
+    # 获取上一次的状态检查结果，用于判断状态是否变化
+    previous_check = get_previous_check(target.id)
+    
+    # 检查库存状态
+    is_available, message, response_time = check_stock_status(target, shared_page)
+    
+    # 记录检查结果：状态不变时合并到上一条记录（STATUS_STORAGE=runs），否则写入新记录
+    now = datetime.utcnow()
+    status_check, _ = record_check(target.id, previous_check, is_available, message, response_time, now)
+    
+    if is_available:
+        logger.info("%s is available", target.name)
+    
+    # 通过订阅索引找出需要通知的设置：绑定该目标的设置在状态变化时通知，
+    # 按条件订阅的设置和全局设置只在变为有库存时通知（第一次检查也视为状态变化）
+    changed = not previous_check or previous_check.is_available != is_available
+    subscribers = config.subscribers_for(target, is_available, changed, dict(message.params).get('price'))
+    if subscribers:
+        logger.info("Status changed for %s, sending %d notifications", target.name, len(subscribers))
+        for notification_setting in subscribers:
+            send_notification(notification_setting, target, status_check)
+    
+    result = {
+        'target_id': target.id,
+        'is_available': is_available,
+        'message': message.render(),
+        'response_time': response_time,
+        'timestamp': now.isoformat()
+    }
+    
+    # 提取器目标：为新出现的产品创建子目标，并立即用同一页面检查它们
+    if target.check_type == 'extractor' and shared_page.content:
+        new_children = sync_product_targets(target, shared_page, config.children_of(target.id))
+        for child in new_children:
+            process_target(child, config, shared_page)
+        result['created_children'] = len(new_children)
+    
+    return result
+
+# 为提取器目标页面上新出现的产品创建子目标
+def sync_product_targets(parent, shared_page, existing_names):
+    if not EXTRACTOR_AUTO_CREATE:
+        return []
+    try:
+        products = shared_page.products(parent.check_pattern)
+    except ExtractorSpecError:
+        return []
+    
+    existing_names = set(existing_names)
+    new_children = []
+    for product in products:
+        if product.name in existing_names:
+            continue
+        child = MonitorTarget(
+            name=f"{parent.name} - {product.name}"[:100],
+            url=parent.url,
+            check_type='product',
+            check_pattern=product.name[:500],
+            expected_result='',
+            interval=parent.interval,
+            is_active=True,
+            use_flaresolverr=parent.use_flaresolverr,
+            max_bytes=parent.max_bytes,
+            region=parent.region,
+            parent_id=parent.id
+        )
+        db.session.add(child)
+        existing_names.add(product.name)
+        new_children.append(child)
+    
+    if new_children:
+        # 刷新以获得子目标ID，便于写入状态记录
+        db.session.flush()
+        bump_config_version()
+        logger.info(f"Created {len(new_children)} product targets for {parent.name}")
+    return new_children
 
-# 监控库存状态
-def monitor_stock_status():
+# 监控库存状态，返回本周期各目标的检查结果
+# due_only为True时（定时任务）只检查按监控间隔到期的目标，见runtime_state
+def monitor_stock_status(due_only=False):
+    from jobs import run_single_flight
+    from runtime_state import get_target_schedule
+    
     with app.app_context():
         logger.info("Starting stock monitoring...")
+        started_at = time.time()
+        schedule = get_target_schedule()
         
-        # 获取所有活跃的监控目标
-        active_targets = MonitorTarget.query.filter_by(is_active=True).all()
-        logger.info(f"Found {len(active_targets)} active monitor targets")
+        # 活跃的监控目标和通知设置来自配置快照，只在配置版本变化时重新查询
+        config = get_config_snapshot()
+        active_targets = config.targets
+        logger.info(f"Found {len(active_targets)} active monitor targets (config v{config.version})")
         
-        # 跟踪有库存的监控目标
-        available_targets = []
+        available_count = 0
+        results = []
+        fetch_stats.reset()
+        cycle_stats.reset()
+        # 当前块中已处理、尚未提交的目标
+        chunk_targets = []
         
+        # 按页面分组：同一页面只抓取一次，组内所有目标的文本规则一次扫描完成
+        page_groups = {}
         for target in active_targets:
-            logger.info(f"Checking stock status for: {target.name}")
-            
-            # 检查库存状态
-            is_available, message, response_time = check_stock_status(target)
-            
-            # 创建状态检查记录
-            status_check = StatusCheck(
-                monitor_target_id=target.id,
-                is_available=is_available,
-                response_time=response_time,
-                message=message
-            )
-            db.session.add(status_check)
-            
-            # 如果有库存，添加到可用目标列表
-            if is_available:
-                available_targets.append((target, status_check))
-                logger.info(f"{target.name} is available")
-            
-            # 获取该监控目标的所有启用的通知设置
-            notification_settings = NotificationSetting.query.filter_by(
-                monitor_target_id=target.id,
-                enabled=True
-            ).all()
-            
-            # 检查是否需要发送通知（状态变化时）
-            if notification_settings:
-                # 获取上一次的状态检查结果
-                previous_check = StatusCheck.query.filter_by(
-                    monitor_target_id=target.id
-                ).order_by(StatusCheck.timestamp.desc()).offset(1).first()
+            page_groups.setdefault(page_key(target), []).append(target)
+        if due_only:
+            page_groups = {key: targets for key, targets in page_groups.items() if schedule.group_due(targets, started_at)}
+            logger.info(f"{sum(len(targets) for targets in page_groups.values())} targets on {len(page_groups)} pages are due")
+        
+        # 处理一组共享页面的目标
+        def process_group(targets, shared_page):
+            nonlocal available_count
+            for target in targets:
+                logger.info("Checking stock status for: %s", target.name)
                 
-                # 如果是第一次检查或者状态发生变化，则发送通知
-                if not previous_check or previous_check.is_available != is_available:
-                    logger.info(f"Status changed for {target.name}, sending notifications")
-                    for notification_setting in notification_settings:
-                        send_notification(notification_setting, target, status_check)
+                try:
+                    # 如果该目标正在被手动检查，直接复用其结果，避免重复抓取
+                    result = run_single_flight(target.id, process_target, target, config, shared_page)
+                except Exception as e:
+                    # target_id 使全文搜索可以按监控目标筛选这条日志
+                    logger.error("Error processing %s: %s", target.name, str(e), extra={'target_id': target.id})
+                    continue
+                
+                results.append(result)
+                if result['is_available']:
+                    available_count += 1
+            
+            # 组内目标处理完毕后释放页面内容
+            shared_page.release()
+            chunk_targets.extend(targets)
+            if len(chunk_targets) >= MONITOR_CHUNK_SIZE:
+                commit_chunk()
         
-        # 处理全局通知设置（适用于任意监控目标）
-        global_notification_settings = NotificationSetting.query.filter_by(
-            monitor_target_id=None,
-            enabled=True
-        ).all()
+        # 提交当前块并清空会话；提交失败时只回滚这一块，这些目标不标记为已检查，下个周期重新检查
+        def commit_chunk():
+            if not chunk_targets:
+                return
+            try:
+                db.session.commit()
+                committed = True
+            except Exception as e:
+                db.session.rollback()
+                committed = False
+                logger.error("Error committing %d checked targets, rolled back: %s", len(chunk_targets), str(e))
+            # 已提交的对象不再需要，从会话中移除，下一块从空的会话开始
+            db.session.expunge_all()
+            if committed:
+                schedule.mark(chunk_targets, started_at)
+            cycle_stats.record_chunk(len(chunk_targets), committed)
+            chunk_targets.clear()
         
-        if global_notification_settings and available_targets:
-            logger.info(f"Found {len(available_targets)} available targets and {len(global_notification_settings)} global notification settings")
-            
-            # 对每个全局通知设置，发送所有可用目标的通知
-            for notification_setting in global_notification_settings:
-                for target, status_check in available_targets:
-                    # 只发送变为可用的通知，不发送保持可用的通知
-                    previous_check = StatusCheck.query.filter_by(
-                        monitor_target_id=target.id
-                    ).order_by(StatusCheck.timestamp.desc()).offset(1).first()
-                    
-                    if not previous_check or not previous_check.is_available:
-                        logger.info(f"Sending global notification for {target.name}")
-                        send_notification(notification_setting, target, status_check)
+        # 启用解析进程池时，需要解析HTML的页面抓取后交给解析进程，主进程继续抓取后面的页面，
+        # 最多保留 2 x 进程数 个等待处理的页面
+        pool = get_evaluation_pool()
+        pending = deque()
+        try:
+            for targets in page_groups.values():
+                shared_page = SharedPage.for_targets(targets)
+                if pool is not None and any(target.check_type in PARSED_CHECK_TYPES for target in targets):
+                    shared_page.load(targets[0])
+                    if shared_page.submit_evaluation(targets):
+                        pending.append((targets, shared_page))
+                        if len(pending) > pool.processes * 2:
+                            process_group(*pending.popleft())
+                        continue
+                process_group(targets, shared_page)
+            while pending:
+                process_group(*pending.popleft())
+        finally:
+            # 出错时释放仍在等待处理的页面占用的共享内存
+            for _, shared_page in pending:
+                shared_page.release()
+        
+        # 提交最后一块
+        commit_chunk()
         
-        # 提交数据库更改
-        db.session.commit()
+        logger.info(f"Found {available_count} available targets")
+        stats = fetch_stats.to_dict()
+        logger.info(f"Direct fetches: {stats['fetches']}, early stops: {stats['early_stops']}, "
+                    f"truncated: {stats['truncated']}, bytes read: {stats['bytes_read']}, bytes saved: {stats['bytes_saved']}")
+        memory = cycle_stats.to_dict()
+        logger.info(f"Committed {memory['chunks']} chunks ({memory['failed_chunks']} failed), "
+                    f"RSS {memory['rss_start_mb']} -> {memory['rss_end_mb']} MB, peak {memory['peak_rss_mb']} MB")
         logger.info("Stock monitoring completed")
+        return results
 
 # 如果直接运行此脚本，立即执行一次监控
 if __name__ == '__main__':
-    # 导入app上下文
-    from app import app
-    monitor_stock_status()
\ No newline at end of file
+    # 导入app上下文，等待后台的数据库初始化完成
+    from app import app, db_ready
+    db_ready.wait()
+    monitor_stock_status()
+    # 没有定时任务时立即投递本次产生的通知
+    from outbox import deliver_outbox
+    deliver_outbox()
\ No newline at end of file
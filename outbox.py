@@ -0,0 +1,241 @@
+import os
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, or_
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 通知发件箱
+#
+# 监控循环不直接发送通知，而是在写入状态记录的同一事务中写入 notification_outbox 表，
+# 由投递任务（定时任务 notification_outbox_job）分批取出并发发送：
+#   - 至少一次投递：进程在发送过程中退出时，锁定超时后的通知会被重新投递；
+#     自定义URL通知附带 Idempotency-Key 请求头和 idempotency_key 字段，接收方可据此去重
+#   - 失败重试：按指数退避重新安排发送时间，超过最大尝试次数或配置无效时标记为 dead
+#   - 投递在独立的线程池中进行，外部服务故障恢复后积压的通知不会阻塞监控循环
+
+# 每批取出的通知数量
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 100))
+# 并发发送的线程数
+OUTBOX_WORKERS = int(os.environ.get('OUTBOX_WORKERS', 4))
+# 最大尝试次数，超过后标记为dead（默认约5小时内持续重试）
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', 12))
+# 首次重试间隔(秒)，之后每次加倍，不超过 OUTBOX_RETRY_MAX_SECONDS
+OUTBOX_RETRY_SECONDS = float(os.environ.get('OUTBOX_RETRY_SECONDS', 30))
+OUTBOX_RETRY_MAX_SECONDS = float(os.environ.get('OUTBOX_RETRY_MAX_SECONDS', 3600))
+# 投递中的通知超过该时间未完成时视为投递进程已退出，重新投递
+OUTBOX_LEASE_SECONDS = float(os.environ.get('OUTBOX_LEASE_SECONDS', 300))
+# 投递任务的轮询间隔(秒)和单次发送的超时时间(秒)
+OUTBOX_POLL_SECONDS = int(os.environ.get('OUTBOX_POLL_SECONDS', 5))
+OUTBOX_SEND_TIMEOUT = float(os.environ.get('OUTBOX_SEND_TIMEOUT', 10))
+# 已投递通知的保留天数
+OUTBOX_RETENTION_DAYS = int(os.environ.get('OUTBOX_RETENTION_DAYS', 7))
+
+OUTBOX_STATUSES = ('pending', 'sending', 'delivered', 'dead')
+
+
+# 通知设置不完整或已删除等不可重试的错误，直接标记为dead
+class NotificationConfigError(ValueError):
+    pass
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+# 获取发送通知的线程池（延迟创建）
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=OUTBOX_WORKERS, thread_name_prefix='outbox-worker')
+        return _executor
+
+
+# 把通知写入发件箱（由调用方与状态记录一起提交）
+def enqueue_notification(notification_setting, monitor_target, status_check, payload):
+    from app import db, NotificationOutbox
+
+    timestamp = status_check.timestamp or datetime.utcnow()
+    entry = NotificationOutbox(
+        idempotency_key=f"{notification_setting.id}-{monitor_target.id}-{timestamp.strftime('%Y%m%d%H%M%S%f')}",
+        notification_setting_id=notification_setting.id,
+        monitor_target_id=monitor_target.id,
+        status_check=status_check,
+        notification_type=notification_setting.notification_type,
+        payload=payload,
+        status='pending',
+        attempts=0,
+        next_attempt_at=datetime.utcnow()
+    )
+    db.session.add(entry)
+    return entry
+
+
+# 第n次失败后的重试间隔
+def retry_delay(attempts):
+    return min(OUTBOX_RETRY_SECONDS * 2 ** max(attempts - 1, 0), OUTBOX_RETRY_MAX_SECONDS)
+
+
+def _ready_condition(now):
+    from app import NotificationOutbox
+
+    return or_(
+        and_(NotificationOutbox.status == 'pending', NotificationOutbox.next_attempt_at <= now),
+        and_(NotificationOutbox.status == 'sending', NotificationOutbox.locked_until < now)
+    )
+
+
+# 取出一批到期的通知并标记为投递中，返回(批次标识, 通知列表)
+def claim_batch(limit=OUTBOX_BATCH_SIZE):
+    from app import db, NotificationOutbox, NotificationSetting
+
+    now = datetime.utcnow()
+    ids = [row[0] for row in db.session.query(NotificationOutbox.id).filter(_ready_condition(now))
+           .order_by(NotificationOutbox.id).limit(limit).all()]
+    if not ids:
+        db.session.commit()
+        return None, []
+
+    # 条件更新：多个进程同时投递时，每条通知只会被一个批次取出
+    token = uuid.uuid4().hex
+    table = NotificationOutbox.__table__
+    db.session.execute(
+        table.update().where(table.c.id.in_(ids)).where(_ready_condition(now))
+        .values(status='sending', claim_token=token, locked_until=now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+    )
+    db.session.commit()
+
+    entries = db.session.query(
+        NotificationOutbox.id, NotificationOutbox.idempotency_key, NotificationOutbox.notification_setting_id,
+        NotificationOutbox.notification_type, NotificationOutbox.payload, NotificationOutbox.attempts
+    ).filter_by(claim_token=token).all()
+    setting_ids = {entry.notification_setting_id for entry in entries}
+    settings = {
+        row.id: (row.notification_type, dict(row.settings or {}), row.enabled)
+        for row in db.session.query(NotificationSetting.id, NotificationSetting.notification_type,
+                                    NotificationSetting.settings, NotificationSetting.enabled)
+        .filter(NotificationSetting.id.in_(setting_ids)).all()
+    }
+    # 发送期间不占用数据库事务
+    db.session.commit()
+    return token, [(entry, settings.get(entry.notification_setting_id)) for entry in entries]
+
+
+# 发送一条通知，返回(通知ID, 错误信息, 是否可重试)
+def _send(entry, setting):
+    from monitor import deliver_notification
+
+    try:
+        if setting is None:
+            raise NotificationConfigError('通知设置已删除')
+        _, settings, enabled = setting
+        if not enabled:
+            raise NotificationConfigError('通知设置已禁用')
+        deliver_notification(entry.notification_type, settings, entry.payload or {}, entry.idempotency_key)
+        return entry.id, None, False
+    except NotificationConfigError as e:
+        return entry.id, str(e), False
+    except Exception as e:
+        return entry.id, str(e) or e.__class__.__name__, True
+
+
+# 记录一批通知的发送结果
+def record_results(token, entries, results):
+    from app import db, NotificationOutbox
+
+    now = datetime.utcnow()
+    table = NotificationOutbox.__table__
+    attempts = {entry.id: entry.attempts for entry, _ in entries}
+    counts = {'delivered': 0, 'retry': 0, 'dead': 0}
+
+    delivered = [entry_id for entry_id, error, _ in results if error is None]
+    if delivered:
+        db.session.execute(
+            table.update().where(table.c.id.in_(delivered)).where(table.c.claim_token == token)
+            .values(status='delivered', delivered_at=now, attempts=table.c.attempts + 1,
+                    claim_token=None, locked_until=None, last_error=None)
+        )
+        counts['delivered'] = len(delivered)
+
+    for entry_id, error, retryable in results:
+        if error is None:
+            continue
+        attempt = attempts[entry_id] + 1
+        if retryable and attempt < OUTBOX_MAX_ATTEMPTS:
+            values = {'status': 'pending', 'next_attempt_at': now + timedelta(seconds=retry_delay(attempt))}
+            counts['retry'] += 1
+        else:
+            values = {'status': 'dead'}
+            counts['dead'] += 1
+            logger.error(f"Notification {entry_id} dead-lettered after {attempt} attempt(s): {error}")
+        db.session.execute(
+            table.update().where(table.c.id == entry_id).where(table.c.claim_token == token)
+            .values(attempts=attempt, last_error=error[:1000], claim_token=None, locked_until=None, **values)
+        )
+    db.session.commit()
+    return counts
+
+
+# 删除超过保留期的已投递通知
+def purge_delivered():
+    from app import db, NotificationOutbox
+
+    cutoff = datetime.utcnow() - timedelta(days=OUTBOX_RETENTION_DAYS)
+    removed = NotificationOutbox.query.filter(
+        NotificationOutbox.status == 'delivered', NotificationOutbox.delivered_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+# 投递发件箱中所有到期的通知，直到没有到期通知或达到max_batches
+def deliver_outbox(max_batches=None):
+    from app import app
+
+    totals = {'delivered': 0, 'retry': 0, 'dead': 0}
+    batches = 0
+    with app.app_context():
+        while max_batches is None or batches < max_batches:
+            token, entries = claim_batch()
+            if not entries:
+                break
+            batches += 1
+            futures = [get_executor().submit(_send, entry, setting) for entry, setting in entries]
+            results = [future.result() for future in futures]
+            counts = record_results(token, entries, results)
+            for key in totals:
+                totals[key] += counts[key]
+        purge_delivered()
+
+    if any(totals.values()):
+        logger.info(f"Notification outbox: {totals['delivered']} delivered, {totals['retry']} scheduled for retry, "
+                    f"{totals['dead']} dead-lettered")
+    return totals
+
+
+# 各状态的通知数量
+def outbox_counts():
+    from app import db, NotificationOutbox
+
+    counts = dict.fromkeys(OUTBOX_STATUSES, 0)
+    rows = db.session.query(NotificationOutbox.status, func.count(NotificationOutbox.id)).group_by(NotificationOutbox.status).all()
+    counts.update({status: count for status, count in rows})
+    return counts
+
+
+# 重新投递失败的通知，entry_id为空时重新投递所有dead通知，返回重新投递的数量
+def requeue_dead(entry_id=None):
+    from app import db, NotificationOutbox
+
+    query = NotificationOutbox.query.filter_by(status='dead')
+    if entry_id is not None:
+        query = query.filter_by(id=entry_id)
+    count = query.update({'status': 'pending', 'attempts': 0, 'next_attempt_at': datetime.utcnow()},
+                         synchronize_session=False)
+    db.session.commit()
+    return count
@@ -0,0 +1,148 @@
+import os
+import logging
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# SQL查询预算
+#
+# 通过SQLAlchemy引擎事件统计每个请求和每个后台任务执行的查询数量和数据库耗时，
+# 超出预算时记录警告日志（附带重复次数最多的语句，便于定位N+1查询）。
+# 调试模式或 QUERY_DEBUG_HEADERS=1 时，在响应头中返回 X-Query-Count / X-Query-Time-Ms。
+
+# 单个请求允许的查询数量和数据库耗时(毫秒)
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 20))
+QUERY_TIME_BUDGET_MS = float(os.environ.get('QUERY_TIME_BUDGET_MS', 500))
+# 后台任务的查询数量预算（监控周期的查询数与目标数量成正比，默认只记录不告警）
+JOB_QUERY_BUDGET = int(os.environ.get('JOB_QUERY_BUDGET', 0))
+QUERY_DEBUG_HEADERS = os.environ.get('QUERY_DEBUG_HEADERS', '0') == '1'
+
+_local = threading.local()
+
+
+class QueryStats:
+    def __init__(self, label):
+        self.label = label
+        self.count = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, duration):
+        self.count += 1
+        self.duration += duration
+        self.statements[statement] += 1
+
+    @property
+    def duration_ms(self):
+        return round(self.duration * 1000, 2)
+
+    # 重复执行次数最多的语句
+    def most_repeated(self, limit=3):
+        return [(statement, count) for statement, count in self.statements.most_common(limit) if count > 1]
+
+
+def _active_stats():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if getattr(_local, 'stack', None):
+        conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stack = getattr(_local, 'stack', None)
+    if not stack:
+        return
+    starts = conn.info.get('query_start')
+    duration = time.perf_counter() - starts.pop() if starts else 0.0
+    # 嵌套统计时，外层也计入内层执行的查询
+    for stats in stack:
+        stats.record(statement, duration)
+
+
+# 统计代码块中执行的查询
+@contextmanager
+def track_queries(label):
+    stats = QueryStats(label)
+    stack = _active_stats()
+    stack.append(stats)
+    try:
+        yield stats
+    finally:
+        stack.remove(stats)
+
+
+# 超出预算时记录警告
+def report(stats, budget=QUERY_BUDGET, time_budget_ms=QUERY_TIME_BUDGET_MS):
+    over_count = budget and stats.count > budget
+    over_time = time_budget_ms and stats.duration_ms > time_budget_ms
+    if not (over_count or over_time):
+        logger.debug("%s: %d queries in %sms", stats.label, stats.count, stats.duration_ms)
+        return False
+    repeated = '; '.join(f"{count}x {statement[:120]}" for statement, count in stats.most_repeated())
+    logger.warning(f"Query budget exceeded: {stats.label} ran {stats.count} queries in {stats.duration_ms}ms "
+                   f"(budget {budget} queries / {time_budget_ms}ms)" + (f"; most repeated: {repeated}" if repeated else ''))
+    return True
+
+
+# 统计后台任务（定时监控周期、手动检查）的查询
+@contextmanager
+def track_job(label, budget=JOB_QUERY_BUDGET):
+    with track_queries(f"job:{label}") as stats:
+        yield stats
+    report(stats, budget, 0)
+    logger.info("%s: %d queries in %sms", stats.label, stats.count, stats.duration_ms)
+
+
+# 断言代码块中的查询数量不超过上限，用于测试和基准测试
+@contextmanager
+def assert_max_queries(limit, label='block'):
+    with track_queries(label) as stats:
+        yield stats
+    if stats.count > limit:
+        details = '\n'.join(f"  {count}x {statement}" for statement, count in stats.statements.most_common())
+        raise AssertionError(f"{label} ran {stats.count} queries (limit {limit}):\n{details}")
+
+
+# 为Flask应用注册按请求统计查询的钩子
+def init_query_budget(app):
+    @app.before_request
+    def start_query_tracking():
+        from flask import g, request
+        g.query_tracking = track_queries(f"{request.method} {request.endpoint or request.path}")
+        g.query_stats = g.query_tracking.__enter__()
+
+    @app.after_request
+    def add_query_headers(response):
+        from flask import g
+        stats = g.get('query_stats')
+        if stats is not None and (app.debug or QUERY_DEBUG_HEADERS):
+            response.headers['X-Query-Count'] = str(stats.count)
+            response.headers['X-Query-Time-Ms'] = str(stats.duration_ms)
+        return response
+
+    @app.teardown_request
+    def finish_query_tracking(exc):
+        from flask import g
+        tracking = g.pop('query_tracking', None)
+        stats = g.pop('query_stats', None)
+        if tracking is None:
+            return
+        tracking.__exit__(None, None, None)
+        if g.pop('query_budget_exempt', False):
+            # 查询次数随数据量增长的请求（如流式导出）只记录调试日志
+            report(stats, 0, 0)
+        else:
+            report(stats)
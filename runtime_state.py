@@ -0,0 +1,229 @@
+import os
+import sys
+import gzip
+import json
+import atexit
+import logging
+import threading
+import time
+from datetime import datetime
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 运行时状态检查点（热重启）
+#
+# 监控进程在内存中维护的状态在重启后会丢失，导致重启后的第一个周期按冷启动的方式工作：
+#   - 每个监控目标的下次到期时间：定时任务只检查到期的目标（按目标的监控间隔），
+#     重启后不会把刚检查过的目标再全部检查一遍
+#   - 对冲抓取按主机记录的延迟和验证页面比例：重启后仍先用FlareSolverr访问返回验证页面的主机
+#   - 代理池的健康统计和剔除时间
+# 这些状态定期（以及每个监控周期结束后、进程退出时）写入一个gzip压缩的JSON文件，启动时读取。
+# 文件带格式版本号和保存时间，版本不符或超过 RUNTIME_STATE_MAX_AGE 秒的检查点不会被使用；
+# 检查点中没有的目标，根据数据库中最近一次检查的时间计算下次到期时间。
+# 上一次状态本来就从数据库读取，重启不会把第一次检查当作状态变化而发送通知。
+
+RUNTIME_STATE = os.environ.get('RUNTIME_STATE', '1') != '0'
+# 检查点文件，默认与数据库放在同一目录
+RUNTIME_STATE_PATH = os.environ.get('RUNTIME_STATE_PATH', '')
+# 定期保存的间隔(秒)
+RUNTIME_STATE_INTERVAL = int(os.environ.get('RUNTIME_STATE_INTERVAL', 60))
+# 超过该时间(秒)的检查点视为过期，不再使用
+RUNTIME_STATE_MAX_AGE = float(os.environ.get('RUNTIME_STATE_MAX_AGE', 3600))
+
+FORMAT_VERSION = 1
+# 定时任务的触发时间有少量抖动，提前这么多秒到期的目标也在本周期检查
+DUE_SLACK_SECONDS = 5
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def state_path():
+    if RUNTIME_STATE_PATH:
+        return RUNTIME_STATE_PATH
+    from app import DATABASE_PATH
+    return os.path.join(os.path.dirname(DATABASE_PATH), 'runtime_state.json.gz')
+
+
+# 每个监控目标的下次到期时间(UNIX时间)
+class TargetSchedule:
+    def __init__(self):
+        self.next_due = {}
+        self.lock = threading.Lock()
+
+    # 同一页面上的目标共用一次抓取，任一目标到期（或从未检查过）时整组检查
+    def group_due(self, targets, now):
+        with self.lock:
+            return any(self.next_due.get(target.id, 0) <= now + DUE_SLACK_SECONDS for target in targets)
+
+    # 以周期开始的时间计算下次到期时间，与定时任务的触发时间对齐
+    def mark(self, targets, started_at):
+        with self.lock:
+            for target in targets:
+                self.next_due[target.id] = started_at + (target.interval or 0)
+
+    # 最早到期的时间（不早于now），用于安排重启后的第一个周期
+    def first_due(self, targets, now):
+        with self.lock:
+            return max(min((self.next_due.get(target.id, now) for target in targets), default=now), now)
+
+    def export_state(self):
+        with self.lock:
+            return {str(target_id): due for target_id, due in self.next_due.items()}
+
+    # 恢复检查点中的到期时间：只保留仍然启用的目标，监控间隔缩短后不晚于 now + 新间隔
+    def restore_state(self, state, targets, now):
+        intervals = {target.id: target.interval or 0 for target in targets}
+        restored = 0
+        with self.lock:
+            for target_id, due in state.items():
+                target_id = int(target_id)
+                if target_id in intervals:
+                    self.next_due[target_id] = min(float(due), now + intervals[target_id])
+                    restored += 1
+        return restored
+
+    # 检查点中没有的目标：最近一次检查时间 + 监控间隔，从未检查过的立即到期
+    def seed_from_database(self, targets):
+        from app import db, MonitorTarget, StatusCheck
+        from sqlalchemy import func
+
+        with self.lock:
+            missing = {target.id: target for target in targets if target.id not in self.next_due}
+        if not missing:
+            return 0
+        rows = db.session.query(
+            MonitorTarget.id, func.coalesce(StatusCheck.last_checked, StatusCheck.timestamp)
+        ).join(StatusCheck, MonitorTarget.latest_check_id == StatusCheck.id).filter(
+            MonitorTarget.id.in_(missing)
+        ).all()
+        with self.lock:
+            for target_id, checked_at in rows:
+                if checked_at is not None and target_id not in self.next_due:
+                    # 数据库中的时间为UTC
+                    checked = (checked_at - _EPOCH).total_seconds()
+                    self.next_due[target_id] = checked + (missing[target_id].interval or 0)
+        return len(rows)
+
+    def to_dict(self, now=None):
+        now = now or time.time()
+        with self.lock:
+            values = list(self.next_due.values())
+        return {
+            'targets': len(values),
+            'due': sum(1 for due in values if due <= now + DUE_SLACK_SECONDS),
+            'next_due_seconds': round(max(min(values) - now, 0), 1) if values else None,
+        }
+
+
+_schedule = TargetSchedule()
+_checkpoint_lock = threading.Lock()
+
+
+def get_target_schedule():
+    return _schedule
+
+
+# 把运行时状态写入检查点文件（先写临时文件再改名，写入中途退出不会损坏已有的检查点）
+def save_checkpoint(path=None):
+    from hedging import get_hedge_router
+    from proxies import get_proxy_pool
+
+    if not RUNTIME_STATE:
+        return None
+    path = path or state_path()
+    state = {
+        'format': FORMAT_VERSION,
+        'saved_at': time.time(),
+        'schedule': _schedule.export_state(),
+        'hedging': get_hedge_router().export_state(),
+        'proxies': get_proxy_pool().export_state(),
+    }
+    data = gzip.compress(json.dumps(state, separators=(',', ':')).encode('utf-8'))
+    with _checkpoint_lock:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    logger.debug("Saved runtime state checkpoint (%d bytes, %d targets)", len(data), len(state['schedule']))
+    return len(data)
+
+
+# 读取检查点，格式不符或已过期时返回None
+def load_checkpoint(path=None, now=None):
+    path = path or state_path()
+    now = now or time.time()
+    try:
+        with open(path, 'rb') as f:
+            state = json.loads(gzip.decompress(f.read()))
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Ignoring unreadable runtime state checkpoint {path}: {str(e)}")
+        return None
+    if not isinstance(state, dict) or state.get('format') != FORMAT_VERSION:
+        logger.warning(f"Ignoring runtime state checkpoint {path} with format {state.get('format') if isinstance(state, dict) else None}")
+        return None
+    age = now - float(state.get('saved_at') or 0)
+    if age > RUNTIME_STATE_MAX_AGE:
+        logger.info(f"Ignoring runtime state checkpoint saved {age:.0f}s ago (RUNTIME_STATE_MAX_AGE={RUNTIME_STATE_MAX_AGE:.0f})")
+        return None
+    return state
+
+
+# 启动时恢复运行时状态，需要在应用上下文中调用；返回恢复的摘要
+def restore_runtime_state(targets, now=None):
+    from hedging import get_hedge_router
+    from proxies import get_proxy_pool
+
+    now = now or time.time()
+    summary = {'checkpoint': False, 'schedule': 0, 'seeded': 0, 'hosts': 0, 'proxies': 0}
+    state = load_checkpoint(now=now) if RUNTIME_STATE else None
+    if state is not None:
+        summary['checkpoint'] = True
+        summary['schedule'] = _schedule.restore_state(state.get('schedule') or {}, targets, now)
+        summary['hosts'] = get_hedge_router().restore_state(state.get('hedging') or {})
+        summary['proxies'] = get_proxy_pool().restore_state(state.get('proxies') or {})
+    summary['seeded'] = _schedule.seed_from_database(targets)
+    logger.info(f"Runtime state restored: {summary}")
+    return summary
+
+
+# 监控进程中注册退出时保存检查点
+def register_checkpoint_on_exit():
+    if RUNTIME_STATE:
+        atexit.register(_save_quietly)
+
+
+def _save_quietly():
+    try:
+        save_checkpoint()
+    except Exception as e:
+        logger.warning(f"Failed to save runtime state checkpoint: {str(e)}")
+
+
+def runtime_state_stats():
+    return {'enabled': RUNTIME_STATE, 'schedule': _schedule.to_dict()}
+
+
+# 命令行入口：查看检查点内容
+#   python runtime_state.py [路径]
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    path = argv[0] if argv else state_path()
+    with open(path, 'rb') as f:
+        state = json.loads(gzip.decompress(f.read()))
+    schedule = state.get('schedule') or {}
+    print(json.dumps({
+        'format': state.get('format'),
+        'age_seconds': round(time.time() - float(state.get('saved_at') or 0), 1),
+        'targets': len(schedule),
+        'next_due_seconds': round(min(schedule.values()) - time.time(), 1) if schedule else None,
+        'hosts': len(state.get('hedging') or {}),
+        'proxies': len(state.get('proxies') or {}),
+    }, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
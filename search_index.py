@@ -0,0 +1,547 @@
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 检查结果和日志的全文搜索索引（SQLite FTS5）
+#
+# 新写入的状态记录（事务提交后）和日志记录（经过限流后，级别不低于 SEARCH_LOG_LEVEL）
+# 由后台线程按批写入独立的SQLite数据库（默认 search.db，与主数据库放在同一目录），
+# 不占用主数据库的写锁，也不会阻塞监控线程：
+#   - search_entry 保存记录（时间、类型、级别、监控目标、来源、消息），search_fts 是以它为
+#     外部内容的FTS5索引，同时索引类型、级别和目标ID，筛选条件与关键词一起在倒排索引中求交集
+#   - unicode61分词器不切分中文，中日韩文字在写入和搜索时都逐字加空格，多个汉字的关键词按短语匹配
+#   - 记录大致按时间顺序写入，按时间范围搜索时先用 created 索引换算出ID范围，
+#     FTS5按ID倒序（最新的在前）遍历匹配的记录，取够一页即停止，与记录总数无关
+# 状态区间（STATUS_STORAGE=runs）只在状态变化时写入新记录，索引中的时间是区间开始的时间。
+
+SEARCH_INDEX = os.environ.get('SEARCH_INDEX', '1') != '0'
+# 索引数据库文件，默认与主数据库放在同一目录
+SEARCH_INDEX_PATH = os.environ.get('SEARCH_INDEX_PATH', '')
+# 写入索引的最低日志级别
+SEARCH_LOG_LEVEL = os.environ.get('SEARCH_LOG_LEVEL', 'INFO').upper()
+# 索引保留的天数，0表示不清理
+SEARCH_RETENTION_DAYS = float(os.environ.get('SEARCH_RETENTION_DAYS', 90))
+# 等待写入索引的记录数量上限，超出时丢弃新的记录
+SEARCH_QUEUE_SIZE = int(os.environ.get('SEARCH_QUEUE_SIZE', 10000))
+# 每页默认和最大的结果数量
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 50))
+SEARCH_MAX_PAGE_SIZE = 500
+
+# 每个事务最多写入的记录数量
+BATCH_SIZE = 500
+# 清理过期记录的间隔(秒)和每批删除的数量
+PRUNE_INTERVAL = 3600
+PRUNE_BATCH = 5000
+# 记录写入索引的时间相对于记录时间的最大延迟(秒)，按时间范围换算ID范围时留出的余量
+ORDER_SLACK_SECONDS = 600
+
+LEVELS = ('debug', 'info', 'warning', 'error', 'critical')
+KINDS = ('check', 'log')
+# 这些结果代码表示检查本身出错（而不只是没有库存），在索引中记为error级别
+ERROR_CODES = frozenset(('fetch_failed', 'check_error', 'api_error', 'rule_invalid', 'extractor_invalid'))
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS search_entry ('
+    ' id INTEGER PRIMARY KEY,'
+    ' created REAL NOT NULL,'  # UNIX时间
+    ' kind TEXT NOT NULL,'  # check / log
+    ' level TEXT NOT NULL,'
+    ' target INTEGER,'  # 监控目标ID
+    ' ref_id INTEGER,'  # 状态记录ID
+    ' source TEXT,'  # 日志来源（logger名称）
+    ' body TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS ix_search_entry_created ON search_entry (created)',
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5("
+    "body, kind, level, target, content='search_entry', content_rowid='id')",
+)
+
+_EPOCH = datetime(1970, 1, 1)
+_CJK = re.compile(r'([\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef])')
+_TERM = re.compile(r'(-?)"([^"]*)"|(\S+)')
+
+
+def index_path():
+    if SEARCH_INDEX_PATH:
+        return SEARCH_INDEX_PATH
+    from app import DATABASE_PATH
+    return os.path.join(os.path.dirname(DATABASE_PATH), 'search.db')
+
+
+def connect(path=None):
+    conn = sqlite3.connect(path or index_path(), timeout=30)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    for statement in SCHEMA:
+        conn.execute(statement)
+    conn.commit()
+    return conn
+
+
+# 中日韩文字逐字分开，unicode61分词器把每个字作为一个词
+def segment(text):
+    return _CJK.sub(r' \1 ', text or '')
+
+
+def epoch(value):
+    return (value - _EPOCH).total_seconds()
+
+
+def level_of(check_code, is_available):
+    if is_available:
+        return 'info'
+    return 'error' if check_code in ERROR_CODES else 'warning'
+
+
+# 写入一批记录：(created, kind, level, target, ref_id, source, body)
+def write_entries(conn, entries):
+    with conn:
+        _insert_entries(conn, entries)
+
+
+# 在当前事务中写入记录，不提交
+def _insert_entries(conn, entries):
+    for entry in entries:
+        created, kind, level, target, ref_id, source, body = entry
+        cursor = conn.execute(
+            'INSERT INTO search_entry (created, kind, level, target, ref_id, source, body) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            entry
+        )
+        conn.execute('INSERT INTO search_fts (rowid, body, kind, level, target) VALUES (?, ?, ?, ?, ?)',
+                     (cursor.lastrowid, segment(body), kind, level, target))
+
+
+# 删除一批记录，外部内容的FTS5索引需要提供写入时的内容
+def _delete_rows(conn, rows):
+    conn.executemany(
+        "INSERT INTO search_fts (search_fts, rowid, body, kind, level, target) VALUES ('delete', ?, ?, ?, ?, ?)",
+        [(row[0], segment(row[1]), row[2], row[3], row[4]) for row in rows]
+    )
+    conn.executemany('DELETE FROM search_entry WHERE id = ?', [(row[0],) for row in rows])
+
+
+# 删除早于 cutoff（UNIX时间）的记录，返回删除的数量
+def prune(conn, cutoff):
+    removed = 0
+    while True:
+        with conn:
+            rows = conn.execute(
+                'SELECT id, body, kind, level, target FROM search_entry WHERE created < ? ORDER BY created LIMIT ?',
+                (cutoff, PRUNE_BATCH)
+            ).fetchall()
+            _delete_rows(conn, rows)
+        removed += len(rows)
+        if len(rows) < PRUNE_BATCH:
+            return removed
+
+
+# 后台写入线程：状态记录和日志记录放入队列，按批写入索引
+class SearchIndexer:
+    def __init__(self, path=None):
+        self.path = path
+        self.queue = queue.Queue(SEARCH_QUEUE_SIZE)
+        self.dropped = 0
+        self.indexed = 0
+        self.errors = 0
+        self.thread = None
+        self.lock = threading.Lock()
+        # 写入线程写入和清理索引时持有，重建索引时持有以暂停写入
+        self.write_lock = threading.Lock()
+        self.last_prune = time.time()
+
+    # 启动写入线程，已经启动时返回False
+    def start(self):
+        with self.lock:
+            if self.thread is not None:
+                return False
+            self.path = self.path or index_path()
+            self.thread = threading.Thread(target=self._run, name='search-indexer', daemon=True)
+            self.thread.start()
+            atexit.register(self.stop)
+            return True
+
+    def submit(self, entries):
+        for entry in entries:
+            try:
+                self.queue.put_nowait(entry)
+            except queue.Full:
+                self.dropped += 1
+
+    # 等待队列中的记录全部写入
+    def flush(self):
+        self.queue.join()
+
+    # 暂停写入线程（重建索引时），已在队列中的记录先写入；暂停期间提交的记录在恢复后写入
+    @contextmanager
+    def paused(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.flush()
+        with self.write_lock:
+            yield
+
+    def stop(self):
+        if self.thread is not None and self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join(5)
+
+    def _run(self):
+        conn = connect(self.path)
+        while True:
+            item = self.queue.get()
+            batch = [item]
+            while len(batch) < BATCH_SIZE:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            entries = [entry for entry in batch if entry is not None]
+            try:
+                if entries:
+                    with self.write_lock:
+                        write_entries(conn, entries)
+                    self.indexed += len(entries)
+            except Exception as e:
+                self.errors += 1
+                # 本模块的日志不写入索引，不会因写入失败而循环
+                logger.warning("Failed to write %d search index entries: %s", len(entries), e)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+            if len(entries) < len(batch):
+                conn.close()
+                return
+            with self.write_lock:
+                self._prune_if_due(conn)
+
+    def _prune_if_due(self, conn):
+        now = time.time()
+        if SEARCH_RETENTION_DAYS <= 0 or now - self.last_prune < PRUNE_INTERVAL:
+            return
+        self.last_prune = now
+        try:
+            removed = prune(conn, now - SEARCH_RETENTION_DAYS * 86400)
+            if removed:
+                logger.info("Pruned %d search index entries older than %s days", removed, SEARCH_RETENTION_DAYS)
+        except Exception as e:
+            logger.warning("Failed to prune search index: %s", e)
+
+    def to_dict(self):
+        return {
+            'running': self.thread is not None and self.thread.is_alive(),
+            'queued': self.queue.qsize(),
+            'indexed': self.indexed,
+            'dropped': self.dropped,
+            'errors': self.errors,
+        }
+
+
+_indexer = SearchIndexer()
+
+
+def get_indexer():
+    return _indexer
+
+
+# 把日志记录交给索引线程，在日志管道的监听线程中调用（已经过级别过滤和限流）
+class SearchLogHandler(logging.Handler):
+    def emit(self, record):
+        if record.name == __name__:
+            return
+        try:
+            message = record.getMessage()
+            if record.exc_text:
+                message = f"{message}\n{record.exc_text}"
+            _indexer.submit([(record.created, 'log', record.levelname.lower(), getattr(record, 'target_id', None),
+                              None, record.name, message)])
+        except Exception:
+            self.handleError(record)
+
+
+# 启动索引线程并把日志接入索引，在应用初始化时调用
+def start_search_index():
+    from logging_config import add_handler
+
+    if SEARCH_INDEX and _indexer.start():
+        add_handler(SearchLogHandler(SEARCH_LOG_LEVEL))
+
+
+# 事务刷新后记下新的状态记录，提交后再写入索引，回滚时丢弃
+def collect_checks(session):
+    from app import StatusCheck
+    from status_messages import get_message
+
+    if not SEARCH_INDEX:
+        return
+    pending = session.info.setdefault('search_checks', [])
+    for obj in session.new:
+        if isinstance(obj, StatusCheck) and obj.id is not None:
+            message = get_message(obj.message_id) if obj.message_id is not None else None
+            body = message.render() if message is not None else (obj.message_text or '')
+            pending.append((epoch(obj.timestamp or datetime.utcnow()), 'check',
+                            level_of(message.code if message is not None else None, obj.is_available),
+                            obj.monitor_target_id, obj.id, None, body))
+
+
+def publish_checks(session):
+    pending = session.info.pop('search_checks', None)
+    if pending:
+        _indexer.submit(pending)
+
+
+def discard_checks(session):
+    session.info.pop('search_checks', None)
+
+
+# FTS5查询中的一个短语；以*结尾时按前缀匹配
+def _phrase(term):
+    prefix = term.endswith('*') and len(term) > 1
+    text = segment(term[:-1] if prefix else term).strip()
+    if not text:
+        return None
+    return '"' + text.replace('"', '""') + '"' + ('*' if prefix else '')
+
+
+# 把搜索框的输入转换为FTS5查询：空格分隔的关键词都要匹配，引号内为短语，-开头的关键词排除
+def build_match(query='', kind=None, level=None, target_id=None):
+    from history_api import ApiError
+
+    include, exclude = [], []
+    for match in _TERM.finditer(query or ''):
+        negate, quoted, word = match.groups()
+        if word is not None:
+            negate, word = (word.startswith('-') and len(word) > 1), word
+            word = word[1:] if negate else word
+        phrase = _phrase(quoted if quoted is not None else word)
+        if phrase is not None:
+            (exclude if negate else include).append(phrase)
+
+    clauses = [f"body : ({' AND '.join(include)})"] if include else []
+    if kind:
+        if kind not in KINDS:
+            raise ApiError(f'未知的记录类型: {kind}')
+        clauses.append(f'kind : {kind}')
+    if level:
+        if level not in LEVELS:
+            raise ApiError(f'未知的日志级别: {level}')
+        # 不低于所选级别
+        clauses.append(f"level : ({' OR '.join(LEVELS[LEVELS.index(level):])})")
+    if target_id is not None:
+        clauses.append(f'target : "{int(target_id)}"')
+    if exclude and not clauses:
+        raise ApiError('只有排除的关键词时无法搜索')
+    expression = ' AND '.join(clauses)
+    for phrase in exclude:
+        expression += f' NOT body : {phrase}'
+    return expression
+
+
+# 时间范围对应的ID范围：记录的写入延迟不超过 ORDER_SLACK_SECONDS
+def _id_range(conn, since, until):
+    low, high = 0, sys.maxsize
+    if since is not None:
+        row = conn.execute('SELECT id FROM search_entry WHERE created < ? ORDER BY created DESC LIMIT 1',
+                           (since - ORDER_SLACK_SECONDS,)).fetchone()
+        if row is not None:
+            low = row[0] + 1
+    if until is not None:
+        row = conn.execute('SELECT id FROM search_entry WHERE created > ? ORDER BY created LIMIT 1',
+                           (until + ORDER_SLACK_SECONDS,)).fetchone()
+        if row is not None:
+            high = row[0] - 1
+    return low, high
+
+
+_local = threading.local()
+
+
+# 查询使用的连接，每个线程一个
+def _reader():
+    conn = getattr(_local, 'conn', None)
+    if conn is None or getattr(_local, 'path', None) != index_path():
+        conn = connect()
+        _local.conn, _local.path = conn, index_path()
+    return conn
+
+
+# 搜索索引，结果按时间倒序；since/until 为UTC时间，before 为上一页返回的游标
+# 返回 (结果列表, 下一页游标)
+def search(query='', kind=None, level=None, target_id=None, since=None, until=None, before=None,
+           limit=SEARCH_PAGE_SIZE):
+    from history_api import decode_cursor, encode_cursor
+
+    expression = build_match(query, kind, level, target_id)
+    conn = _reader()
+    since = epoch(since) if since is not None else None
+    until = epoch(until) if until is not None else None
+    low, high = _id_range(conn, since, until)
+    if before:
+        high = min(high, decode_cursor(before, (int,))[0] - 1)
+    conditions, params = [], []
+    if since is not None:
+        conditions.append('e.created >= ?')
+        params.append(since)
+    if until is not None:
+        conditions.append('e.created < ?')
+        params.append(until)
+    columns = 'e.id, e.created, e.kind, e.level, e.target, e.ref_id, e.source, e.body'
+    if expression:
+        sql = (f'SELECT {columns} FROM search_fts JOIN search_entry e ON e.id = search_fts.rowid '
+               f'WHERE search_fts MATCH ? AND search_fts.rowid BETWEEN ? AND ?')
+        params = [expression, low, high] + params
+        order = 'search_fts.rowid'
+    else:
+        sql = f'SELECT {columns} FROM search_entry e WHERE e.id BETWEEN ? AND ?'
+        params = [low, high] + params
+        order = 'e.id'
+    sql += ''.join(f' AND {condition}' for condition in conditions) + f' ORDER BY {order} DESC LIMIT ?'
+    try:
+        rows = conn.execute(sql, params + [limit + 1]).fetchall()
+    except sqlite3.OperationalError as e:
+        from history_api import ApiError
+        raise ApiError(f'搜索条件无效: {str(e)}')
+    next_cursor = encode_cursor(rows[limit - 1][0]) if len(rows) > limit else None
+    return [_item(row) for row in rows[:limit]], next_cursor
+
+
+def _item(row):
+    entry_id, created, kind, level, target, ref_id, source, body = row
+    return {
+        'id': entry_id,
+        'time': datetime.utcfromtimestamp(created).isoformat(timespec='seconds') + 'Z',
+        'kind': kind,
+        'level': level,
+        'target_id': target,
+        'check_id': ref_id,
+        'source': source,
+        'message': body,
+    }
+
+
+# 重建索引：按时间顺序重新写入已有的日志记录和数据库中的全部状态记录
+# 需要在应用上下文中调用。本进程的写入线程在重建期间暂停；整个重建在一个事务中进行，
+# 其他进程的写入线程等待索引数据库的写锁，超时（30秒）后放弃该批记录，因此建议在停止服务时执行
+def rebuild_index(batch_size=5000):
+    with _indexer.paused():
+        return _rebuild_index(batch_size)
+
+
+def _rebuild_index(batch_size):
+    import heapq
+    from app import db, StatusCheck
+    from status_messages import get_message, preload_messages
+
+    def checks():
+        last_id = 0
+        while True:
+            rows = db.session.query(
+                StatusCheck.id, StatusCheck.monitor_target_id, StatusCheck.timestamp, StatusCheck.is_available,
+                StatusCheck.message_id, StatusCheck.message_text
+            ).filter(StatusCheck.id > last_id).order_by(StatusCheck.id).limit(batch_size).all()
+            if not rows:
+                return
+            preload_messages(row.message_id for row in rows)
+            for row in rows:
+                message = get_message(row.message_id) if row.message_id is not None else None
+                yield (epoch(row.timestamp or _EPOCH), 'check',
+                       level_of(message.code if message is not None else None, row.is_available),
+                       row.monitor_target_id, row.id, None,
+                       message.render() if message is not None else (row.message_text or ''))
+            last_id = rows[-1].id
+
+    conn = connect()
+    # 先取得写锁，重建完成前其他连接看不到删除了一半的表
+    conn.execute('BEGIN IMMEDIATE')
+    conn.execute('CREATE TEMP TABLE saved_log AS SELECT created, kind, level, target, ref_id, source, body '
+                 "FROM search_entry WHERE kind = 'log'")
+    conn.execute('DROP TABLE search_fts')
+    conn.execute('DROP TABLE search_entry')
+    for statement in SCHEMA:
+        conn.execute(statement)
+    logs = conn.execute('SELECT * FROM saved_log ORDER BY created')
+    # 状态记录按ID读取（ID与时间的顺序基本一致），与日志按时间合并后写入
+    count = 0
+    batch = []
+    for entry in heapq.merge(checks(), logs, key=lambda entry: entry[0]):
+        batch.append(tuple(entry))
+        if len(batch) >= batch_size:
+            _insert_entries(conn, batch)
+            count += len(batch)
+            batch = []
+    _insert_entries(conn, batch)
+    count += len(batch)
+    conn.execute('DROP TABLE saved_log')
+    conn.execute("INSERT INTO search_fts (search_fts) VALUES ('optimize')")
+    conn.commit()
+    conn.close()
+    logger.info(f"Rebuilt search index with {count} entries")
+    return count
+
+
+def index_stats():
+    conn = _reader()
+    counts = dict(conn.execute('SELECT kind, COUNT(*) FROM search_entry GROUP BY kind').fetchall())
+    oldest = conn.execute('SELECT MIN(created) FROM search_entry').fetchone()[0]
+    path = index_path()
+    return {
+        'enabled': SEARCH_INDEX,
+        'path': path,
+        'size_bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+        'entries': counts,
+        'oldest': datetime.utcfromtimestamp(oldest).isoformat(timespec='seconds') + 'Z' if oldest else None,
+        'indexer': _indexer.to_dict(),
+    }
+
+
+# 命令行入口：
+#   python search_index.py stats
+#   python search_index.py rebuild
+#   python search_index.py search 关键词 [--level error] [--target 12] [--hours 24]
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='检查结果和日志的全文搜索索引')
+    parser.add_argument('command', choices=('stats', 'rebuild', 'search'))
+    parser.add_argument('query', nargs='?', default='')
+    parser.add_argument('--kind', choices=KINDS)
+    parser.add_argument('--level', choices=LEVELS)
+    parser.add_argument('--target', type=int)
+    parser.add_argument('--hours', type=float, help='只搜索最近若干小时')
+    parser.add_argument('--limit', type=int, default=SEARCH_PAGE_SIZE)
+    args = parser.parse_args(argv)
+
+    # 命令行工具不需要启动定时任务，数据库初始化完成后再继续
+    os.environ.setdefault('ENABLE_SCHEDULER', '0')
+    os.environ.setdefault('FAST_START', '0')
+    from app import app, db_ready
+
+    db_ready.wait()
+    if args.command == 'rebuild':
+        with app.app_context():
+            print(json.dumps({'entries': rebuild_index()}))
+    elif args.command == 'stats':
+        print(json.dumps(index_stats(), ensure_ascii=False, indent=2))
+    else:
+        since = datetime.utcnow() - timedelta(hours=args.hours) if args.hours else None
+        start = time.perf_counter()
+        items, _ = search(args.query, args.kind, args.level, args.target, since=since, limit=args.limit)
+        for item in items:
+            print(json.dumps(item, ensure_ascii=False))
+        print(f"{len(items)} results in {(time.perf_counter() - start) * 1000:.1f}ms", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    # 通过导入的模块运行，与应用使用同一个写入线程（重建时才能暂停它）
+    import search_index
+    sys.exit(search_index.main())
@@ -0,0 +1,312 @@
+import os
+import hashlib
+import logging
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime
+from urllib.parse import urlsplit
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 页面快照
+#
+# SNAPSHOT_STORE=1 时，监控周期把每次抓取到的页面压缩后保存到 page_snapshot 表，
+# 每个页面（URL）保留最近 SNAPSHOT_KEEP 份，修改检查规则时可以用这些快照离线测试，
+# 不需要等到下一个监控周期，也不会再次请求供应商网站：
+#   - 同一主机的页面模板大多相同，每个主机用第一次保存的页面开头作为zlib预设字典，
+#     之后的页面引用字典中的内容，压缩率明显高于单独压缩
+#   - 内容与该页面最近一份快照相同时只更新时间，不重复保存
+#   - 所有快照压缩后的总大小超过 SNAPSHOT_MAX_BYTES 时，淘汰最久未使用（保存或测试）的快照
+# 流式匹配提前停止下载的页面只保存了已下载的部分，测试结果中会标注。
+
+SNAPSHOT_STORE = os.environ.get('SNAPSHOT_STORE', '0') == '1'
+# 每个页面保留的快照数量
+SNAPSHOT_KEEP = int(os.environ.get('SNAPSHOT_KEEP', 5))
+# 所有快照压缩后的总大小上限(字节)
+SNAPSHOT_MAX_BYTES = int(os.environ.get('SNAPSHOT_MAX_BYTES', 64 * 1024 * 1024))
+# zlib压缩级别
+SNAPSHOT_LEVEL = int(os.environ.get('SNAPSHOT_LEVEL', 6))
+
+# deflate的窗口为32KB，更长的字典没有作用
+DICTIONARY_BYTES = 32 * 1024
+
+# 快照内容：text 为解压后的页面
+Snapshot = namedtuple('Snapshot', ['id', 'url', 'fetched_at', 'source', 'partial', 'raw_size', 'size', 'text'])
+
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+
+
+def _host(url):
+    return (urlsplit(url).hostname or '').lower()
+
+
+# 主机的压缩字典，返回(字典ID, 字典内容)；没有时用 sample 创建
+def host_dictionary(host, sample=None):
+    from app import db, SnapshotDictionary
+
+    cached = _dictionaries.get(host)
+    if cached is not None:
+        return cached
+    table = SnapshotDictionary.__table__
+    row = db.session.execute(select(table.c.id, table.c.data).where(table.c.host == host)).first()
+    if row is not None:
+        with _dictionaries_lock:
+            _dictionaries[host] = (row.id, bytes(row.data))
+        return _dictionaries[host]
+    if not sample:
+        return None, None
+    try:
+        with db.session.begin_nested():
+            dictionary_id = db.session.execute(
+                table.insert().values(host=host, data=sample, created_at=datetime.utcnow())
+            ).inserted_primary_key[0]
+    except IntegrityError:
+        # 其他进程同时创建了该主机的字典
+        return host_dictionary(host)
+    # 新建的字典随调用方的事务提交，提交之前不放入缓存
+    return dictionary_id, sample
+
+
+# 按ID读取字典（解压用）
+def _dictionary_by_id(dictionary_id):
+    from app import db, SnapshotDictionary
+
+    for cached in list(_dictionaries.values()):
+        if cached[0] == dictionary_id:
+            return cached[1]
+    table = SnapshotDictionary.__table__
+    row = db.session.execute(select(table.c.host, table.c.data).where(table.c.id == dictionary_id)).first()
+    if row is None:
+        raise LookupError(f"Snapshot dictionary {dictionary_id} not found")
+    with _dictionaries_lock:
+        _dictionaries[row.host] = (dictionary_id, bytes(row.data))
+    return bytes(row.data)
+
+
+def compress(data, zdict=None):
+    compressor = zlib.compressobj(SNAPSHOT_LEVEL, zdict=zdict) if zdict else zlib.compressobj(SNAPSHOT_LEVEL)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(body, zdict=None):
+    decompressor = zlib.decompressobj(zdict=zdict) if zdict else zlib.decompressobj()
+    return decompressor.decompress(body) + decompressor.flush()
+
+
+# 保存一次抓取到的页面，返回快照ID（内容未变化时为已有快照的ID）
+# 在当前会话中写入，由调用方提交（监控周期结束时与状态记录一起提交）
+def save_snapshot(url, content, monitor_target_id=None, source=None, partial=False):
+    from app import db, PageSnapshot
+
+    data = content.encode('utf-8')
+    digest = hashlib.sha1(data).hexdigest()
+    now = datetime.utcnow()
+    table = PageSnapshot.__table__
+
+    latest = db.session.execute(
+        select(table.c.id, table.c.digest).where(table.c.url == url)
+        .order_by(table.c.fetched_at.desc(), table.c.id.desc()).limit(1)
+    ).first()
+    if latest is not None and latest.digest == digest:
+        db.session.execute(table.update().where(table.c.id == latest.id)
+                           .values(fetched_at=now, last_used_at=now, source=source, partial=partial))
+        return latest.id
+
+    dictionary_id, zdict = host_dictionary(_host(url), data[:DICTIONARY_BYTES])
+    body = compress(data, zdict)
+    snapshot_id = db.session.execute(table.insert().values(
+        url=url, monitor_target_id=monitor_target_id, fetched_at=now, last_used_at=now, source=source,
+        partial=partial, digest=digest, raw_size=len(data), size=len(body), dictionary_id=dictionary_id, body=body
+    )).inserted_primary_key[0]
+    _evict(url, snapshot_id)
+    return snapshot_id
+
+
+# 每个页面只保留最近 SNAPSHOT_KEEP 份快照；总大小超出上限时淘汰最久未使用的快照（刚保存的快照除外）
+def _evict(url, keep_id):
+    from app import db, PageSnapshot
+
+    table = PageSnapshot.__table__
+    stale = [row.id for row in db.session.execute(
+        select(table.c.id).where(table.c.url == url)
+        .order_by(table.c.fetched_at.desc(), table.c.id.desc()).offset(SNAPSHOT_KEEP)
+    )]
+    if stale:
+        db.session.execute(table.delete().where(table.c.id.in_(stale)))
+
+    total = db.session.execute(select(func.coalesce(func.sum(table.c.size), 0))).scalar()
+    if total <= SNAPSHOT_MAX_BYTES:
+        return
+    evicted = []
+    for row in db.session.execute(select(table.c.id, table.c.size).where(table.c.id != keep_id)
+                                  .order_by(table.c.last_used_at, table.c.id)):
+        if total <= SNAPSHOT_MAX_BYTES:
+            break
+        evicted.append(row.id)
+        total -= row.size or 0
+    for start in range(0, len(evicted), 500):
+        db.session.execute(table.delete().where(table.c.id.in_(evicted[start:start + 500])))
+    logger.info(f"Evicted {len(evicted)} least recently used page snapshots")
+
+
+# 读取页面最近的快照（从新到旧），同时更新最近使用时间（由调用方提交）
+def load_snapshots(url, limit=None):
+    from app import db, PageSnapshot
+
+    table = PageSnapshot.__table__
+    query = select(table).where(table.c.url == url).order_by(table.c.fetched_at.desc(), table.c.id.desc())
+    if limit:
+        query = query.limit(limit)
+    rows = db.session.execute(query).all()
+    if rows:
+        db.session.execute(table.update().where(table.c.id.in_([row.id for row in rows]))
+                           .values(last_used_at=datetime.utcnow()))
+    return [_snapshot(row) for row in rows]
+
+
+# 按ID读取一份快照
+def load_snapshot(snapshot_id):
+    from app import db, PageSnapshot
+
+    table = PageSnapshot.__table__
+    row = db.session.execute(select(table).where(table.c.id == snapshot_id)).first()
+    return _snapshot(row) if row is not None else None
+
+
+def _snapshot(row):
+    zdict = _dictionary_by_id(row.dictionary_id) if row.dictionary_id is not None else None
+    text = decompress(row.body, zdict).decode('utf-8')
+    return Snapshot(row.id, row.url, row.fetched_at, row.source, bool(row.partial), row.raw_size, row.size, text)
+
+
+# 快照存储的统计：快照数量、页面数量、压缩前后的总大小
+def snapshot_stats():
+    from app import db, PageSnapshot, SnapshotDictionary
+
+    table = PageSnapshot.__table__
+    row = db.session.execute(select(
+        func.count(table.c.id), func.count(func.distinct(table.c.url)),
+        func.coalesce(func.sum(table.c.raw_size), 0), func.coalesce(func.sum(table.c.size), 0)
+    )).first()
+    dictionaries = db.session.execute(select(func.count(SnapshotDictionary.__table__.c.id))).scalar()
+    snapshots, pages, raw_bytes, stored_bytes = row
+    return {
+        'enabled': SNAPSHOT_STORE,
+        'snapshots': snapshots,
+        'pages': pages,
+        'dictionaries': dictionaries,
+        'raw_bytes': raw_bytes,
+        'stored_bytes': stored_bytes,
+        'ratio': round(raw_bytes / stored_bytes, 2) if stored_bytes else None,
+        'max_bytes': SNAPSHOT_MAX_BYTES,
+        'keep': SNAPSHOT_KEEP,
+    }
+
+
+# 待测试的检查规则：以监控目标为基础，替换检查类型、检查模式和期望结果
+def candidate_target(target, check_type=None, check_pattern=None, expected_result=None):
+    from config_snapshot import TARGET_FIELDS, TargetConfig
+
+    parent_pattern = target.parent.check_pattern if target.parent is not None else None
+    config = TargetConfig(*(getattr(target, field) for field in TARGET_FIELDS), parent_pattern)
+    return config._replace(
+        check_type=check_type or config.check_type,
+        check_pattern=check_pattern if check_pattern is not None else config.check_pattern,
+        expected_result=expected_result if expected_result is not None else config.expected_result
+    )
+
+
+# 用页面的快照测试检查规则（不发出网络请求），同时给出当前规则的结果用于对比
+# 返回每份快照的结果列表（从新到旧）
+def evaluate_snapshots(target, candidate, limit=None):
+    from monitor import SharedPage, check_stock_status
+
+    current = candidate_target(target)
+    results = []
+    for snapshot in load_snapshots(target.url, limit):
+        started = time.perf_counter()
+        page = SharedPage.from_content([candidate], snapshot.text, snapshot.source)
+        is_available, message, _ = check_stock_status(candidate, page)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        page = SharedPage.from_content([current], snapshot.text, snapshot.source)
+        current_available, current_message, _ = check_stock_status(current, page)
+        results.append({
+            'snapshot_id': snapshot.id,
+            'fetched_at': snapshot.fetched_at.isoformat() if snapshot.fetched_at else None,
+            'source': snapshot.source,
+            'partial': snapshot.partial,
+            'raw_size': snapshot.raw_size,
+            'is_available': is_available,
+            'code': message.code,
+            'message': str(message),
+            'current_available': current_available,
+            'current_message': str(current_message),
+            'changed': is_available != current_available,
+            'elapsed_ms': round(elapsed_ms, 2),
+        })
+    return results
+
+
+# 命令行入口：
+#   python snapshots.py stats
+#   python snapshots.py test <目标ID> [--type selector] [--pattern ".stock"] [--expected 有货]
+#   python snapshots.py show <快照ID>
+def main(argv=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='页面快照')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='快照存储的统计')
+    test_parser = subparsers.add_parser('test', help='用已保存的快照测试检查规则')
+    test_parser.add_argument('target_id', type=int)
+    test_parser.add_argument('--type', dest='check_type', help='检查类型，默认为目标当前的类型')
+    test_parser.add_argument('--pattern', dest='check_pattern', help='检查模式，默认为目标当前的模式')
+    test_parser.add_argument('--expected', dest='expected_result', help='期望结果，默认为目标当前的期望结果')
+    test_parser.add_argument('--limit', type=int, help='最多测试的快照数量')
+    show_parser = subparsers.add_parser('show', help='输出快照的页面内容')
+    show_parser.add_argument('snapshot_id', type=int)
+    args = parser.parse_args(argv)
+
+    # 命令行工具不需要启动定时任务，数据库初始化完成后再继续
+    os.environ.setdefault('ENABLE_SCHEDULER', '0')
+    os.environ.setdefault('FAST_START', '0')
+    from app import app, db, MonitorTarget
+
+    with app.app_context():
+        if args.command == 'stats':
+            print(json.dumps(snapshot_stats(), indent=2))
+        elif args.command == 'test':
+            target = db.session.get(MonitorTarget, args.target_id)
+            if target is None:
+                print(f"Monitor target {args.target_id} not found")
+                return 1
+            candidate = candidate_target(target, args.check_type, args.check_pattern, args.expected_result)
+            results = evaluate_snapshots(target, candidate, args.limit)
+            db.session.commit()
+            if not results:
+                print(f"No snapshots for {target.url}")
+                return 1
+            for result in results:
+                flags = ' (partial)' if result['partial'] else ''
+                changed = ' *' if result['changed'] else ''
+                print(f"#{result['snapshot_id']} {result['fetched_at']}{flags}: "
+                      f"{'有库存' if result['is_available'] else '无库存'} - {result['message']}{changed}")
+        elif args.command == 'show':
+            snapshot = load_snapshot(args.snapshot_id)
+            if snapshot is None:
+                print(f"Snapshot {args.snapshot_id} not found")
+                return 1
+            print(snapshot.text)
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
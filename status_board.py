@@ -0,0 +1,483 @@
+import os
+import sys
+import math
+import mmap
+import fcntl
+import struct
+import logging
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 共享内存状态板
+#
+# 仪表盘和状态接口需要的最新状态（是否有库存、检查时间、响应时间）监控进程都已经有了，
+# 状态板把它们写入一个固定布局的内存映射文件，所有gunicorn进程映射同一个文件，读取时不访问数据库：
+#   - 文件头之后是按目标ID索引的定长记录，记录中有状态开始的时间、最近检查时间、响应时间、
+#     状态记录ID和该目标的写入次数（version）
+#   - 写入使用seqlock：先把记录的序号加一（变为奇数），写入内容，再加一（变为偶数）；
+#     读取时序号为奇数或前后不一致说明正在写入，重新读取，读取方不加锁；重试多次仍未读到一致的记录时
+#     （例如写入方在写入中途被终止）放弃读取，改为查询数据库；写入时从偶数开始计数，这样的记录在下次写入后恢复
+#   - 写入方之间通过线程锁（同一进程中的监控周期、手动检查和请求线程共用一个文件描述符，flock不能使它们互斥）
+#     和文件锁（flock，不同进程之间）互斥
+#   - 状态记录在事务提交后才写入状态板，回滚的事务不会留下状态
+#   - 文件头中的目标版本号在目标配置变化时（bump_config_version）递增，各进程据此重新加载
+#     目标的名称、URL等信息（一次查询）；状态版本号在每次写入状态后递增，版本号不变时
+#     各进程直接使用上次读取的结果
+# 运行定时监控的进程启动时根据数据库重建状态板；状态板不存在、未就绪或目标ID超出容量时，
+# 仪表盘和状态接口照常查询数据库。
+
+STATUS_BOARD = os.environ.get('STATUS_BOARD', '1') != '0'
+# 状态板文件，默认与数据库放在同一目录
+STATUS_BOARD_PATH = os.environ.get('STATUS_BOARD_PATH', '')
+# 容量（最大目标ID + 1），每个目标48字节
+STATUS_BOARD_CAPACITY = int(os.environ.get('STATUS_BOARD_CAPACITY', 16384))
+# 检查状态板文件是否被重建的间隔(秒)
+STATUS_BOARD_RECHECK = float(os.environ.get('STATUS_BOARD_RECHECK', 5))
+
+MAGIC = b'VPSB'
+LAYOUT_VERSION = 1
+# 文件头：标识、布局版本、容量、记录大小、是否就绪、目标版本号、状态版本号
+HEADER = struct.Struct('<4sIIIIII36x')
+READY_OFFSET = 16
+TARGETS_VERSION_OFFSET = 20
+STATUS_VERSION_OFFSET = 24
+# 记录：序号、目标ID、状态、最近检查时间、状态开始时间、响应时间、状态记录ID、写入次数
+RECORD = struct.Struct('<IIb3xdddII4x')
+# 记录中序号之后的部分
+PAYLOAD = struct.Struct('<Ib3xdddII4x')
+SEQ = struct.Struct('<I')
+WORD = struct.Struct('<I')
+
+# 记录中的状态：0表示没有状态（等待检查或空位）
+EMPTY, UNAVAILABLE, AVAILABLE = 0, 1, 2
+
+# 读取一条记录的最大重试次数
+READ_RETRIES = 1000
+# 重试后仍未读到一致的记录
+_TORN = object()
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+TARGET_COLUMNS = ('id', 'name', 'url', 'check_type', 'vendor', 'region', 'interval', 'is_active', 'parent_id',
+                  'created_at')
+# 仪表盘使用的目标信息，latest_status 为 BoardStatus 或 None
+BoardTarget = namedtuple('BoardTarget', TARGET_COLUMNS + ('latest_status',))
+
+
+def _to_epoch(value):
+    return (value - _EPOCH).total_seconds()
+
+
+def _from_epoch(value):
+    return _EPOCH + timedelta(seconds=value)
+
+# 从状态板读取的最新状态，属性与StatusCheck相同，可直接用于模板和接口
+# 时间以UTC秒数保存，用到时才转换为datetime
+class BoardStatus(namedtuple('BoardStatus', ['id', 'is_available', 'since', 'checked', 'response_time', 'version'])):
+    __slots__ = ()
+
+    @property
+    def timestamp(self):
+        return _from_epoch(self.since)
+
+    @property
+    def checked_at(self):
+        return _from_epoch(self.checked)
+
+
+def board_path():
+    if STATUS_BOARD_PATH:
+        return STATUS_BOARD_PATH
+    from app import DATABASE_PATH
+    return os.path.join(os.path.dirname(DATABASE_PATH), 'status_board.bin')
+
+
+class StatusBoard:
+    def __init__(self, path, fd, mm, capacity):
+        self.path = path
+        self.fd = fd
+        self.mm = mm
+        self.capacity = capacity
+        self.pid = os.getpid()
+        self.inode = os.fstat(fd).st_ino
+        self.lock = threading.Lock()
+
+    # 映射已有的状态板文件，文件不存在或布局不符时返回None
+    @classmethod
+    def open(cls, path):
+        try:
+            fd = os.open(path, os.O_RDWR)
+        except FileNotFoundError:
+            return None
+        try:
+            size = os.fstat(fd).st_size
+            if size < HEADER.size:
+                raise ValueError('truncated header')
+            mm = mmap.mmap(fd, size)
+            magic, layout, capacity, record_size, _, _, _ = HEADER.unpack_from(mm, 0)
+            if magic != MAGIC or layout != LAYOUT_VERSION or record_size != RECORD.size \
+                    or size < HEADER.size + capacity * RECORD.size:
+                mm.close()
+                raise ValueError('unexpected layout')
+        except (OSError, ValueError) as e:
+            os.close(fd)
+            logger.warning("Ignoring status board %s: %s", path, e)
+            return None
+        return cls(path, fd, mm, capacity)
+
+    # 创建新的状态板文件（未就绪），通过改名替换旧文件，已映射旧文件的进程不会读到截断的数据
+    @classmethod
+    def create(cls, path, capacity):
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, LAYOUT_VERSION, capacity, RECORD.size, 0, 0, 0))
+            f.truncate(HEADER.size + capacity * RECORD.size)
+        os.replace(tmp, path)
+        return cls.open(path)
+
+    def close(self):
+        self.mm.close()
+        os.close(self.fd)
+
+    @property
+    def ready(self):
+        return WORD.unpack_from(self.mm, READY_OFFSET)[0] == 1
+
+    @property
+    def targets_version(self):
+        return WORD.unpack_from(self.mm, TARGETS_VERSION_OFFSET)[0]
+
+    @property
+    def status_version(self):
+        return WORD.unpack_from(self.mm, STATUS_VERSION_OFFSET)[0]
+
+    # 文件已被删除或替换
+    def stale(self):
+        try:
+            return os.stat(self.path).st_ino != self.inode
+        except FileNotFoundError:
+            return True
+
+    # 写入方之间的互斥锁：线程锁用于同一进程内的线程，flock用于不同进程
+    @contextmanager
+    def writing(self):
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                yield self
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+    def _offset(self, target_id):
+        return HEADER.size + target_id * RECORD.size
+
+    def _status(self, record):
+        _, target_id, state, checked_at, since, response_time, check_id, version = record
+        if state == EMPTY:
+            return None
+        # NaN表示没有响应时间
+        return BoardStatus(check_id, state == AVAILABLE, since, checked_at,
+                           None if response_time != response_time else response_time, version)
+
+    # 读取一个目标的状态，没有状态或读取失败时返回None
+    def read(self, target_id):
+        status = self._read(target_id)
+        return None if status is _TORN else status
+
+    def _read(self, target_id):
+        if not 0 <= target_id < self.capacity:
+            return None
+        offset = self._offset(target_id)
+        for _ in range(READ_RETRIES):
+            seq = SEQ.unpack_from(self.mm, offset)[0]
+            if seq & 1:
+                time.sleep(0)
+                continue
+            record = RECORD.unpack_from(self.mm, offset)
+            if SEQ.unpack_from(self.mm, offset)[0] == seq:
+                return self._status(record)
+        logger.warning("Status board record %d is still being written after %d retries", target_id, READ_RETRIES)
+        return _TORN
+
+    # 读取ID不超过max_id的所有目标的状态，返回 {目标ID: BoardStatus}；有记录读取失败时返回None
+    # 先读取所有序号，再复制记录，再读取一次序号，序号有变化的记录单独重新读取
+    def read_all(self, max_id):
+        count = min(max_id + 1, self.capacity)
+        if count <= 0:
+            return {}
+        start, end = HEADER.size, HEADER.size + count * RECORD.size
+        step = RECORD.size // WORD.size
+        with memoryview(self.mm) as view, view[start:end] as records, records.cast('I') as words:
+            before = words[::step].tolist()
+            data = bytes(records)
+            after = words[::step].tolist()
+        statuses = {}
+        for target_id, record, seq_before, seq_after in zip(range(count), RECORD.iter_unpack(data), before, after):
+            if record[2] == EMPTY and seq_before == seq_after:
+                continue
+            status = self._read(target_id) if seq_before != seq_after or seq_before & 1 else self._status(record)
+            if status is _TORN:
+                return None
+            if status is not None:
+                statuses[target_id] = status
+        return statuses
+
+    # 写入一个目标的状态，调用方需持有写入锁
+    # force为True时（重建状态板）不比较检查时间
+    def write(self, target_id, check_id, is_available, since, checked_at, response_time, force=False):
+        if not 0 <= target_id < self.capacity:
+            return False
+        offset = self._offset(target_id)
+        seq, _, state, current_checked_at, _, _, _, version = RECORD.unpack_from(self.mm, offset)
+        # 较早的记录（例如合并历史时修改的旧区间）不覆盖最新状态
+        if not force and state != EMPTY and _to_epoch(checked_at) < current_checked_at:
+            return False
+        seq = self._begin_write(offset, seq)
+        PAYLOAD.pack_into(self.mm, offset + SEQ.size, target_id, AVAILABLE if is_available else UNAVAILABLE,
+                          _to_epoch(checked_at), _to_epoch(since),
+                          math.nan if response_time is None else response_time, check_id or 0, (version + 1) & 0xFFFFFFFF)
+        SEQ.pack_into(self.mm, offset, (seq + 2) & 0xFFFFFFFF)
+        return True
+
+    # 把序号设为奇数，返回写入完成后序号减2的值
+    # 从偶数开始计数：写入方中途被终止而留下的奇数序号在下次写入后恢复为偶数
+    def _begin_write(self, offset, seq):
+        seq = (seq + 1) & 0xFFFFFFFE
+        SEQ.pack_into(self.mm, offset, (seq + 1) & 0xFFFFFFFF)
+        return seq
+
+    # 清除一个目标的状态（目标已删除），调用方需持有写入锁
+    def clear(self, target_id):
+        if not 0 <= target_id < self.capacity:
+            return
+        offset = self._offset(target_id)
+        seq = self._begin_write(offset, SEQ.unpack_from(self.mm, offset)[0])
+        PAYLOAD.pack_into(self.mm, offset + SEQ.size, 0, EMPTY, 0.0, 0.0, 0.0, 0, 0)
+        SEQ.pack_into(self.mm, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def set_ready(self, ready):
+        WORD.pack_into(self.mm, READY_OFFSET, 1 if ready else 0)
+
+    def bump_targets_version(self):
+        WORD.pack_into(self.mm, TARGETS_VERSION_OFFSET, (self.targets_version + 1) & 0xFFFFFFFF)
+
+    # 写入状态后调用，调用方需持有写入锁
+    def bump_status_version(self):
+        WORD.pack_into(self.mm, STATUS_VERSION_OFFSET, (self.status_version + 1) & 0xFFFFFFFF)
+
+
+_board = None
+_board_checked_at = 0.0
+_board_lock = threading.Lock()
+
+
+# 获取当前进程映射的状态板，不存在时返回None（定期重新检查文件）
+def get_board():
+    global _board, _board_checked_at
+    if not STATUS_BOARD:
+        return None
+    board = _board
+    now = time.monotonic()
+    if board is not None and board.pid == os.getpid() and now - _board_checked_at < STATUS_BOARD_RECHECK:
+        return board
+    if board is None and now - _board_checked_at < STATUS_BOARD_RECHECK:
+        return None
+    with _board_lock:
+        if _board is not None and (_board.pid != os.getpid() or _board.stale()):
+            # fork后的子进程需要自己的文件描述符，flock才能在进程之间互斥
+            _board = None
+        if _board is None:
+            _board = StatusBoard.open(board_path())
+        _board_checked_at = now
+        return _board
+
+
+# 根据数据库重建状态板：写入所有目标的最新状态，清除已删除的目标，然后标记为就绪
+def rebuild_board(capacity=None):
+    global _board, _board_checked_at
+    from app import db, MonitorTarget, StatusCheck
+
+    if not STATUS_BOARD:
+        return None
+    capacity = capacity or STATUS_BOARD_CAPACITY
+    path = board_path()
+    with _board_lock:
+        board = StatusBoard.open(path)
+        if board is None or board.capacity != capacity:
+            if board is not None:
+                # 已映射旧文件的进程在重新检查前改为查询数据库
+                board.set_ready(False)
+                board.close()
+            board = StatusBoard.create(path, capacity)
+        _board, _board_checked_at = board, time.monotonic()
+
+    # 持有写入锁后再查询数据库：查询之后提交的状态等待写入锁，在重建完成后写入，不会被较早的状态覆盖
+    with board.writing():
+        rows = db.session.query(
+            MonitorTarget.id, StatusCheck.id, StatusCheck.is_available, StatusCheck.timestamp,
+            StatusCheck.last_checked, StatusCheck.response_time
+        ).outerjoin(StatusCheck, MonitorTarget.latest_check_id == StatusCheck.id).all()
+        existing = board.read_all(board.capacity - 1)
+        target_ids = set()
+        for target_id, check_id, is_available, timestamp, last_checked, response_time in rows:
+            target_ids.add(target_id)
+            if check_id is None:
+                board.clear(target_id)
+            else:
+                board.write(target_id, check_id, is_available, timestamp, last_checked or timestamp, response_time,
+                            force=True)
+        # 有记录读取失败时（写入方中途被终止）清除所有不存在的目标的记录
+        stale = existing.keys() if existing is not None else range(board.capacity)
+        for target_id in set(stale) - target_ids:
+            board.clear(target_id)
+        board.bump_targets_version()
+        board.bump_status_version()
+        board.set_ready(True)
+    overflow = sum(1 for target_id in target_ids if target_id >= board.capacity)
+    if overflow:
+        logger.warning("%d monitor targets exceed STATUS_BOARD_CAPACITY=%d, dashboard will query the database",
+                       overflow, board.capacity)
+    logger.info("Status board rebuilt at %s with %d targets", path, len(target_ids))
+    return board
+
+
+# 在flush后记录本事务中写入的状态和删除的目标，提交后再写入状态板
+def collect_updates(session):
+    from app import MonitorTarget, StatusCheck
+
+    if not STATUS_BOARD:
+        return
+    updates = session.info.setdefault('board_updates', {})
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, StatusCheck) and obj.monitor_target_id is not None:
+            checked_at = obj.last_checked or obj.timestamp
+            current = updates.get(obj.monitor_target_id)
+            if current is None or checked_at >= current[3]:
+                updates[obj.monitor_target_id] = (obj.id, obj.is_available, obj.timestamp, checked_at, obj.response_time)
+    deleted = [obj.id for obj in session.deleted if isinstance(obj, MonitorTarget)]
+    if deleted:
+        session.info.setdefault('board_cleared', set()).update(deleted)
+
+
+# 事务提交后写入状态板
+def publish_updates(session):
+    updates = session.info.pop('board_updates', None)
+    cleared = session.info.pop('board_cleared', None)
+    config_changed = session.info.pop('config_changed', False)
+    if not (updates or cleared or config_changed):
+        return
+    board = get_board()
+    if board is None:
+        return
+    try:
+        with board.writing():
+            for target_id, (check_id, is_available, since, checked_at, response_time) in (updates or {}).items():
+                board.write(target_id, check_id, is_available, since, checked_at, response_time)
+            for target_id in cleared or ():
+                board.clear(target_id)
+            if updates or cleared:
+                board.bump_status_version()
+            if config_changed:
+                board.bump_targets_version()
+    except Exception as e:
+        logger.warning("Failed to update status board: %s", e)
+
+
+def discard_updates(session):
+    for key in ('board_updates', 'board_cleared', 'config_changed'):
+        session.info.pop(key, None)
+
+
+_targets = (None, ())
+_listing = (None, None)
+
+
+# 目标信息和状态板中的最新状态，按ID排序；状态板不可用时返回None，调用方改为查询数据库
+# 目标信息按进程缓存，状态板中的目标版本号变化时重新加载；结果按（状态板文件, 目标版本号, 状态版本号）缓存
+def board_targets():
+    global _targets, _listing
+    from flask import g, has_request_context
+
+    if has_request_context() and 'board_targets' in g:
+        return g.board_targets
+    board = get_board()
+    if board is None or not board.ready:
+        return None
+    # 先读取版本号再读取数据，读取期间有写入时版本号已变化，下次请求会重新读取
+    # 重建的状态板文件版本号从头开始计数，缓存同时按文件（inode）区分
+    version = (board.inode, board.targets_version, board.status_version)
+    cached_version, result = _listing
+    if cached_version != version:
+        cached_targets_version, targets = _targets
+        if cached_targets_version != version[:2]:
+            from app import db, MonitorTarget
+            columns = [getattr(MonitorTarget, column) for column in TARGET_COLUMNS]
+            targets = tuple(BoardTarget(*row, None) for row in db.session.query(*columns).order_by(MonitorTarget.id))
+            if targets and targets[-1].id >= board.capacity:
+                targets = None
+            _targets = (version[:2], targets)
+        if targets is None:
+            result = None
+        else:
+            statuses = board.read_all(targets[-1].id) if targets else {}
+            # 有记录读取失败时改为查询数据库
+            result = tuple(target._replace(latest_status=statuses.get(target.id)) for target in targets) \
+                if statuses is not None else None
+        _listing = (version, result)
+    if has_request_context():
+        g.board_targets = result
+    return result
+
+
+def board_stats():
+    board = get_board()
+    if board is None:
+        return {'enabled': STATUS_BOARD, 'path': board_path() if STATUS_BOARD else None, 'ready': False}
+    statuses = board.read_all(board.capacity - 1)
+    return {
+        'enabled': True,
+        'path': board.path,
+        'ready': board.ready,
+        'capacity': board.capacity,
+        'targets': len(statuses) if statuses is not None else None,
+        'targets_version': board.targets_version,
+        'status_version': board.status_version,
+    }
+
+
+# 命令行入口：
+#   python status_board.py stats
+#   python status_board.py rebuild [--capacity N]
+# 运行中的服务启动时已重建状态板，rebuild 只应在停止服务时执行：容量变化时会替换状态板文件，
+# 服务进程在重新检查文件（STATUS_BOARD_RECHECK）之前仍写入旧文件，这些状态不会出现在新文件中
+def main(argv=None):
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description='共享内存状态板')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('stats', help='显示状态板信息')
+    rebuild = subparsers.add_parser('rebuild', help='根据数据库重建状态板（需先停止服务）')
+    rebuild.add_argument('--capacity', type=int, help='容量（最大目标ID + 1）')
+    args = parser.parse_args(argv)
+
+    # 命令行工具不需要启动定时任务，数据库初始化完成后再继续
+    os.environ.setdefault('ENABLE_SCHEDULER', '0')
+    os.environ.setdefault('FAST_START', '0')
+    from app import app
+    with app.app_context():
+        if args.command == 'rebuild':
+            rebuild_board(args.capacity)
+        print(json.dumps(board_stats(), ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
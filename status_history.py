@@ -0,0 +1,254 @@
+import os
+import logging
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import func, or_
+from status_messages import check_message, get_message, intern_message, preload_messages, reason_label
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 状态历史存储
+#
+# STATUS_STORAGE=runs（默认）时只在状态（是否有库存、状态消息）变化时写入新的StatusCheck记录，
+# 状态不变的检查只更新当前记录的 last_checked、check_count 和响应时间统计，
+# 每条记录表示一段状态稳定的区间，timestamp 为区间开始（状态变化）的时间。
+# STATUS_STORAGE=full 时每次检查写入一条记录（旧的存储方式）。
+# 下面的查询函数同时适用于两种格式的记录，可以混合存在。
+STATUS_STORAGE = os.environ.get('STATUS_STORAGE', 'runs')
+
+# 状态变化记录
+Transition = namedtuple('Transition', ['target_id', 'timestamp', 'is_available', 'message', 'code'])
+
+
+# 记录一次检查结果：状态与上一条记录相同时合并到该区间，否则写入新记录
+# message为status_messages.CheckMessage；返回(状态记录, 是否新建)
+def record_check(target_id, previous, is_available, message, response_time, timestamp=None):
+    from app import db, StatusCheck
+
+    timestamp = timestamp or datetime.utcnow()
+    message_id = intern_message(message)
+    if STATUS_STORAGE == 'runs' and previous is not None and previous.is_available == is_available:
+        # 旧的文本消息记录按生成的消息文本比较，升级后状态不变时不会多写一条记录
+        if previous.message_id == message_id or previous.message == message.render():
+            previous.extend_run(timestamp, response_time)
+            return previous, False
+
+    status_check = StatusCheck(
+        monitor_target_id=target_id,
+        timestamp=timestamp,
+        is_available=is_available,
+        response_time=response_time,
+        message_id=message_id,
+        check_count=1,
+        response_time_min=response_time,
+        response_time_max=response_time,
+        response_time_total=response_time
+    )
+    db.session.add(status_check)
+    return status_check, True
+
+
+# 某一时刻的状态：该时刻之前开始的最近一条记录，没有记录时返回None
+def status_at(target_id, when):
+    from app import StatusCheck
+
+    return StatusCheck.query.filter(
+        StatusCheck.monitor_target_id == target_id,
+        StatusCheck.timestamp <= when
+    ).order_by(StatusCheck.timestamp.desc(), StatusCheck.id.desc()).first()
+
+
+# 统计一段时间内的可用率：
+#   uptime         按时间加权的有库存比例(%)，每条记录持续到下一条记录开始（最后一条持续到最近一次检查）
+#   success_rate   按检查次数计算的有库存比例(%)
+#   avg_response_time / checks / transitions
+# target_ids为空时统计所有目标；返回 {target_id: 统计结果}，没有记录的目标不包含在结果中
+def uptime_summary(since, until=None, target_ids=None):
+    from app import db, StatusCheck
+
+    until = until or datetime.utcnow()
+    query = db.session.query(
+        StatusCheck.monitor_target_id, StatusCheck.timestamp, StatusCheck.last_checked, StatusCheck.is_available,
+        StatusCheck.check_count, StatusCheck.response_time, StatusCheck.response_time_total
+    ).filter(
+        or_(StatusCheck.timestamp >= since, StatusCheck.last_checked >= since),
+        StatusCheck.timestamp <= until
+    )
+    if target_ids is not None:
+        query = query.filter(StatusCheck.monitor_target_id.in_(list(target_ids)))
+    rows = query.order_by(StatusCheck.monitor_target_id, StatusCheck.timestamp, StatusCheck.id).all()
+
+    summaries = {}
+    for index, row in enumerate(rows):
+        following = rows[index + 1] if index + 1 < len(rows) else None
+        if following is not None and following.monitor_target_id != row.monitor_target_id:
+            following = None
+        start = max(row.timestamp, since)
+        end = following.timestamp if following is not None else (row.last_checked or row.timestamp)
+        duration = max((min(end, until) - start).total_seconds(), 0.0)
+        checks = row.check_count or 1
+        total_time = row.response_time_total if row.response_time_total is not None else (row.response_time or 0)
+
+        summary = summaries.setdefault(row.monitor_target_id, {
+            'observed_seconds': 0.0, 'available_seconds': 0.0, 'checks': 0, 'available_checks': 0,
+            'response_time_total': 0.0, 'transitions': 0, 'last_available': None
+        })
+        summary['observed_seconds'] += duration
+        summary['checks'] += checks
+        summary['response_time_total'] += total_time
+        if row.is_available:
+            summary['available_seconds'] += duration
+            summary['available_checks'] += checks
+        if summary['last_available'] is not None and summary['last_available'] != row.is_available:
+            summary['transitions'] += 1
+        summary['last_available'] = row.is_available
+
+    results = {}
+    for target_id, summary in summaries.items():
+        observed = summary['observed_seconds']
+        results[target_id] = {
+            'uptime': round(summary['available_seconds'] / observed * 100, 2) if observed else None,
+            'success_rate': round(summary['available_checks'] / summary['checks'] * 100, 2),
+            'avg_response_time': round(summary['response_time_total'] / summary['checks'], 2),
+            'checks': summary['checks'],
+            'transitions': summary['transitions'],
+        }
+    return results
+
+
+# 状态变化历史（只包含是否有库存发生变化的记录），按时间倒序
+# target_id为空时返回所有目标的状态变化
+def transitions(target_id=None, since=None, limit=50):
+    from app import db, StatusCheck
+
+    previous = func.lag(StatusCheck.is_available).over(
+        partition_by=StatusCheck.monitor_target_id,
+        order_by=(StatusCheck.timestamp, StatusCheck.id)
+    )
+    query = db.session.query(
+        StatusCheck.monitor_target_id, StatusCheck.timestamp, StatusCheck.is_available,
+        StatusCheck.message_id, StatusCheck.message_text.label('message_text'), previous.label('previous')
+    )
+    if target_id is not None:
+        query = query.filter(StatusCheck.monitor_target_id == target_id)
+    if since is not None:
+        query = query.filter(StatusCheck.timestamp >= since)
+    history = query.subquery()
+
+    rows = db.session.query(
+        history.c.monitor_target_id, history.c.timestamp, history.c.is_available,
+        history.c.message_id, history.c.message_text
+    ).filter(
+        or_(history.c.previous.is_(None), history.c.previous != history.c.is_available)
+    ).order_by(history.c.timestamp.desc()).limit(limit).all()
+
+    preload_messages(row.message_id for row in rows)
+    results = []
+    for target_id, timestamp, is_available, message_id, message_text in rows:
+        message = get_message(message_id) if message_id is not None else None
+        results.append(Transition(target_id, timestamp, is_available,
+                                  message.render() if message else message_text, message.code if message else None))
+    return results
+
+
+# 按结果代码统计一段时间内的失败原因（按检查次数），返回[(代码, 原因说明, 次数)]，次数多的在前
+# 旧的文本消息记录没有结果代码，归入“其他”
+def failure_reasons(since, target_ids=None):
+    from app import db, StatusCheck
+
+    query = db.session.query(StatusCheck.message_id, func.sum(func.coalesce(StatusCheck.check_count, 1))).filter(
+        StatusCheck.is_available.is_(False),
+        or_(StatusCheck.timestamp >= since, StatusCheck.last_checked >= since)
+    )
+    if target_ids is not None:
+        query = query.filter(StatusCheck.monitor_target_id.in_(list(target_ids)))
+    rows = query.group_by(StatusCheck.message_id).all()
+
+    preload_messages(message_id for message_id, _ in rows)
+    counts = {}
+    for message_id, count in rows:
+        message = get_message(message_id) if message_id is not None else None
+        code = message.code if message else None
+        counts[code] = counts.get(code, 0) + count
+    return sorted(((code, reason_label(code), count) for code, count in counts.items()), key=lambda item: -item[2])
+
+
+# 合并两条相邻且状态相同的记录
+def _merge_run(current, check):
+    def total(item):
+        return item.response_time_total if item.response_time_total is not None else (item.response_time or 0)
+
+    values = [value for item in (current, check) for value in (item.response_time_min, item.response_time_max, item.response_time)
+              if value is not None]
+    current.response_time_total = total(current) + total(check)
+    current.response_time_min = min(values) if values else None
+    current.response_time_max = max(values) if values else None
+    current.check_count = (current.check_count or 1) + (check.check_count or 1)
+    current.last_checked = check.checked_at
+    if check.response_time is not None:
+        current.response_time = check.response_time
+
+
+# 把逐条写入的历史记录合并为状态区间，旧的文本消息改为引用去重后的消息，返回删除的记录数
+# 每个目标单独处理并提交，避免长时间锁住数据库
+def compact_history(target_ids=None):
+    from app import db, MonitorTarget, StatusCheck
+
+    if target_ids is None:
+        target_ids = [row[0] for row in db.session.query(MonitorTarget.id).all()]
+
+    removed = 0
+    for target_id in target_ids:
+        checks = StatusCheck.query.filter_by(monitor_target_id=target_id).order_by(
+            StatusCheck.timestamp, StatusCheck.id
+        ).all()
+        current = None
+        merged_ids = []
+        for check in checks:
+            if current is not None and current.is_available == check.is_available and current.message == check.message:
+                _merge_run(current, check)
+                merged_ids.append(check.id)
+            else:
+                current = check
+                # 旧的文本消息也改为引用去重后的消息
+                if current.message_id is None and current.message_text is not None:
+                    current.message_id = intern_message(check_message('legacy_text', text=current.message_text))
+                    current.message_text = None
+        if merged_ids:
+            for start in range(0, len(merged_ids), 500):
+                StatusCheck.query.filter(StatusCheck.id.in_(merged_ids[start:start + 500])).delete(synchronize_session=False)
+            # 最新记录可能已被合并，重新指向区间记录
+            MonitorTarget.query.filter_by(id=target_id).update({'latest_check_id': current.id})
+            removed += len(merged_ids)
+        db.session.commit()
+        db.session.expunge_all()
+
+    logger.info(f"Compacted status history: removed {removed} rows")
+    return removed
+
+
+# 命令行入口：
+#   python status_history.py compact
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description='状态历史维护')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('compact', help='把逐条写入的历史记录合并为状态区间')
+    args = parser.parse_args(argv)
+
+    # 命令行工具不需要启动定时任务，数据库初始化完成后再继续
+    os.environ.setdefault('ENABLE_SCHEDULER', '0')
+    os.environ.setdefault('FAST_START', '0')
+    from app import app
+
+    with app.app_context():
+        if args.command == 'compact':
+            print(compact_history())
+    return 0
+
+
+if __name__ == '__main__':
+    import sys
+    sys.exit(main())
@@ -0,0 +1,178 @@
+import json
+import logging
+import threading
+from collections import namedtuple
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 检查结果消息
+#
+# 检查结果以结果代码和参数表示（如 text_missing + {"pattern": "In Stock"}），
+# 相同的(代码, 参数)在 status_message 表中只保存一次，状态记录只引用其ID，
+# 显示时再按代码对应的模板生成中文消息。已保存的消息在进程内缓存，
+# 正常的监控周期不需要为消息查询或写入数据库。
+
+
+# 产品子目标的状态消息：有库存/无库存，附带库存数量和价格
+def _render_product(params):
+    parts = []
+    if params.get('stock') is not None:
+        parts.append(f"库存: {params['stock']}")
+    elif params.get('stock_text'):
+        parts.append(f"库存: {params['stock_text']}")
+    if params.get('price') is not None:
+        parts.append(f"价格: {params['price']:g}")
+    detail = f" ({', '.join(parts)})" if parts else ''
+    return f"{'有库存' if params.get('available') else '无库存'}{detail}"
+
+
+# 结果代码 -> (原因说明, 消息模板或生成函数)
+MESSAGE_CODES = {
+    'empty': ('无结果', ''),
+    'fetch_failed': ('无法获取页面', '无法获取页面内容'),
+    'text_found': ('找到匹配文本', '找到匹配文本: {pattern}'),
+    'text_missing': ('未找到匹配文本', '未找到匹配文本: {pattern}'),
+    'rule_matched': ('文本规则匹配', '文本规则匹配 (命中: {hits})'),
+    'rule_unmatched': ('文本规则不匹配', '文本规则不匹配 (命中: {hits})'),
+    'rule_invalid': ('文本规则无效', '文本规则无效: {error}'),
+    'selector_expected': ('选择器包含期望结果', '选择器元素包含期望结果: {expected}'),
+    'selector_unexpected': ('选择器不包含期望结果', '选择器元素不包含期望结果'),
+    'selector_found': ('找到选择器元素', '找到选择器元素: {selector}'),
+    'selector_missing': ('未找到选择器元素', '未找到选择器元素: {selector}'),
+    'extractor_summary': ('提取产品', '提取到 {total} 个产品，其中 {available} 个有库存'),
+    'extractor_invalid': ('提取器配置无效', '提取器配置无效: {error}'),
+    'product_parent_missing': ('提取器目标不存在', '产品所属的提取器目标不存在'),
+    'product_missing': ('页面中未找到产品', '页面中未找到产品: {name}'),
+    'product_status': ('产品库存状态', _render_product),
+    'api_expected': ('API符合期望结果', 'API响应符合期望结果'),
+    'api_unexpected': ('API不符合期望结果', 'API响应不符合期望结果'),
+    'api_path_found': ('API包含路径', 'API响应包含路径: {path}'),
+    'api_path_missing': ('API未找到路径', 'API响应中未找到路径: {path}'),
+    'api_error': ('API检查失败', 'API检查失败: {error}'),
+    'check_error': ('检查过程出错', '检查过程中发生错误: {error}'),
+    # 升级前写入的文本消息（由 status_history.compact_history 转换）
+    'legacy_text': ('其他', '{text}'),
+}
+
+# 进程内缓存的消息数量上限，超出后清空（错误消息的参数可能不断变化）
+MESSAGE_CACHE_SIZE = 50000
+
+
+class CheckMessage(namedtuple('CheckMessage', ['code', 'params'])):
+    __slots__ = ()
+
+    # 参数的规范化JSON，与代码一起在数据库中作为去重的键
+    @property
+    def params_json(self):
+        return json.dumps(dict(self.params), ensure_ascii=False, sort_keys=True)
+
+    @property
+    def label(self):
+        return reason_label(self.code)
+
+    def render(self):
+        template = MESSAGE_CODES.get(self.code, (None, self.code))[1]
+        params = dict(self.params)
+        if callable(template):
+            return template(params)
+        try:
+            return template.format(**params)
+        except (KeyError, IndexError, ValueError):
+            return f"{template} {params}"
+
+    def __str__(self):
+        return self.render()
+
+
+# 创建检查结果消息，例如 check_message('text_missing', pattern='In Stock')
+def check_message(code, **params):
+    return CheckMessage(code, tuple(sorted(params.items())))
+
+
+# 结果代码的原因说明，用于按失败原因分组统计
+def reason_label(code):
+    if code is None:
+        return '其他'
+    return MESSAGE_CODES.get(code, (code,))[0]
+
+
+_ids = {}
+_messages = {}
+_cache_lock = threading.Lock()
+
+
+def _remember(message_id, message):
+    with _cache_lock:
+        if len(_ids) >= MESSAGE_CACHE_SIZE:
+            _ids.clear()
+            _messages.clear()
+        _ids[message] = message_id
+        _messages[message_id] = message
+
+
+# 获取消息的ID，不存在时在当前事务中写入
+# 新写入的消息在事务提交后才加入进程缓存，事务回滚时不会留下无效的ID
+def intern_message(message):
+    from app import db, StatusMessage
+    from sqlalchemy.dialects.sqlite import insert
+
+    message_id = _ids.get(message)
+    if message_id is not None:
+        return message_id
+    pending = db.session.info.setdefault('pending_messages', {})
+    if message in pending:
+        return pending[message]
+
+    params = message.params_json
+    db.session.execute(
+        insert(StatusMessage.__table__).values(code=message.code, params=params)
+        .on_conflict_do_nothing(index_elements=['code', 'params'])
+    )
+    message_id = db.session.query(StatusMessage.id).filter_by(code=message.code, params=params).scalar()
+    pending[message] = message_id
+    return message_id
+
+
+# 根据ID获取消息，未缓存时从数据库读取
+def get_message(message_id):
+    from app import db, StatusMessage
+
+    message = _messages.get(message_id)
+    if message is not None:
+        return message
+    for pending_message, pending_id in db.session.info.get('pending_messages', {}).items():
+        if pending_id == message_id:
+            return pending_message
+    row = db.session.query(StatusMessage.code, StatusMessage.params).filter_by(id=message_id).first()
+    if row is None:
+        return None
+    message = CheckMessage(row.code, tuple(sorted(json.loads(row.params or '{}').items())))
+    _remember(message_id, message)
+    return message
+
+
+# 预加载一组消息，避免显示多条记录时逐条查询
+def preload_messages(message_ids):
+    from app import db, StatusMessage
+
+    missing = {message_id for message_id in message_ids if message_id is not None and message_id not in _messages}
+    if not missing:
+        return
+    rows = db.session.query(StatusMessage.id, StatusMessage.code, StatusMessage.params).filter(
+        StatusMessage.id.in_(missing)
+    ).all()
+    for row in rows:
+        _remember(row.id, CheckMessage(row.code, tuple(sorted(json.loads(row.params or '{}').items()))))
+
+
+# 事务提交后把新写入的消息加入缓存，回滚时丢弃
+def promote_pending_messages(session):
+    pending = session.info.pop('pending_messages', None)
+    if pending:
+        for message, message_id in pending.items():
+            _remember(message_id, message)
+
+
+def discard_pending_messages(session):
+    session.info.pop('pending_messages', None)
@@ -0,0 +1,227 @@
+import logging
+from bisect import bisect_left
+from collections import namedtuple
+from math import inf
+from types import MappingProxyType
+from matcher import build_literal_matcher
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 通知订阅索引
+#
+# 通知设置可以绑定单个监控目标，也可以不绑定目标而按条件订阅：
+#   filter_vendor     供应商（URL主机名，不含www.）
+#   filter_keyword    目标名称中包含的关键词（不区分大小写）
+#   filter_region     监控目标的地区
+#   filter_max_price  价格上限（只匹配带价格的产品状态）
+# 多个条件同时设置时需全部满足，都未设置且未绑定目标时即为全局通知设置。
+#
+# 每个设置按最有选择性的条件（目标 > 供应商 > 地区 > 关键词 > 价格上限）放入一个分桶，
+# 状态变化时只取出与事件相关的分桶再逐个校验其余条件，不需要遍历所有设置；
+# 关键词分桶用一个多关键词匹配器一次扫描目标名称。
+# 每个分桶内的设置按价格上限排序，事件带价格时二分查找跳过上限低于价格的设置，
+# 没有价格时只取没有价格上限的设置。
+# 通知设置修改后只更新发生变化的设置（见 SubscriptionIndex.update）。
+
+# 状态变化事件：target 为监控目标配置，price 为检查结果中的价格（没有时为None）
+SubscriptionEvent = namedtuple('SubscriptionEvent', ['target', 'is_available', 'changed', 'price'])
+
+_BUCKETS = ('by_target', 'by_vendor', 'by_region', 'by_keyword')
+
+
+# 规范化筛选条件：去掉空白并转为小写，空字符串视为未设置
+def normalize_filter(value):
+    value = (value or '').strip().lower()
+    return value or None
+
+
+# 供应商筛选条件：允许填写URL或带www.的主机名
+def normalize_vendor(value):
+    from app import vendor_from_url
+
+    value = normalize_filter(value)
+    if value is None:
+        return None
+    return vendor_from_url(value if '://' in value else f"http://{value}") or value
+
+
+# 设置放入的分桶和键
+def bucket_key(setting):
+    if setting.monitor_target_id is not None:
+        return 'by_target', setting.monitor_target_id
+    if setting.filter_vendor:
+        return 'by_vendor', setting.filter_vendor
+    if setting.filter_region:
+        return 'by_region', setting.filter_region
+    if setting.filter_keyword:
+        return 'by_keyword', setting.filter_keyword
+    if setting.filter_max_price is not None:
+        return 'by_price', None
+    return 'wildcard', None
+
+
+# 校验事件是否满足设置的所有条件
+def setting_matches(setting, event, target_name=None):
+    target = event.target
+    if setting.monitor_target_id is not None and setting.monitor_target_id != target.id:
+        return False
+    if setting.filter_vendor and setting.filter_vendor != (target.vendor or '').lower():
+        return False
+    if setting.filter_region and setting.filter_region != normalize_filter(getattr(target, 'region', None)):
+        return False
+    if setting.filter_keyword:
+        if target_name is None:
+            target_name = (target.name or '').lower()
+        if setting.filter_keyword not in target_name:
+            return False
+    if setting.filter_max_price is not None and (event.price is None or event.price > setting.filter_max_price):
+        return False
+    if setting.monitor_target_id is not None and not has_filters(setting):
+        # 只绑定目标的设置：状态变化（包括变为无库存）都通知
+        return event.changed
+    # 按条件订阅的设置与全局设置一样只通知变为有库存
+    return event.changed and event.is_available
+
+
+def has_filters(setting):
+    return bool(setting.filter_vendor or setting.filter_region or setting.filter_keyword
+                or setting.filter_max_price is not None)
+
+
+# 按价格上限排序的一组设置
+class PriceBucket:
+    __slots__ = ('settings', 'ceilings', 'unlimited_from')
+
+    def __init__(self, settings):
+        self.settings = tuple(sorted(settings, key=lambda item: (ceiling(item), item.id)))
+        self.ceilings = tuple(ceiling(item) for item in self.settings)
+        self.unlimited_from = bisect_left(self.ceilings, inf)
+
+    def __len__(self):
+        return len(self.settings)
+
+    # 价格上限不低于price的设置；price为None时只返回没有价格上限的设置
+    def eligible(self, price):
+        start = self.unlimited_from if price is None else bisect_left(self.ceilings, price)
+        return self.settings[start:]
+
+
+def ceiling(setting):
+    return setting.filter_max_price if setting.filter_max_price is not None else inf
+
+
+class SubscriptionIndex:
+    __slots__ = ('settings', 'by_target', 'by_vendor', 'by_region', 'by_keyword', 'by_price', 'wildcard',
+                 'keyword_matcher', 'watermark')
+
+    def __init__(self, settings=(), watermark=None):
+        self.settings = MappingProxyType({setting.id: setting for setting in settings})
+        buckets = {name: {} for name in _BUCKETS}
+        price = []
+        wildcard = []
+        for setting in self.settings.values():
+            bucket, key = bucket_key(setting)
+            if bucket == 'by_price':
+                price.append(setting)
+            elif bucket == 'wildcard':
+                wildcard.append(setting)
+            else:
+                buckets[bucket].setdefault(key, []).append(setting)
+        for name in _BUCKETS:
+            setattr(self, name, MappingProxyType({key: PriceBucket(items) for key, items in buckets[name].items()}))
+        self.by_price = PriceBucket(price)
+        self.wildcard = PriceBucket(wildcard)
+        self.keyword_matcher = build_literal_matcher(tuple(sorted(self.by_keyword))) if self.by_keyword else None
+        self.watermark = watermark
+
+    def __len__(self):
+        return len(self.settings)
+
+    # 绑定到目标的设置数量和未绑定目标的设置数量
+    def counts(self):
+        bound = sum(len(bucket) for bucket in self.by_target.values())
+        return bound, len(self.settings) - bound
+
+    def _bucket(self, name, key):
+        if name in _BUCKETS:
+            return getattr(self, name).get(key)
+        return getattr(self, name)
+
+    # 应用修改过的设置和已删除（或已禁用）的设置ID，返回新的索引；当前索引不变，可继续被其他线程使用
+    # 只有受影响的分桶会重新生成，其余分桶与当前索引共用
+    def update(self, changed=(), removed_ids=(), watermark=None):
+        settings = dict(self.settings)
+        touched = set(removed_ids) | {setting.id for setting in changed}
+        affected = set()
+        for setting_id in touched:
+            previous = settings.pop(setting_id, None)
+            if previous is not None:
+                affected.add(bucket_key(previous))
+        for setting in changed:
+            if setting.enabled:
+                settings[setting.id] = setting
+                affected.add(bucket_key(setting))
+
+        members = {}
+        for name, key in affected:
+            bucket = self._bucket(name, key)
+            members[(name, key)] = [item for item in (bucket.settings if bucket else ()) if item.id not in touched]
+        for setting in changed:
+            if setting.enabled:
+                members[bucket_key(setting)].append(setting)
+
+        index = SubscriptionIndex.__new__(SubscriptionIndex)
+        index.settings = MappingProxyType(settings)
+        for name in _BUCKETS:
+            buckets = dict(getattr(self, name))
+            for (bucket_name, key), items in members.items():
+                if bucket_name != name:
+                    continue
+                if items:
+                    buckets[key] = PriceBucket(items)
+                else:
+                    buckets.pop(key, None)
+            setattr(index, name, MappingProxyType(buckets))
+        for name in ('by_price', 'wildcard'):
+            items = members.get((name, None))
+            setattr(index, name, PriceBucket(items) if items is not None else getattr(self, name))
+        if index.by_keyword.keys() == self.by_keyword.keys():
+            index.keyword_matcher = self.keyword_matcher
+        else:
+            index.keyword_matcher = build_literal_matcher(tuple(sorted(index.by_keyword))) if index.by_keyword else None
+        index.watermark = watermark if watermark is not None else self.watermark
+        return index
+
+    # 事件对应的候选设置（只取出相关的分桶）
+    def candidates(self, event, target_name):
+        target = event.target
+        buckets = [self.by_target.get(target.id)]
+        if not event.is_available:
+            # 变为无库存时只通知绑定目标且没有其他条件的设置
+            bucket = buckets[0]
+            return list(bucket.eligible(None)) if bucket else []
+        if self.by_vendor and target.vendor:
+            buckets.append(self.by_vendor.get(target.vendor.lower()))
+        region = normalize_filter(getattr(target, 'region', None))
+        if self.by_region and region:
+            buckets.append(self.by_region.get(region))
+        if self.keyword_matcher is not None and target_name:
+            buckets.extend(self.by_keyword[keyword] for keyword in self.keyword_matcher.find(target_name))
+        buckets.append(self.by_price)
+        buckets.append(self.wildcard)
+
+        candidates = []
+        for bucket in buckets:
+            if bucket:
+                candidates.extend(bucket.eligible(event.price))
+        return candidates
+
+    # 事件需要通知的设置，按设置ID排序
+    def match(self, event):
+        if not event.changed:
+            return []
+        target_name = (event.target.name or '').lower()
+        matched = {setting.id: setting for setting in self.candidates(event, target_name)
+                   if setting_matches(setting, event, target_name)}
+        return [matched[setting_id] for setting_id in sorted(matched)]
@@ -0,0 +1,199 @@
+import os
+import logging
+from collections import Counter
+from sqlalchemy import case, func
+from sqlalchemy.orm import contains_eager
+
+# 配置日志
+logger = logging.getLogger(__name__)
+
+# 仪表盘目标列表：服务端分页、筛选和排序
+#
+# 最新状态通过 MonitorTarget.latest_check_id 按主键关联，不再逐个目标查询；
+# 供应商、名称和最新检查记录都有索引，页面大小固定时查询耗时不随目标数量增长。
+# 共享内存状态板（见status_board）可用时，在内存中按相同的规则筛选、排序和分页，不访问数据库。
+
+STATUS_FILTERS = ('all', 'available', 'unavailable', 'unknown')
+SORT_FIELDS = ('name', 'status', 'last_checked', 'response_time', 'created')
+
+# 仪表盘卡片视图的默认每页数量，以及JSON接口允许的最大每页数量
+DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', 60))
+MAX_PAGE_SIZE = 500
+
+
+# 从请求参数中解析筛选、排序和分页条件
+def parse_listing_args(args, default_per_page=DASHBOARD_PAGE_SIZE):
+    status = args.get('status', 'all')
+    if status not in STATUS_FILTERS:
+        status = 'all'
+    sort = args.get('sort', 'name')
+    if sort not in SORT_FIELDS:
+        sort = 'name'
+    order = 'desc' if args.get('order') == 'desc' else 'asc'
+    page = max(args.get('page', 1, type=int) or 1, 1)
+    per_page = min(max(args.get('per_page', default_per_page, type=int) or default_per_page, 1), MAX_PAGE_SIZE)
+    return {
+        'status': status,
+        'vendor': (args.get('vendor') or '').strip().lower(),
+        'sort': sort,
+        'order': order,
+        'page': page,
+        'per_page': per_page,
+    }
+
+
+def _filtered_query(query, status, vendor):
+    from app import MonitorTarget, StatusCheck
+
+    query = query.outerjoin(StatusCheck, MonitorTarget.latest_check_id == StatusCheck.id)
+    if vendor:
+        query = query.filter(MonitorTarget.vendor == vendor)
+    if status == 'available':
+        query = query.filter(StatusCheck.is_available.is_(True))
+    elif status == 'unavailable':
+        query = query.filter(StatusCheck.is_available.is_(False))
+    elif status == 'unknown':
+        query = query.filter(MonitorTarget.latest_check_id.is_(None))
+    return query
+
+
+def _order_by(sort, order):
+    from app import MonitorTarget, StatusCheck
+
+    if sort == 'status':
+        # 有库存 < 无库存 < 等待检查
+        column = case((StatusCheck.is_available.is_(True), 0), (StatusCheck.is_available.is_(False), 1), else_=2)
+    elif sort == 'last_checked':
+        column = func.coalesce(StatusCheck.last_checked, StatusCheck.timestamp)
+    elif sort == 'response_time':
+        column = StatusCheck.response_time
+    elif sort == 'created':
+        column = MonitorTarget.id
+    else:
+        column = MonitorTarget.name
+    column = column.desc() if order == 'desc' else column.asc()
+    # 以ID作为次级排序，保证分页结果稳定
+    return [column, MonitorTarget.id.desc() if order == 'desc' else MonitorTarget.id.asc()]
+
+
+# 状态板中的目标按筛选条件过滤
+def _board_filter(targets, status, vendor):
+    if vendor:
+        targets = [target for target in targets if target.vendor == vendor]
+    if status == 'available':
+        return [target for target in targets if target.latest_status is not None and target.latest_status.is_available]
+    if status == 'unavailable':
+        return [target for target in targets if target.latest_status is not None and not target.latest_status.is_available]
+    if status == 'unknown':
+        return [target for target in targets if target.latest_status is None]
+    return targets
+
+
+# 与 _order_by 相同的排序：空值在升序时排在最前，以ID作为次级排序
+def _board_sort_key(sort):
+    def value(target):
+        latest = target.latest_status
+        if sort == 'status':
+            return 2 if latest is None else (0 if latest.is_available else 1)
+        if sort == 'last_checked':
+            return latest.checked_at if latest is not None else None
+        if sort == 'response_time':
+            return latest.response_time if latest is not None else None
+        if sort == 'created':
+            return target.id
+        return target.name
+
+    def key(target):
+        item = value(target)
+        return (item is not None, item, target.id)
+    return key
+
+
+# 查询一页监控目标（已预加载最新状态），返回 (targets, total)
+def query_targets(status='all', vendor='', sort='name', order='asc', page=1, per_page=DASHBOARD_PAGE_SIZE):
+    from app import db, MonitorTarget
+    from status_board import board_targets
+
+    targets = board_targets()
+    if targets is not None:
+        targets = sorted(_board_filter(targets, status, vendor), key=_board_sort_key(sort), reverse=order == 'desc')
+        return targets[(page - 1) * per_page:page * per_page], len(targets)
+
+    total = _filtered_query(db.session.query(func.count(MonitorTarget.id)), status, vendor).scalar()
+    targets = (
+        _filtered_query(MonitorTarget.query, status, vendor)
+        .options(contains_eager(MonitorTarget.latest_status))
+        .order_by(*_order_by(sort, order))
+        .offset((page - 1) * per_page)
+        .limit(per_page)
+        .all()
+    )
+    return targets, total
+
+
+# 按状态统计目标数量（可按供应商过滤）
+def status_counts(vendor=''):
+    from app import db, MonitorTarget, StatusCheck
+    from status_board import board_targets
+
+    targets = board_targets()
+    if targets is not None:
+        counts = {key: len(_board_filter(targets, key, vendor)) for key in ('available', 'unavailable', 'unknown')}
+        counts['all'] = sum(counts.values())
+        return counts
+
+    query = db.session.query(StatusCheck.is_available, func.count(MonitorTarget.id)).select_from(MonitorTarget)
+    rows = _filtered_query(query, 'all', vendor).group_by(StatusCheck.is_available).all()
+    counts = {'available': 0, 'unavailable': 0, 'unknown': 0}
+    for is_available, count in rows:
+        if is_available is None:
+            counts['unknown'] += count
+        else:
+            counts['available' if is_available else 'unavailable'] += count
+    counts['all'] = sum(counts.values())
+    return counts
+
+
+# 所有供应商及其目标数量，用于筛选下拉框
+def vendor_options():
+    from app import db, MonitorTarget
+    from status_board import board_targets
+
+    targets = board_targets()
+    if targets is not None:
+        counts = Counter(target.vendor for target in targets if target.vendor)
+        return [{'vendor': vendor, 'count': counts[vendor]} for vendor in sorted(counts)]
+
+    rows = (
+        db.session.query(MonitorTarget.vendor, func.count(MonitorTarget.id))
+        .filter(MonitorTarget.vendor.isnot(None), MonitorTarget.vendor != '')
+        .group_by(MonitorTarget.vendor)
+        .order_by(MonitorTarget.vendor)
+        .all()
+    )
+    return [{'vendor': vendor, 'count': count} for vendor, count in rows]
+
+
+# 目标状态的字符串表示
+def target_status(target):
+    if target.latest_status is None:
+        return 'unknown'
+    return 'available' if target.latest_status.is_available else 'unavailable'
+
+
+# 序列化单个目标供JSON接口使用
+def target_summary(target, convert_time=None):
+    latest = target.latest_status
+    last_checked = None
+    if latest is not None and latest.checked_at is not None:
+        last_checked = convert_time(latest.checked_at) if convert_time else latest.checked_at.isoformat()
+    return {
+        'id': target.id,
+        'name': target.name,
+        'url': target.url,
+        'vendor': target.vendor,
+        'is_active': bool(target.is_active),
+        'status': target_status(target),
+        'last_checked': last_checked,
+        'response_time': latest.response_time if latest is not None else None,
+    }
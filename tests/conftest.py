@@ -0,0 +1,24 @@
+import os
+import sys
+import tempfile
+
+# 测试使用临时目录中的数据库、状态板和搜索索引，不启动定时任务；需要在导入app之前设置
+_tmp = tempfile.mkdtemp(prefix='stock-monitor-tests-')
+os.environ.setdefault('DATABASE_PATH', os.path.join(_tmp, 'database.db'))
+os.environ.setdefault('STATUS_BOARD_PATH', os.path.join(_tmp, 'status_board.bin'))
+os.environ.setdefault('SEARCH_INDEX', '0')
+os.environ.setdefault('LOG_FILE', os.path.join(_tmp, 'app.log'))
+os.environ.setdefault('ENABLE_SCHEDULER', '0')
+os.environ.setdefault('FAST_START', '0')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+import pytest
+
+
+# 应用（导入时完成数据库初始化），测试之间共用同一个临时数据库
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    return app
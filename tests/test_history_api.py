@@ -0,0 +1,117 @@
+import json
+from datetime import datetime, timedelta
+
+import pytest
+
+from history_api import ApiError, decode_cursor, encode_cursor
+
+BASE = datetime(2024, 3, 1, 8, 0, 0)
+
+
+@pytest.fixture
+def target(app):
+    from app import db, MonitorTarget, StatusCheck
+
+    with app.app_context():
+        target = MonitorTarget(name='history', url='https://history.example/item')
+        db.session.add(target)
+        db.session.flush()
+        # 同一时间（包括同一秒内不同微秒）的多条记录，分页时按ID区分
+        timestamps = [BASE] * 5 + [BASE + timedelta(microseconds=500)] * 3 + [BASE + timedelta(seconds=1)] * 2 \
+            + [BASE - timedelta(minutes=1)]
+        for i, timestamp in enumerate(timestamps):
+            db.session.add(StatusCheck(monitor_target_id=target.id, timestamp=timestamp, is_available=i % 2 == 0,
+                                       response_time=float(i), message_text=f'check {i}'))
+        db.session.commit()
+        checks = sorted(((check.timestamp, check.id) for check in target.status_checks))
+        yield target.id, [check_id for _, check_id in checks]
+
+
+def pages(client, url, **params):
+    ids = []
+    after = None
+    for _ in range(100):
+        query = dict(params, **({'after': after} if after else {}))
+        response = client.get(url, query_string=query)
+        assert response.status_code == 200
+        body = response.get_json()
+        ids.extend(item['id'] for item in body['items'])
+        after = body['next']
+        if after is None:
+            return ids
+    raise AssertionError('pagination did not terminate')
+
+
+def test_cursor_round_trip():
+    timestamp = BASE + timedelta(microseconds=123)
+    assert decode_cursor(encode_cursor(timestamp, 7), (datetime, int)) == (timestamp, 7)
+    assert decode_cursor(encode_cursor(42), (int,)) == (42,)
+
+
+# 无法解码、字段数量不符、类型不符、不是列表（'e30' 为 {} 的编码）
+@pytest.mark.parametrize('cursor', ['not-base64!', encode_cursor(1, 2), encode_cursor('x'), 'e30'])
+def test_invalid_cursor(cursor):
+    with pytest.raises(ApiError):
+        decode_cursor(cursor, (int,))
+
+
+@pytest.mark.parametrize('limit', [1, 2, 3, 4, 100])
+def test_check_pages_with_equal_timestamps(app, target, limit):
+    target_id, expected = target
+    client = app.test_client()
+    url = f'/api/targets/{target_id}/checks'
+    assert pages(client, url, limit=limit) == expected
+    assert pages(client, url, limit=limit, order='desc') == expected[::-1]
+
+
+def test_check_pages_respect_time_range(app, target):
+    target_id, expected = target
+    client = app.test_client()
+    ids = pages(client, f'/api/targets/{target_id}/checks', limit=2,
+                since='2024-03-01T08:00:00Z', until='2024-03-01T08:00:01Z')
+    assert ids == expected[1:9]
+    assert client.get(f'/api/targets/{target_id}/checks', query_string={'after': 'bad'}).status_code == 400
+
+
+def test_export_resumes_from_cursor(app, target):
+    target_id, expected = target
+    client = app.test_client()
+    first = client.get(f'/api/targets/{target_id}/checks', query_string={'limit': 4}).get_json()
+    response = client.get(f'/api/targets/{target_id}/checks', query_string={'format': 'ndjson', 'after': first['next']})
+    assert response.mimetype == 'application/x-ndjson'
+    exported = [json.loads(line)['id'] for line in response.get_data(as_text=True).splitlines()]
+    assert [item['id'] for item in first['items']] + exported == expected
+
+
+def test_target_pages(app, target):
+    from app import MonitorTarget
+
+    with app.app_context():
+        expected = [row.id for row in MonitorTarget.query.order_by(MonitorTarget.id)]
+    assert pages(app.test_client(), '/api/targets', limit=2, fields='id') == expected
+
+
+def test_etag_revalidation(app, target):
+    from app import db, StatusCheck
+
+    target_id, _ = target
+    client = app.test_client()
+    url = f'/api/targets/{target_id}/checks'
+    response = client.get(url, query_string={'limit': 3})
+    etag = response.headers['ETag']
+    assert response.status_code == 200 and etag
+
+    cached = client.get(url, query_string={'limit': 3}, headers={'If-None-Match': etag})
+    assert cached.status_code == 304
+    assert cached.get_data() == b''
+    # 其他参数的响应不同，ETag也不同
+    assert client.get(url, query_string={'limit': 3}, headers={'If-None-Match': '"other"'}).status_code == 200
+    assert client.get(url, query_string={'limit': 4}, headers={'If-None-Match': etag}).status_code == 200
+
+    with app.app_context():
+        db.session.add(StatusCheck(monitor_target_id=target_id, timestamp=BASE - timedelta(hours=1),
+                                   is_available=True, response_time=1.0))
+        db.session.commit()
+    changed = client.get(url, query_string={'limit': 3}, headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
@@ -0,0 +1,132 @@
+import pytest
+
+import matcher
+from matcher import PageScan, RuleSyntaxError, StreamScanner, compile_rule, match_text
+
+
+# 分别在使用和不使用pyahocorasick时运行
+@pytest.fixture(params=['ahocorasick', 'str'])
+def literal_backend(request, monkeypatch):
+    if request.param == 'ahocorasick':
+        if matcher.ahocorasick is None:
+            pytest.skip('pyahocorasick is not installed')
+    else:
+        monkeypatch.setattr(matcher, 'ahocorasick', None)
+    matcher.build_literal_matcher.cache_clear()
+    yield request.param
+    matcher.build_literal_matcher.cache_clear()
+
+
+def test_plain_pattern_is_case_sensitive_literal():
+    rule = compile_rule('Add to cart')
+    assert not rule.is_expression
+    assert [term.kind for term in rule.terms] == ['literal']
+    assert match_text('Add to cart', '<button>Add to cart</button>')[0]
+    assert not match_text('Add to cart', '<button>ADD TO CART</button>')[0]
+
+
+def test_plain_pattern_keeps_operators_literally():
+    # 不以 expr: 开头时 & ! 等字符只是普通文本
+    assert match_text('A & !B', 'x A & !B y')[0]
+    assert not match_text('A & !B', 'A')[0]
+
+
+def test_expression_terms():
+    rule = compile_rule('expr: "Add to cart"i & !"Out of Stock"i & !/sold\\s*out/i')
+    assert rule.is_expression
+    assert [(term.kind, term.value, term.flags) for term in rule.terms] == [
+        ('literal', 'Add to cart', 'i'), ('literal', 'Out of Stock', 'i'), ('regex', 'sold\\s*out', 'i'),
+    ]
+    assert match_text(rule.source, 'add TO cart')[0]
+    assert not match_text(rule.source, 'Add to cart - out of stock')[0]
+    assert not match_text(rule.source, 'Add to cart - SOLD  OUT')[0]
+
+
+def test_expression_keywords_and_precedence():
+    # & 优先于 |
+    rule = compile_rule('expr: a OR b AND NOT c')
+    assert rule.evaluate({rule.terms[0]})
+    assert rule.evaluate({rule.terms[1]})
+    assert not rule.evaluate({rule.terms[1], rule.terms[2]})
+    grouped = compile_rule('expr: (a | b) & !c')
+    assert not grouped.evaluate({grouped.terms[0], grouped.terms[2]})
+
+
+def test_expression_bare_words_and_escapes():
+    assert match_text('expr: 有货 & !缺货', '商品有货')[0]
+    assert not match_text('expr: 有货 & !缺货', '有货 缺货')[0]
+    assert match_text('expr: "say \\"hi\\""', 'say "hi"')[0]
+    assert match_text('expr: /a\\/b/', 'x a/b y')[0]
+
+
+@pytest.mark.parametrize('pattern', [
+    'expr: ', 'expr: a &', 'expr: (a | b', 'expr: a b', 'expr: ""', 'expr: /(/', 'expr: a )',
+])
+def test_expression_syntax_errors(pattern):
+    with pytest.raises(RuleSyntaxError):
+        compile_rule(pattern)
+
+
+def test_empty_pattern_matches_with_other_literals(literal_backend):
+    # 空的检查模式与 '' in content 一致，总是命中；同一页面上还有其他关键词时也一样
+    page = PageScan('some page', [compile_rule(''), compile_rule('page'), compile_rule('missing')])
+    assert page.evaluate(compile_rule(''))[0]
+    assert page.evaluate(compile_rule('page'))[0]
+    assert not page.evaluate(compile_rule('missing'))[0]
+
+
+def test_literal_set_matcher_backends_agree(literal_backend):
+    literals = ('', 'abc', 'bcd', 'zz')
+    assert matcher.build_literal_matcher(literals).find('xabcdx') == {'', 'abc', 'bcd'}
+
+
+def test_page_scan_shares_one_scan(literal_backend):
+    rules = [compile_rule('expr: "in stock"i'), compile_rule('Buy'), compile_rule('expr: /\\d+ left/')]
+    page = PageScan('IN STOCK - Buy now, 3 left', rules)
+    assert [page.evaluate(rule)[0] for rule in rules] == [True, True, True]
+    assert page.evaluate(rules[0])[1] == ['"in stock"i']
+
+
+def test_stream_scanner_matches_across_chunks(literal_backend):
+    scanner = StreamScanner([compile_rule('Add to cart'), compile_rule('expr: "SOLD OUT"i')])
+    assert not scanner.feed('<div>... Add to')
+    assert not scanner.feed(' cart ... sold')
+    # 全部关键词的结果确定后才能提前停止：第二条规则只有 "SOLD OUT" 一个关键词
+    assert scanner.feed(' out</div>')
+    results = scanner.finish()
+    assert all(results.values())
+
+
+def test_stream_scanner_regex_across_chunks(literal_backend):
+    scanner = StreamScanner([compile_rule('expr: /sold\\s+out/i')])
+    scanner.feed('x' * 100 + 'SOLD')
+    assert scanner.feed('   OUT')
+
+
+def test_stream_scanner_early_stop_hits(literal_backend):
+    # a 命中后 a | b 已确定，b 没有扫描到，finish后记为不存在
+    rule = compile_rule('expr: a | b')
+    scanner = StreamScanner([rule])
+    assert scanner.feed('xx a xx')
+    results = scanner.finish()
+    assert results == {rule.terms[0]: True, rule.terms[1]: False}
+    page = PageScan('xx a xx', results=results)
+    assert page.evaluate(rule) == (True, ['a'])
+
+
+def test_stream_scanner_negated_term_is_undecided_until_finish(literal_backend):
+    # !b 只有读完整个页面才能确定
+    rule = compile_rule('expr: a & !b')
+    scanner = StreamScanner([rule])
+    assert not scanner.feed('a')
+    assert not scanner.feed('cc')
+    results = scanner.finish()
+    assert PageScan('acc', results=results).evaluate(rule)[0]
+    scanner = StreamScanner([rule])
+    scanner.feed('a')
+    assert scanner.feed('b')
+    assert not PageScan('ab', results=scanner.finish()).evaluate(rule)[0]
+
+
+def test_stream_scanner_without_rules_is_decided():
+    assert StreamScanner([]).feed('anything')
@@ -0,0 +1,201 @@
+from datetime import datetime, timedelta
+
+import pytest
+import requests
+
+import monitor
+import outbox
+from outbox import NotificationConfigError, claim_batch, deliver_outbox, record_results, retry_delay
+
+
+@pytest.fixture
+def ctx(app):
+    from app import db, NotificationOutbox, NotificationSetting
+
+    with app.app_context():
+        NotificationOutbox.query.delete()
+        NotificationSetting.query.filter_by(notification_type='webhook').delete()
+        db.session.commit()
+        yield db
+        db.session.rollback()
+
+
+def add_setting(db, enabled=True):
+    from app import NotificationSetting
+
+    setting = NotificationSetting(user_id=1, notification_type='webhook', settings={'url': 'https://hooks.example/x'},
+                                  enabled=enabled)
+    db.session.add(setting)
+    db.session.commit()
+    return setting
+
+
+def add_entry(db, setting_id, key='n-1', due=None):
+    from app import NotificationOutbox
+
+    entry = NotificationOutbox(idempotency_key=key, notification_setting_id=setting_id, notification_type='webhook',
+                               payload={'title': 't', 'content': 'c', 'data': {'monitor_name': 'm'}},
+                               status='pending', attempts=0, next_attempt_at=due or datetime.utcnow())
+    db.session.add(entry)
+    db.session.commit()
+    return entry.id
+
+
+def load(db, entry_id):
+    from app import NotificationOutbox
+
+    db.session.expire_all()
+    return db.session.get(NotificationOutbox, entry_id)
+
+
+def make_due(db, entry_id):
+    entry = load(db, entry_id)
+    entry.next_attempt_at = datetime.utcnow()
+    db.session.commit()
+
+
+# 替换发送函数，记录调用并按顺序返回结果（异常实例会被抛出）
+@pytest.fixture
+def sender(monkeypatch):
+    calls = []
+    outcomes = []
+
+    def deliver(notification_type, settings, payload, idempotency_key):
+        calls.append((notification_type, settings, payload, idempotency_key))
+        outcome = outcomes.pop(0) if outcomes else None
+        if isinstance(outcome, Exception):
+            raise outcome
+
+    monkeypatch.setattr(monitor, 'deliver_notification', deliver)
+    deliver.calls = calls
+    deliver.outcomes = outcomes
+    return deliver
+
+
+# 替换 requests.post，返回指定状态码的响应
+def respond_with(monkeypatch, status_code):
+    def post(url, **kwargs):
+        response = requests.Response()
+        response.status_code = status_code
+        response.url = url
+        return response
+
+    monkeypatch.setattr(monitor.requests, 'post', post)
+
+
+def test_retry_delay_doubles_up_to_limit(monkeypatch):
+    monkeypatch.setattr(outbox, 'OUTBOX_RETRY_SECONDS', 30)
+    monkeypatch.setattr(outbox, 'OUTBOX_RETRY_MAX_SECONDS', 200)
+    assert [retry_delay(attempt) for attempt in range(1, 6)] == [30, 60, 120, 200, 200]
+
+
+def test_delivered(ctx, sender):
+    setting = add_setting(ctx)
+    entry_id = add_entry(ctx, setting.id, key='delivered-1')
+    assert deliver_outbox() == {'delivered': 1, 'retry': 0, 'dead': 0}
+    assert sender.calls == [('webhook', {'url': 'https://hooks.example/x'},
+                             {'title': 't', 'content': 'c', 'data': {'monitor_name': 'm'}}, 'delivered-1')]
+    entry = load(ctx, entry_id)
+    assert (entry.status, entry.attempts, entry.claim_token, entry.last_error) == ('delivered', 1, None, None)
+    assert entry.delivered_at is not None
+    # 已投递的通知不会再次发送
+    assert deliver_outbox() == {'delivered': 0, 'retry': 0, 'dead': 0}
+    assert len(sender.calls) == 1
+
+
+def test_retryable_failure_backs_off(ctx, sender):
+    setting = add_setting(ctx)
+    entry_id = add_entry(ctx, setting.id)
+    sender.outcomes.extend([requests.Timeout('timed out'), requests.ConnectionError('refused')])
+
+    before = datetime.utcnow()
+    assert deliver_outbox()['retry'] == 1
+    entry = load(ctx, entry_id)
+    assert (entry.status, entry.attempts, entry.last_error) == ('pending', 1, 'timed out')
+    assert entry.next_attempt_at >= before + timedelta(seconds=retry_delay(1))
+    # 未到重试时间时不会发送
+    assert deliver_outbox()['retry'] == 0
+    assert len(sender.calls) == 1
+
+    make_due(ctx, entry_id)
+    before = datetime.utcnow()
+    deliver_outbox()
+    entry = load(ctx, entry_id)
+    assert (entry.status, entry.attempts) == ('pending', 2)
+    assert entry.next_attempt_at >= before + timedelta(seconds=retry_delay(2))
+
+    make_due(ctx, entry_id)
+    assert deliver_outbox()['delivered'] == 1
+    assert load(ctx, entry_id).attempts == 3
+
+
+def test_dead_after_max_attempts(ctx, sender, monkeypatch):
+    monkeypatch.setattr(outbox, 'OUTBOX_MAX_ATTEMPTS', 2)
+    setting = add_setting(ctx)
+    entry_id = add_entry(ctx, setting.id)
+    sender.outcomes.extend([RuntimeError('boom'), RuntimeError('boom')])
+    deliver_outbox()
+    make_due(ctx, entry_id)
+    assert deliver_outbox()['dead'] == 1
+    entry = load(ctx, entry_id)
+    assert (entry.status, entry.attempts, entry.last_error) == ('dead', 2, 'boom')
+
+
+def test_config_error_is_dead_immediately(ctx, sender):
+    setting = add_setting(ctx)
+    entry_id = add_entry(ctx, setting.id)
+    sender.outcomes.append(NotificationConfigError('自定义URL通知缺少URL'))
+    assert deliver_outbox()['dead'] == 1
+    assert (load(ctx, entry_id).status, load(ctx, entry_id).attempts) == ('dead', 1)
+
+
+@pytest.mark.parametrize('enabled, delete', [(False, False), (True, True)])
+def test_disabled_or_deleted_setting_is_dead(ctx, sender, enabled, delete):
+    setting = add_setting(ctx, enabled=enabled)
+    entry_id = add_entry(ctx, setting.id)
+    if delete:
+        ctx.session.delete(setting)
+        ctx.session.commit()
+    assert deliver_outbox()['dead'] == 1
+    assert load(ctx, entry_id).status == 'dead'
+    assert sender.calls == []
+
+
+# 408、429和5xx可以重试；其他4xx说明通知配置有误，直接标记为dead
+@pytest.mark.parametrize('status_code, expected', [
+    (200, 'delivered'), (400, 'dead'), (401, 'dead'), (403, 'dead'), (404, 'dead'),
+    (408, 'pending'), (429, 'pending'), (500, 'pending'), (503, 'pending'),
+])
+def test_http_status_mapping(ctx, monkeypatch, status_code, expected):
+    respond_with(monkeypatch, status_code)
+    setting = add_setting(ctx)
+    entry_id = add_entry(ctx, setting.id)
+    deliver_outbox()
+    entry = load(ctx, entry_id)
+    assert (entry.status, entry.attempts) == (expected, 1)
+
+
+def test_claim_is_exclusive_until_lease_expires(ctx):
+    setting = add_setting(ctx)
+    first_id = add_entry(ctx, setting.id, key='claim-1')
+    add_entry(ctx, setting.id, key='claim-2', due=datetime.utcnow() + timedelta(hours=1))
+
+    token, entries = claim_batch()
+    assert [entry.id for entry, _ in entries] == [first_id]
+    assert entries[0][1] == ('webhook', {'url': 'https://hooks.example/x'}, True)
+    entry = load(ctx, first_id)
+    assert (entry.status, entry.claim_token) == ('sending', token)
+    # 投递中的通知不会被另一个批次取出
+    assert claim_batch() == (None, [])
+
+    # 投递进程退出（锁定超时）后重新取出；原批次的结果不再生效
+    entry.locked_until = datetime.utcnow() - timedelta(seconds=1)
+    ctx.session.commit()
+    new_token, reclaimed = claim_batch()
+    assert [entry.id for entry, _ in reclaimed] == [first_id]
+    assert new_token != token
+    record_results(token, entries, [(first_id, None, False)])
+    entry = load(ctx, first_id)
+    assert (entry.status, entry.claim_token) == ('sending', new_token)
+    record_results(new_token, reclaimed, [(first_id, None, False)])
+    assert load(ctx, first_id).status == 'delivered'
@@ -0,0 +1,175 @@
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+import status_board
+from status_board import SEQ, StatusBoard
+
+
+@pytest.fixture
+def board(tmp_path):
+    board = StatusBoard.create(str(tmp_path / 'board.bin'), 64)
+    yield board
+    board.close()
+
+
+def write(board, target_id, check_id, checked_at, is_available=True, force=False):
+    with board.writing():
+        return board.write(target_id, check_id, is_available, checked_at, checked_at, float(check_id), force=force)
+
+
+def test_write_and_read(board):
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    assert write(board, 5, 42, now)
+    status = board.read(5)
+    assert (status.id, status.is_available, status.response_time, status.version) == (42, True, 42.0, 1)
+    assert status.checked_at == now
+    assert board.read(6) is None
+    assert board.read_all(63) == {5: status}
+
+
+def test_older_status_does_not_overwrite(board):
+    now = datetime(2024, 1, 1, 12, 0, 0)
+    write(board, 1, 2, now)
+    assert not write(board, 1, 1, now - timedelta(minutes=5))
+    assert board.read(1).id == 2
+    assert write(board, 1, 1, now - timedelta(minutes=5), force=True)
+    assert board.read(1).id == 1
+
+
+def test_target_id_beyond_capacity(board):
+    now = datetime(2024, 1, 1)
+    assert not write(board, 64, 1, now)
+    assert board.read(64) is None
+    assert board.read(-1) is None
+
+
+def test_clear(board):
+    write(board, 3, 7, datetime(2024, 1, 1))
+    with board.writing():
+        board.clear(3)
+    assert board.read(3) is None
+    assert board.read_all(63) == {}
+
+
+# 写入线程不断写入内容一致的记录（check_id 等于响应时间），读取方不应读到写了一半的记录
+def test_concurrent_reader_never_sees_torn_record(board):
+    stop = threading.Event()
+    start = datetime(2024, 1, 1)
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            for target_id in (1, 2):
+                with board.writing():
+                    board.write(target_id, i, i % 2 == 0, start, start + timedelta(seconds=i), float(i))
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    reads = 0
+    try:
+        deadline = time.monotonic() + 0.5
+        while time.monotonic() < deadline:
+            status = board.read(1)
+            if status is not None:
+                assert status.response_time == float(status.id)
+                assert status.is_available == (status.id % 2 == 0)
+                assert status.checked_at == start + timedelta(seconds=status.id)
+                reads += 1
+            for status in (board.read_all(2) or {}).values():
+                assert status.response_time == float(status.id)
+    finally:
+        stop.set()
+        thread.join()
+    assert reads > 0
+
+
+# 写入方在写入中途被终止时序号保持为奇数：读取方有限次重试后放弃，下次写入后恢复
+def test_stuck_odd_sequence_is_bounded_and_heals(board, monkeypatch):
+    monkeypatch.setattr(status_board, 'READ_RETRIES', 50)
+    now = datetime(2024, 1, 1)
+    write(board, 4, 1, now)
+    write(board, 5, 1, now)
+    offset = board._offset(4)
+    SEQ.pack_into(board.mm, offset, SEQ.unpack_from(board.mm, offset)[0] + 1)
+
+    assert board.read(4) is None
+    assert board.read(5).id == 1
+    assert board.read_all(63) is None
+
+    write(board, 4, 2, now + timedelta(seconds=1))
+    assert SEQ.unpack_from(board.mm, offset)[0] % 2 == 0
+    assert board.read(4).id == 2
+    assert set(board.read_all(63)) == {4, 5}
+
+
+def test_writing_excludes_threads(board):
+    # 同一进程中的线程共用一个文件描述符，flock不能使它们互斥，需要线程锁
+    entered = threading.Event()
+    release = threading.Event()
+    order = []
+
+    def holder():
+        with board.writing():
+            entered.set()
+            release.wait(5)
+            order.append('holder')
+
+    thread = threading.Thread(target=holder)
+    thread.start()
+    entered.wait(5)
+
+    def waiter():
+        with board.writing():
+            order.append('waiter')
+
+    thread2 = threading.Thread(target=waiter)
+    thread2.start()
+    thread2.join(0.2)
+    assert order == []
+    release.set()
+    thread.join()
+    thread2.join(5)
+    assert order == ['holder', 'waiter']
+
+
+def test_reopen_and_replace(board):
+    write(board, 1, 9, datetime(2024, 1, 1))
+    reopened = StatusBoard.open(board.path)
+    assert reopened.read(1).id == 9
+    replacement = StatusBoard.create(board.path, 128)
+    assert board.stale()
+    assert not replacement.stale()
+    assert replacement.capacity == 128
+    assert replacement.read(1) is None
+    reopened.close()
+    replacement.close()
+
+
+# 目标ID超出容量时改为查询数据库；以更大的容量重建后重新使用状态板
+def test_rebuild_grows_capacity(app):
+    from app import db, MonitorTarget, StatusCheck
+
+    with app.app_context():
+        targets = [MonitorTarget(name=f'board-{i}', url=f'https://board{i}.example/') for i in range(3)]
+        db.session.add_all(targets)
+        db.session.flush()
+        for target in targets:
+            db.session.add(StatusCheck(monitor_target_id=target.id, is_available=True, response_time=1.0))
+        db.session.commit()
+        max_id = max(target.id for target in targets)
+
+        small = status_board.rebuild_board(capacity=max_id)
+        assert small.capacity == max_id
+        assert status_board.board_targets() is None
+
+        large = status_board.rebuild_board(capacity=max_id + 16)
+        assert large.capacity == max_id + 16
+        assert not small.ready
+        listing = {target.id: target for target in status_board.board_targets()}
+        for target in targets:
+            assert listing[target.id].latest_status.id == target.latest_check_id
+            assert listing[target.id].latest_status.is_available